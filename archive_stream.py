@@ -0,0 +1,64 @@
+# archive_stream.py
+import os
+import zipfile
+import rarfile
+import py7zr
+
+def _extract_zip_members(archive_path, extract_dir):
+    with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+        for info in zip_ref.infolist():
+            if not info.is_dir():
+                yield zip_ref.extract(info, extract_dir)
+
+def _extract_rar_members(archive_path, extract_dir):
+    with rarfile.RarFile(archive_path, 'r') as rar_ref:
+        for info in rar_ref.infolist():
+            if not info.is_dir():
+                yield rar_ref.extract(info, extract_dir)
+
+def _extract_7z_members(archive_path, extract_dir):
+    with py7zr.SevenZipFile(archive_path, mode='r') as z_ref:
+        names = [f.filename for f in z_ref.list() if not f.is_directory]
+        if z_ref.archiveinfo().solid:
+            # Solid blocks can only be decoded front to back, so member-by-member
+            # extraction would re-decode the archive for every file.
+            z_ref.extractall(path=extract_dir)
+            for name in names:
+                yield os.path.join(extract_dir, name)
+            return
+        for name in names:
+            z_ref.extract(path=extract_dir, targets=[name])
+            z_ref.reset()
+            yield os.path.join(extract_dir, name)
+
+def archive_extraction_sizes(archive_path: str) -> list[int]:
+    """Uncompressed bytes written by each successive step of `iter_archive_members`, read from the archive headers."""
+    lowered = archive_path.lower()
+    if lowered.endswith('.zip'):
+        with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+            return [info.file_size for info in zip_ref.infolist() if not info.is_dir()]
+    if lowered.endswith('.rar'):
+        with rarfile.RarFile(archive_path, 'r') as rar_ref:
+            return [info.file_size for info in rar_ref.infolist() if not info.is_dir()]
+    if lowered.endswith('.7z'):
+        with py7zr.SevenZipFile(archive_path, mode='r') as z_ref:
+            sizes = [f.uncompressed for f in z_ref.list() if not f.is_directory]
+            if z_ref.archiveinfo().solid and sizes:
+                # The first step extracts everything.
+                return [sum(sizes)] + [0] * (len(sizes) - 1)
+            return sizes
+    raise ValueError(f"Unsupported archive type: {os.path.basename(archive_path)}")
+
+def iter_archive_members(archive_path: str, extract_dir: str):
+    """
+    Extracts an archive one member at a time, yielding each extracted file path as
+    soon as it is on disk. Each `next()` blocks, so drive it from a worker thread.
+    """
+    lowered = archive_path.lower()
+    if lowered.endswith('.zip'):
+        return _extract_zip_members(archive_path, extract_dir)
+    if lowered.endswith('.rar'):
+        return _extract_rar_members(archive_path, extract_dir)
+    if lowered.endswith('.7z'):
+        return _extract_7z_members(archive_path, extract_dir)
+    raise ValueError(f"Unsupported archive type: {os.path.basename(archive_path)}")
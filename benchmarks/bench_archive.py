@@ -0,0 +1,83 @@
+# benchmarks/bench_archive.py
+import os
+import shutil
+import subprocess
+import tempfile
+import zipfile
+import py7zr
+import pytest
+
+import config
+from conftest import measure
+from archive_stream import archive_extraction_sizes, iter_archive_members
+
+MEMBERS = 2000
+MEMBER_SIZE = 16 * 1024
+NESTED_ARCHIVES = 20
+
+def _write_members(directory, count, size):
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        with open(os.path.join(directory, f"member_{i:05d}.bin"), "wb") as f:
+            f.write(os.urandom(size))
+
+def _zip_directory(source_dir, archive_path):
+    with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_STORED) as zf:
+        for name in sorted(os.listdir(source_dir)):
+            zf.write(os.path.join(source_dir, name), name)
+
+@pytest.fixture(scope="module")
+def archives(tmp_path_factory):
+    root = tmp_path_factory.mktemp("archives")
+    members_dir = str(root / "members")
+    _write_members(members_dir, MEMBERS, MEMBER_SIZE)
+
+    paths = {"zip": str(root / "many.zip"), "7z": str(root / "many.7z")}
+    _zip_directory(members_dir, paths["zip"])
+    with py7zr.SevenZipFile(paths["7z"], "w") as z:
+        z.writeall(members_dir, arcname="")
+
+    # An outer zip holding NESTED_ARCHIVES inner zips of MEMBERS / NESTED_ARCHIVES members each.
+    nested_dir = root / "nested"
+    nested_dir.mkdir()
+    per_archive = MEMBERS // NESTED_ARCHIVES
+    for n in range(NESTED_ARCHIVES):
+        inner_members = str(root / f"inner_{n}")
+        _write_members(inner_members, per_archive, MEMBER_SIZE)
+        _zip_directory(inner_members, str(nested_dir / f"inner_{n:02d}.zip"))
+    paths["nested"] = str(root / "nested.zip")
+    _zip_directory(str(nested_dir), paths["nested"])
+
+    if shutil.which("rar"):
+        paths["rar"] = str(root / "many.rar")
+        subprocess.run(["rar", "a", "-m0", "-ep", "-idq", paths["rar"], members_dir + os.sep], check=True)
+    return paths
+
+def _extract(archive_path):
+    """Drains iter_archive_members like stream_archive does, expanding nested archives depth first."""
+    extract_dir = tempfile.mkdtemp(prefix="bench_extract_")
+    extracted = 0
+    try:
+        pending = [archive_path]
+        while pending:
+            for member in iter_archive_members(pending.pop(), extract_dir):
+                if member.lower().endswith(config.ARCHIVE_EXTENSIONS):
+                    pending.append(member)
+                else:
+                    extracted += 1
+                    os.remove(member) # Members are deleted once uploaded
+    finally:
+        shutil.rmtree(extract_dir, ignore_errors=True)
+    return extracted
+
+@pytest.mark.parametrize("kind", ["zip", "7z", "rar", "nested"])
+def bench_extract(benchmark, archives, kind):
+    if kind not in archives:
+        pytest.skip("the rar command line tool is needed to create RAR fixtures")
+    extracted = measure(benchmark, _extract, archives[kind], nbytes=MEMBERS * MEMBER_SIZE, rounds=3)
+    assert extracted == MEMBERS
+
+@pytest.mark.parametrize("kind", ["zip", "7z"])
+def bench_archive_extraction_sizes(benchmark, archives, kind):
+    sizes = measure(benchmark, archive_extraction_sizes, archives[kind])
+    assert sum(sizes) == MEMBERS * MEMBER_SIZE
@@ -0,0 +1,35 @@
+# benchmarks/bench_content_hash.py
+import io
+import os
+import pytest
+
+from conftest import MB, measure
+from content_hash import FrontierHashingReader, MerkleRootHasher
+
+DATA_SIZE = 64 * MB
+READ_SIZE = 512 * 1024
+
+@pytest.fixture(scope="module")
+def data():
+    return os.urandom(DATA_SIZE)
+
+def _hash_direct(data):
+    hasher = MerkleRootHasher()
+    view = memoryview(data)
+    for offset in range(0, len(data), READ_SIZE):
+        hasher.update(view[offset:offset + READ_SIZE])
+    return hasher.digest()
+
+def _hash_while_reading(data):
+    reader = FrontierHashingReader(io.BytesIO(data), MerkleRootHasher(), len(data))
+    buffer = bytearray(READ_SIZE)
+    while reader.readinto(buffer):
+        pass
+    return reader.hasher.digest()
+
+def bench_merkle_root(benchmark, data):
+    measure(benchmark, _hash_direct, data, nbytes=len(data), rounds=5)
+
+def bench_merkle_root_upload_reader(benchmark, data):
+    root = measure(benchmark, _hash_while_reading, data, nbytes=len(data), rounds=5)
+    assert root == _hash_direct(data)
@@ -0,0 +1,41 @@
+# benchmarks/bench_file_slice.py
+import pytest
+
+from conftest import MB, measure
+from file_slice import FileSlice, plan_file_parts
+
+GB = 1024 * MB
+PART_SIZE = 2000 * MB # telegram_uploader.MAX_FILE_SIZE_BYTES
+READ_SIZE = 512 * 1024 # Telethon's part size
+
+@pytest.fixture(scope="module")
+def sparse_file(tmp_path_factory):
+    """A 5 GB sparse file: three parts at the 2000 MB limit, no real disk usage."""
+    path = tmp_path_factory.mktemp("sparse") / "movie.mkv"
+    with open(path, "wb") as f:
+        f.truncate(5 * GB)
+    return str(path)
+
+def _read_all(part):
+    with part.open() as stream:
+        buffer = bytearray(READ_SIZE)
+        while stream.readinto(buffer):
+            pass
+
+def _read_all_pread(part):
+    with FileSlice(part.path, part.offset, part.length, part.name, use_mmap=False) as stream:
+        buffer = bytearray(READ_SIZE)
+        while stream.readinto(buffer):
+            pass
+
+def bench_plan_file_parts(benchmark, sparse_file):
+    parts = measure(benchmark, plan_file_parts, sparse_file, PART_SIZE)
+    assert len(parts) == 3
+
+def bench_read_part_mmap(benchmark, sparse_file):
+    part = plan_file_parts(sparse_file, PART_SIZE)[1] # Unaligned offset, full-size window
+    measure(benchmark, _read_all, part, nbytes=part.length, rounds=3)
+
+def bench_read_part_pread(benchmark, sparse_file):
+    part = plan_file_parts(sparse_file, PART_SIZE)[1]
+    measure(benchmark, _read_all_pread, part, nbytes=part.length, rounds=3)
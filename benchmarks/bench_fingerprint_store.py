@@ -0,0 +1,117 @@
+# benchmarks/bench_fingerprint_store.py
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import pytest
+
+from conftest import measure
+from fingerprint_store import FingerprintStore
+
+SIZES = [10**3, 10**4, 10**5, 10**6]
+LOOKUPS = 1000 # Fingerprints checked per call, about one large torrent's worth of files
+
+def _fingerprints(start: int, count: int):
+    return [(f"Some.Show.S01E{i:07d}.1080p.WEB-DL.mkv", 1_000_000 + i) for i in range(start, start + count)]
+
+@pytest.fixture(scope="module", params=SIZES, ids=lambda n: f"{n:.0e}")
+def index(request, tmp_path_factory):
+    """Two copies of an index with `n` fingerprints: one closed cleanly (Bloom filter persisted), one not."""
+    n = request.param
+    root = tmp_path_factory.mktemp(f"index_{n}")
+    raw_path = str(root / "raw.db")
+    store = FingerprintStore(raw_path)
+    store.open()
+    store.import_fingerprints(_fingerprints(0, n))
+    asyncio.run(store.close(persist_bloom=False))
+
+    persisted_path = str(root / "persisted.db")
+    shutil.copyfile(raw_path, persisted_path)
+    store = FingerprintStore(persisted_path)
+    store.open()
+    asyncio.run(store.close())
+
+    json_path = str(root / "channel_index.json")
+    with open(json_path, "w") as f:
+        json.dump(_fingerprints(0, n), f)
+    return {"n": n, "root": root, "raw": raw_path, "persisted": persisted_path, "json": json_path}
+
+def _close_all(stores):
+    for store in stores:
+        asyncio.run(store.close(persist_bloom=False)) # Leave the saved Bloom filter as it was
+
+def _measure_open(benchmark, db_path):
+    stores = []
+
+    def open_store():
+        store = FingerprintStore(db_path)
+        store.open()
+        stores.append(store)
+
+    try:
+        measure(benchmark, open_store, rounds=3)
+    finally:
+        _close_all(stores)
+
+def bench_open_rebuild_bloom(benchmark, index):
+    _measure_open(benchmark, index["raw"])
+
+def bench_open_persisted_bloom(benchmark, index):
+    _measure_open(benchmark, index["persisted"])
+
+def _contains_all(store, fingerprints):
+    async def check():
+        return sum([await store.contains(fingerprint) for fingerprint in fingerprints])
+    return asyncio.run(check())
+
+@pytest.fixture
+def opened(index):
+    store = FingerprintStore(index["persisted"])
+    store.open()
+    yield store
+    _close_all([store])
+
+def bench_contains_hit(benchmark, index, opened):
+    step = max(1, index["n"] // LOOKUPS)
+    fingerprints = _fingerprints(0, index["n"])[::step][:LOOKUPS]
+    assert measure(benchmark, _contains_all, opened, fingerprints) == len(fingerprints)
+
+def bench_contains_miss(benchmark, index, opened):
+    fingerprints = _fingerprints(index["n"], LOOKUPS)
+    assert measure(benchmark, _contains_all, opened, fingerprints) == 0
+
+def bench_add_and_flush(benchmark, index, opened):
+    batches = itertools.count(index["n"], LOOKUPS)
+
+    def add_and_flush(fingerprints):
+        for fingerprint in fingerprints:
+            opened.add(fingerprint)
+        asyncio.run(opened.flush())
+
+    measure(benchmark, add_and_flush, setup=lambda: (_fingerprints(next(batches), LOOKUPS),), rounds=5)
+
+def bench_migrate_json_index(benchmark, index):
+    """The legacy channel_index.json load path, now a one-off import into SQLite."""
+    rounds = itertools.count()
+    stores = []
+
+    def fresh_copy():
+        directory = index["root"] / f"migrate_{next(rounds)}"
+        directory.mkdir()
+        json_path = str(directory / "channel_index.json")
+        shutil.copyfile(index["json"], json_path)
+        store = FingerprintStore(str(directory / "index.db"))
+        store.open()
+        stores.append(store)
+        return store, json_path
+
+    def migrate(store, json_path):
+        added = store.migrate_json_index(json_path)
+        os.remove(json_path + ".migrated")
+        return added
+
+    try:
+        assert measure(benchmark, migrate, setup=fresh_copy, rounds=3) == index["n"]
+    finally:
+        _close_all(stores)
@@ -0,0 +1,61 @@
+# benchmarks/bench_status_panel.py
+import asyncio
+from types import SimpleNamespace
+import libtorrent as lt
+import pytest
+
+from conftest import measure
+from state import AppState, TorrentInfoCache, new_torrent_data
+from status_panel import create_progress_bar, format_bytes, format_time, render_status_panel
+
+PANELS = 200 # Active torrents rendered per call
+
+class _Info:
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+class _Handle:
+    """Stands in for a removed torrent's handle; a cache miss renders the info-hash instead of the name."""
+    def is_valid(self):
+        return False
+
+@pytest.fixture(scope="module")
+def app_state():
+    """An AppState with PANELS torrents whose info and status snapshots are already cached."""
+    async def build():
+        return AppState(torrent_info_cache=TorrentInfoCache(max_entries=PANELS))
+    state = asyncio.run(build())
+    for i in range(PANELS):
+        info_hash_str = f"{i:040x}"
+        torrent_data = new_torrent_data(handle=_Handle())
+        torrent_data["details_visible"] = i % 2 == 0
+        torrent_data["jobs_total"] = 40
+        torrent_data["jobs_completed"] = i % 40
+        state.active_torrents[info_hash_str] = torrent_data
+        state.torrent_info_cache.put(info_hash_str, _Info(f"Some.Show.S{i:02d}.1080p.WEB-DL"))
+        state.torrent_status[info_hash_str] = SimpleNamespace(
+            state=lt.torrent_status.states.downloading, progress=(i % 100) / 100,
+            download_rate=12_345_678, upload_rate=234_567, num_peers=42,
+            total_wanted=40 * 1024**3, total_wanted_done=(i % 100) * 400 * 1024**2,
+        )
+    return state
+
+def _format_many(values):
+    for value in values:
+        format_bytes(value)
+        format_time(value / 1_000_000)
+        create_progress_bar((value % 1000) / 1000)
+
+def bench_formatters(benchmark):
+    values = [17 ** (i % 12) + i for i in range(10_000)]
+    measure(benchmark, _format_many, values)
+
+def _render_all(app_state):
+    for info_hash_str in app_state.active_torrents:
+        render_status_panel(app_state, info_hash_str, "Uploading: Some.Show.S01E01.1080p.WEB-DL.mkv")
+
+def bench_render_status_panel(benchmark, app_state):
+    measure(benchmark, _render_all, app_state)
@@ -0,0 +1,50 @@
+# benchmarks/bench_upload_ordering.py
+import asyncio
+import random
+import pytest
+
+from conftest import measure
+from fingerprint_store import FingerprintStore
+from state import AppState, new_torrent_data
+from telegram_uploader import deposit_records, flush_upload_buffer
+
+INFO_HASH = "0" * 40
+
+class _NullTelethonClient:
+    """Accepts every post instantly, so only the reordering and bookkeeping are timed."""
+    async def send_file(self, *args, **kwargs):
+        return None
+
+_CLIENT = _NullTelethonClient()
+
+def _record(file_index: int) -> dict:
+    return {"client": _CLIENT, "input_file": None, "force_document": True, "attributes": [],
+            "name": f"file_{file_index:05d}.mkv", "size": 1_000_000 + file_index}
+
+async def _publish_shuffled(files: int, arrival_order: list[int]) -> int:
+    app_state = AppState(channel_file_index=FingerprintStore(":memory:"))
+    app_state.channel_file_index.open()
+    torrent_data = new_torrent_data(handle=None)
+    torrent_data["upload_order"] = list(range(files))
+    torrent_data["upload_position"] = {idx: idx for idx in range(files)}
+    torrent_data["jobs_total"] = files + 1 # One job left over keeps the torrent out of the cleanup path
+    app_state.active_torrents[INFO_HASH] = torrent_data
+    app_state.torrent_locks[INFO_HASH] = asyncio.Lock()
+
+    for file_index in arrival_order:
+        await deposit_records(app_state, INFO_HASH, file_index, [_record(file_index)])
+        await flush_upload_buffer(None, app_state, INFO_HASH, session=None)
+    return torrent_data["jobs_completed"]
+
+def _run(files: int, arrival_order: list[int]) -> int:
+    return asyncio.run(_publish_shuffled(files, arrival_order))
+
+@pytest.mark.parametrize("files", [100, 1000, 5000])
+def bench_flush_upload_buffer_shuffled(benchmark, files):
+    arrival_order = list(range(files))
+    random.Random(files).shuffle(arrival_order)
+    assert measure(benchmark, _run, files, arrival_order, rounds=5) == files
+
+@pytest.mark.parametrize("files", [1000])
+def bench_flush_upload_buffer_in_order(benchmark, files):
+    assert measure(benchmark, _run, files, list(range(files)), rounds=5) == files
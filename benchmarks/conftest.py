@@ -0,0 +1,43 @@
+# benchmarks/conftest.py
+import os
+import sys
+import tracemalloc
+
+# config.py refuses to import without credentials; the benchmarks never talk to Telegram.
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("TARGET_CHAT_ID", "0")
+os.environ.setdefault("TELEGRAM_API_ID", "0")
+os.environ.setdefault("TELEGRAM_API_HASH", "benchmark")
+os.environ.setdefault("METRICS_PORT", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MB = 1024 * 1024
+
+def measure(benchmark, function, *args, nbytes: int | None = None, rounds: int | None = None, setup=None):
+    """
+    Runs `function(*args)` under pytest-benchmark, then once more under tracemalloc.
+    Peak memory and (given `nbytes` per call) throughput are added to the report.
+    With `setup`, each round gets fresh arguments from `setup()` instead of `args`.
+    """
+    if rounds is not None or setup is not None:
+        if setup is not None:
+            result = benchmark.pedantic(function, setup=lambda: (setup(), {}), rounds=rounds or 5)
+        else:
+            result = benchmark.pedantic(function, args=args, rounds=rounds, iterations=1)
+    else:
+        result = benchmark(function, *args)
+
+    tracemalloc.start()
+    try:
+        function(*(setup() if setup is not None else args))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info["peak_memory_mb"] = round(peak / MB, 3)
+
+    if nbytes is not None and benchmark.stats is not None:
+        mean = benchmark.stats.stats.mean
+        if mean > 0:
+            benchmark.extra_info["throughput_mb_s"] = round(nbytes / MB / mean, 1)
+    return result
@@ -1,25 +1,56 @@
 import asyncio
 import math
 import os
+import shutil
 import libtorrent as lt
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.error import BadRequest
 
 import config
-from state import AppState
-from telegram_uploader import refresh_status_panel
+from state import AppState, new_torrent_data
+from status_panel import refresh_status_panel
+from torrent_client import get_torrent_info, torrent_file_root
+from metadata_cache import MagnetResolver, cached_torrent_path, metadata_key, store_torrent_file
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Welcome! Send me a .torrent file to start.")
+    await update.message.reply_text("Welcome! Send me a .torrent file or a magnet link to start.")
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Send a .torrent file. I will show you the contents, and you can choose what to download and upload.")
+    await update.message.reply_text("Send a .torrent file or a magnet link. I will show you the contents, and you can choose what to download and upload.")
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE, app_state: AppState, session):
     if not update.message:
         return
-    await update.message.reply_text("Invalid input. Please send a .torrent file.")
+    text = (update.message.text or "").strip()
+    if not text.startswith("magnet:?"):
+        await update.message.reply_text("Invalid input. Please send a .torrent file or a magnet link.")
+        return
+
+    try:
+        info_hash_str = MagnetResolver.info_hash_of(text)
+    except Exception:
+        await update.message.reply_text("Invalid magnet link.")
+        return
+    if not os.path.exists(cached_torrent_path(info_hash_str)):
+        await update.message.reply_text("🔎 Fetching torrent metadata from peers...")
+    # Updates are handled one at a time; a fetch of up to MAGNET_METADATA_TIMEOUT must not hold up the others.
+    context.application.create_task(_open_magnet(update, context, app_state, session, text, info_hash_str), update=update)
+
+async def _open_magnet(update: Update, context: ContextTypes.DEFAULT_TYPE, app_state: AppState, session, text: str, info_hash_str: str):
+    try:
+        cached_path = await app_state.magnet_resolver.resolve(session, text, app_state.trackers.top(config.TRACKERS_PER_TORRENT))
+    except asyncio.TimeoutError:
+        await update.message.reply_text("❌ Could not fetch the torrent metadata in time. Please try again later.")
+        return
+    except Exception as e:
+        await update.message.reply_text(f"Error fetching torrent metadata: {e}")
+        return
+
+    # process_torrent_file owns (and eventually deletes) its copy; the cached file stays.
+    file_path = os.path.join("temp", f"magnet_{info_hash_str}.torrent")
+    await asyncio.to_thread(shutil.copyfile, cached_path, file_path)
+    await process_torrent_file(update, context, app_state, session, file_path)
 
 async def handle_torrent_file(update: Update, context: ContextTypes.DEFAULT_TYPE, app_state: AppState, session):
     file = await context.bot.get_file(update.message.document.file_id)
@@ -34,35 +65,24 @@ async def process_torrent_file(update: Update, context: ContextTypes.DEFAULT_TYP
         
         if info_hash_str not in app_state.torrent_metadata_cache:
             app_state.torrent_metadata_cache[info_hash_str] = file_path
+        app_state.torrent_info_cache.put(info_hash_str, info)
         
-        params = {'ti': info, 'save_path': './downloads/'}
-        handle = session.add_torrent(params)
+        await asyncio.to_thread(store_torrent_file, metadata_key(info.info_hashes()), file_path)
         
-        for tracker in config.PUBLIC_TRACKERS:
+        # A magnet's metadata fetch leaves a stopped handle behind; reuse it rather than adding a duplicate.
+        handle = session.find_torrent(info.info_hashes().get_best())
+        if not handle.is_valid():
+            params = {'ti': info, 'save_path': './downloads/'}
+            handle = session.add_torrent(params)
+        
+        for tracker in app_state.trackers.top(config.TRACKERS_PER_TORRENT):
             handle.add_tracker({'url': tracker})
         
         handle.pause()
         handle.unset_flags(lt.torrent_flags.auto_managed)
         
         if info_hash_str not in app_state.active_torrents:
-            app_state.active_torrents[info_hash_str] = {
-                "handle": handle, 
-                "files_to_download": {}, 
-                "download_complete_files": [], 
-                "successfully_uploaded_files": [], 
-                "status_message_id": None, 
-                "user_chat_id": None,
-                "jobs_total": 0, 
-                "jobs_completed": 0, 
-                "seeding_paused": False,
-                "details_visible": False, 
-                "selection_mode": False, 
-                "selection": set(),
-                # --- NEW: Sequencing State ---
-                "upload_order": [],       # List of file indices in the correct order
-                "current_upload_idx": 0,  # Pointer to the current index in upload_order
-                "ready_buffer": {}        # Storage for processed files waiting for their turn
-            }
+            app_state.active_torrents[info_hash_str] = new_torrent_data(handle)
             app_state.torrent_locks[info_hash_str] = asyncio.Lock()
         
         await display_torrent_info(update, context, app_state, info, handle, info_hash_str)
@@ -162,11 +182,10 @@ async def _handle_archive_prompt(update: Update, context: ContextTypes.DEFAULT_T
 
 async def _handle_pagination(update: Update, context: ContextTypes.DEFAULT_TYPE, app_state: AppState, info_hash_str: str, value: str):
     query = update.callback_query
-    torrent_file_path = app_state.torrent_metadata_cache.get(info_hash_str)
-    if not torrent_file_path:
+    info = await get_torrent_info(app_state, info_hash_str)
+    if not info:
         await query.edit_message_text(text="Error: Torrent metadata has expired."); return
     
-    info = await asyncio.to_thread(lt.torrent_info, torrent_file_path)
     handle = app_state.active_torrents.get(info_hash_str, {}).get("handle")
     if not handle:
         await query.edit_message_text(text="Error: This torrent is not active."); return
@@ -176,14 +195,14 @@ async def _handle_pagination(update: Update, context: ContextTypes.DEFAULT_TYPE,
 
 async def _handle_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, app_state: AppState, session, info_hash_str: str, indices: list, extract: bool):
     query = update.callback_query
-    torrent_file_path = app_state.torrent_metadata_cache.get(info_hash_str)
-    if not torrent_file_path:
+    info = await get_torrent_info(app_state, info_hash_str)
+    if not info:
         await query.edit_message_text(text="Error: Torrent metadata has expired."); return
 
-    info = await asyncio.to_thread(lt.torrent_info, torrent_file_path)
     files = info.files()
     
     files_to_queue, total_size, skipped_files = [], 0, []
+    post_processing_bytes = 0 # Largest extraction/transcode output among the queued files
     
     torrent_data = app_state.active_torrents[info_hash_str]
 
@@ -197,13 +216,28 @@ async def _handle_selection(update: Update, context: ContextTypes.DEFAULT_TYPE,
         is_archive = filename.lower().endswith(config.ARCHIVE_EXTENSIONS)
         should_extract_this_file = extract and is_archive
 
-        if not should_extract_this_file and (filename, filesize) in app_state.channel_file_index:
+        if should_extract_this_file:
+            already_in_channel = False
+        else:
+            # Content roots (v2 torrents) are exact; name and size are only a fallback for v1 metadata.
+            content_root = torrent_file_root(info, index)
+            if content_root is not None:
+                already_in_channel = await app_state.channel_file_index.has_content(content_root)
+            else:
+                already_in_channel = await app_state.channel_file_index.contains((filename, filesize))
+
+        if already_in_channel:
             skipped_files.append(filename)
         else:
             files_to_queue.append(index)
             total_size += filesize
+            if should_extract_this_file:
+                post_processing_bytes = max(post_processing_bytes, int(filesize * config.ARCHIVE_EXPANSION_RATIO))
+            elif filename.lower().endswith(config.VIDEO_EXTENSIONS):
+                post_processing_bytes = max(post_processing_bytes, filesize)
             torrent_data["files_to_download"][index] = {"extract": should_extract_this_file}
             # --- FIX: Add to the ordered list of uploads ---
+            torrent_data["upload_position"][index] = len(torrent_data["upload_order"])
             torrent_data["upload_order"].append(index)
 
     response_message = ""
@@ -212,7 +246,8 @@ async def _handle_selection(update: Update, context: ContextTypes.DEFAULT_TYPE,
         
         await app_state.download_queue.put({
             "info_hash": info_hash_str, "file_indices": files_to_queue, 
-            "total_size": total_size, "chat_id": update.effective_chat.id
+            "total_size": total_size, "post_processing_bytes": post_processing_bytes,
+            "chat_id": update.effective_chat.id
         })
         app_state.new_download_event.set()
         response_message += f"✅ Queued {len(files_to_queue)} file(s) ({total_size / (1024*1024):.2f} MB) for download.\n"
@@ -243,11 +278,6 @@ async def _handle_cancellation(update: Update, context: ContextTypes.DEFAULT_TYP
         print(f"Cancelling torrent: {info_hash_str}")
         handle = torrent_data["handle"]
 
-        jobs = context.job_queue.get_jobs_by_name(f"job_{info_hash_str}")
-        for job in jobs:
-            job.schedule_removal()
-            print(f"Removed job: {job.name}")
-
         if handle.is_valid():
             await asyncio.to_thread(session.remove_torrent, handle, session.delete_files)
 
@@ -256,10 +286,7 @@ async def _handle_cancellation(update: Update, context: ContextTypes.DEFAULT_TYP
             if os.path.exists(temp_torrent_path):
                 await asyncio.to_thread(os.remove, temp_torrent_path)
         
-        if info_hash_str in app_state.active_torrents:
-            del app_state.active_torrents[info_hash_str]
-        if info_hash_str in app_state.torrent_locks:
-            del app_state.torrent_locks[info_hash_str]
+        app_state.forget_torrent(info_hash_str)
 
     await query.edit_message_text("✅ **Cancelled:** The torrent has been stopped and all associated files have been deleted.")
     print(f"Successfully cancelled and cleaned up torrent: {info_hash_str}")
@@ -277,7 +304,10 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, ap
         await query.edit_message_text("This torrent is no longer active.")
         return
     
-    info = await asyncio.to_thread(lt.torrent_info, app_state.torrent_metadata_cache[info_hash_str])
+    info = await get_torrent_info(app_state, info_hash_str)
+    if not info:
+        await query.edit_message_text(text="Error: Torrent metadata has expired.")
+        return
     handle = torrent_data["handle"] if torrent_data else None
     
     page = 0
@@ -297,7 +327,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, ap
         await _handle_selection(update, context, app_state, session, info_hash_str, indices, extract)
     elif action == "details":
         torrent_data["details_visible"] = not torrent_data["details_visible"]
-        await refresh_status_panel(context.bot, app_state, info_hash_str, "Toggled details view")
+        await refresh_status_panel(context.bot, app_state, info_hash_str, None, urgent=True)
     elif action == "cancel":
         await _handle_cancellation(update, context, app_state, session, info_hash_str)
     elif action == "processall":
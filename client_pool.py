@@ -0,0 +1,56 @@
+# client_pool.py
+import asyncio
+import contextlib
+import os
+from telethon import TelegramClient
+
+import config
+
+class UploadClientPool:
+    """
+    Telethon clients used for uploads, each its own session and MTProto connection with
+    its own limits: UPLOAD_SESSIONS_PER_TOKEN sessions for the bot token and for every
+    token in UPLOAD_BOT_TOKENS. `lease()` hands out the least-loaded client. Uploaded
+    parts belong to the session that sent them, so a file must be published by the
+    client that uploaded it.
+    """
+    def __init__(self, sessions_dir: str):
+        self.clients = []   # (client, bot token, label)
+        tokens = [config.TELEGRAM_BOT_TOKEN] + config.UPLOAD_BOT_TOKENS
+        for token_index, token in enumerate(tokens):
+            for session_index in range(max(1, config.UPLOAD_SESSIONS_PER_TOKEN)):
+                # The first client keeps the original session file, so existing logins carry over.
+                name = "bot_session" if token_index == session_index == 0 else f"upload_{token_index}_{session_index}"
+                client = TelegramClient(os.path.join(sessions_dir, name), config.TELEGRAM_API_ID, config.TELEGRAM_API_HASH)
+                self.clients.append((client, token, name))
+        self.load = [0] * len(self.clients) # Part workers currently running on each client
+
+    async def start(self):
+        """Starts every client; extra clients that fail to log in are dropped, the primary must start."""
+        results = await asyncio.gather(*(client.start(bot_token=token) for client, token, _ in self.clients), return_exceptions=True)
+        if isinstance(results[0], BaseException):
+            raise results[0]
+        started = []
+        for (client, token, name), result in zip(self.clients, results):
+            if isinstance(result, BaseException):
+                print(f"Telethon: Could not start upload client {name}: {result}")
+                continue
+            started.append((client, token, name))
+        self.clients = started
+        self.load = [0] * len(started)
+        print(f"Telethon: {len(started)} upload client(s) started.")
+
+    @contextlib.asynccontextmanager
+    async def lease(self, weight: int = 1):
+        """`async with pool.lease(workers) as client:` runs on the client with the fewest part workers in flight."""
+        index = min(range(len(self.clients)), key=self.load.__getitem__)
+        self.load[index] += weight
+        try:
+            yield self.clients[index][0]
+        finally:
+            self.load[index] -= weight
+
+    async def disconnect(self):
+        for client, _, _ in self.clients:
+            if client.is_connected():
+                await client.disconnect()
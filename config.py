@@ -27,22 +27,65 @@ if not TELEGRAM_API_HASH:
 
 # --- Application Constants ---
 FILES_PER_PAGE = 10
+TORRENT_INFO_CACHE_SIZE = 32 # Parsed torrent metadata kept in memory for the file browser
 STORAGE_BUFFER_GB = 2.0
+DOWNLOAD_ADMISSION_INTERVAL = 30 # Seconds between admission re-checks even without a wake-up (external disk changes)
+DOWNLOAD_STARVATION_SECONDS = 1800 # A queued download older than this gets its space reserved ahead of smaller jobs
+ARCHIVE_EXPANSION_RATIO = 1.2 # Extracted/compressed size assumed at admission, before the archive's headers can be read
 VIDEO_EXTENSIONS = ('.mkv', '.mp4', '.avi', '.mov', '.webm')
 IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
 AUDIO_EXTENSIONS = ('.mp3', '.flac', '.wav', '.ogg', '.m4a')
 ARCHIVE_EXTENSIONS = ('.zip', '.rar', '.7z')
 
 # --- PERFORMANCE TUNING ---
+LIBTORRENT_PROFILE = os.getenv("LIBTORRENT_PROFILE", "balanced") # balanced, seedbox or vps (see torrent_client.SESSION_PROFILES)
+SESSION_STATE_FILE = os.path.join("sessions", "libtorrent.state") # DHT routing table kept across restarts
+METRICS_HOST = "127.0.0.1" # Prometheus endpoint is local-only
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464")) # 0 disables the /metrics endpoint
+METRICS_STATS_INTERVAL = 10 # Seconds between libtorrent session_stats samples
+TRACE_DIR = os.getenv("TRACE_DIR", "") # Per-torrent timeline traces (Chrome/Perfetto JSON) are written here; empty disables tracing
 NUM_UPLOAD_WORKERS = 5 
+ALERT_POLL_INTERVAL = 1.0 # Seconds between libtorrent alert pumps
+ARCHIVE_LOOKAHEAD = 4 # Archive members extracted ahead of the upload (bounds temp disk usage)
+UPLOAD_REORDER_WINDOW = 8 # Files that may be transferred ahead of the next one to publish
+RESUME_DIR = "resume" # libtorrent resume data and pipeline positions, restored on startup
+RESUME_SAVE_INTERVAL = 60 # Seconds between resume data checkpoints
+METADATA_CACHE_DIR = "metadata_cache" # .torrent files keyed by info-hash, shared by magnets and uploads
+MAGNET_FETCH_CONCURRENCY = 4 # Magnet metadata fetches running at once
+MAGNET_METADATA_TIMEOUT = 120 # Seconds to wait for a magnet's metadata from peers
 
-# Telethon Internal Tuning
-TELETHON_UPLOAD_WORKERS = 4 
-TELETHON_PART_SIZE_KB = 2048 
+# Video encode pool (independent of upload workers)
+ENCODE_CORE_BUDGET = os.cpu_count() or 1 # Cores shared by all concurrent libx264 encodes
+ENCODE_MAX_JOBS = 2 # Concurrent full encodes; each gets ENCODE_CORE_BUDGET // ENCODE_MAX_JOBS threads
+ENCODE_NICENESS = 10 # Added to the encoder's nice value so uploads and the bot stay responsive
+ENCODE_SEGMENT_THREADS = 4 # libx264 threads per parallel segment; a job runs threads_per_job // this many segments
+ENCODE_SEGMENT_MIN_DURATION = 600 # Seconds; shorter videos are encoded in a single process
+
+# Status panel edit budgets (Telegram flood limits)
+PANEL_EDIT_INTERVAL = 5 # Minimum seconds between edits of the same panel
+PANEL_CHAT_EDITS_PER_MINUTE = 20
+PANEL_GLOBAL_EDITS_PER_SECOND = 25
+
+# Telethon Internal Tuning (starting points and bounds for part_uploader.UploadTuner)
+TELETHON_UPLOAD_WORKERS = 4 # Parallel part requests per file before any throughput is measured
+TELETHON_MAX_UPLOAD_WORKERS = 16
+TELETHON_PART_SIZE_KB = 512 # MTProto maximum
+TELETHON_MIN_PART_SIZE_KB = 32
+TELETHON_PART_TIMEOUT = 60 # Seconds before a part request counts as timed out
+TELETHON_PART_RETRIES = 5 # Attempts per part before the transfer attempt fails
+UPLOAD_RETRY_BUDGET = int(os.getenv("UPLOAD_RETRY_BUDGET", "5")) # Attempts per file transfer (resuming from acknowledged parts) and per publish
+UPLOAD_RETRY_BASE_DELAY = 5 # Seconds before the second attempt, doubled for each further one
+UPLOAD_RETRY_MAX_DELAY = 300
+UPLOAD_SESSIONS_PER_TOKEN = int(os.getenv("UPLOAD_SESSIONS_PER_TOKEN", "1")) # Telethon sessions (MTProto connections) per bot used for uploads
+UPLOAD_BOT_TOKENS = [t.strip() for t in os.getenv("UPLOAD_BOT_TOKENS", "").split(",") if t.strip()] # Extra upload bots; each must be able to post to TARGET_CHAT_ID
 # --------------------------
 
 TRACKER_URLS = [
     "https://raw.githubusercontent.com/ngosang/trackerslist/master/trackers_best.txt",
     "https://raw.githubusercontent.com/ngosang/trackerslist/master/trackers_all_udp.txt"
 ]
-PUBLIC_TRACKERS = []
+TRACKER_CACHE_FILE = "trackers.json" # Fetched tracker lists and their health scores
+TRACKER_CACHE_TTL = 24 * 3600 # Seconds before the tracker lists are fetched again
+TRACKER_FETCH_TIMEOUT = 30 # Seconds per tracker list download
+TRACKER_SAVE_INTERVAL = 600 # Seconds between health score checkpoints (and staleness checks)
+TRACKERS_PER_TORRENT = 20 # Healthiest public trackers attached to each torrent
@@ -0,0 +1,101 @@
+# content_hash.py
+import hashlib
+import io
+
+BLOCK_SIZE = 16 * 1024 # BitTorrent v2 leaf size
+_PAD_HASHES = [bytes(32)] # Root of an all-padding subtree, per level
+for _ in range(64):
+    _PAD_HASHES.append(hashlib.sha256(_PAD_HASHES[-1] * 2).digest())
+
+class MerkleRootHasher:
+    """
+    Incremental BitTorrent v2 "pieces root" (BEP 52) of a single file: SHA-256 over
+    16 KiB blocks, combined pairwise, with zero hashes padding the tree to a power of
+    two leaves. Only one pending subtree per level is kept, so memory stays O(log n).
+    """
+    def __init__(self):
+        self.size = 0
+        self._buffer = bytearray()
+        self._stack = [] # (level, digest), levels strictly decreasing
+
+    def update(self, data):
+        self.size += len(data)
+        self._buffer += data
+        if len(self._buffer) < BLOCK_SIZE:
+            return
+        view = memoryview(self._buffer)
+        offset = 0
+        while len(self._buffer) - offset >= BLOCK_SIZE:
+            self._push(self._stack, 0, hashlib.sha256(view[offset:offset + BLOCK_SIZE]).digest())
+            offset += BLOCK_SIZE
+        view.release()
+        del self._buffer[:offset]
+
+    @staticmethod
+    def _push(stack, level, digest):
+        while stack and stack[-1][0] == level:
+            _, left = stack.pop()
+            digest = hashlib.sha256(left + digest).digest()
+            level += 1
+        stack.append((level, digest))
+
+    def digest(self) -> bytes | None:
+        """The 32-byte pieces root, or None for an empty file (v2 gives those no root)."""
+        if self.size == 0:
+            return None
+        stack = list(self._stack)
+        if self._buffer:
+            self._push(stack, 0, hashlib.sha256(self._buffer).digest())
+        level, digest = stack.pop()
+        while stack:
+            # Pad the right-most subtree up to its left neighbour's height, then merge.
+            while level < stack[-1][0]:
+                digest = hashlib.sha256(digest + _PAD_HASHES[level]).digest()
+                level += 1
+            _, left = stack.pop()
+            digest = hashlib.sha256(left + digest).digest()
+            level += 1
+        return digest
+
+class FrontierHashingReader(io.RawIOBase):
+    """
+    Passes reads through to `raw` and feeds every byte to `hasher` exactly once, in
+    file order. Re-reads behind the hashed frontier are ignored; a read that skips
+    past it leaves the hash incomplete (see `complete`).
+    """
+    def __init__(self, raw, hasher: MerkleRootHasher, length: int):
+        super().__init__()
+        self.raw = raw
+        self.hasher = hasher
+        self.length = length
+        self.name = getattr(raw, 'name', None)
+        self._frontier = 0
+
+    @property
+    def complete(self) -> bool:
+        return self._frontier >= self.length
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return self.raw.seekable()
+
+    def readinto(self, buffer) -> int:
+        position = self.raw.tell()
+        n = self.raw.readinto(buffer)
+        if n and position <= self._frontier < position + n:
+            skip = self._frontier - position
+            self.hasher.update(memoryview(buffer)[skip:n])
+            self._frontier = position + n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self.raw.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.raw.tell()
+
+    def close(self):
+        self.raw.close()
+        super().close()
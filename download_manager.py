@@ -1,18 +1,24 @@
 import asyncio
 import os
-import shutil
+import time
 import libtorrent as lt
-from telegram.ext import Application, ContextTypes
+from telegram.ext import Application
 
 import config
-from state import AppState
-from telegram_uploader import refresh_status_panel
+import resume_store
+import tracing
+from metadata_cache import metadata_key
+from state import AppState, new_torrent_data
+from status_panel import refresh_status_panel
+from metrics import STAGE_SECONDS
+from telegram_uploader import finish_torrent, purge_deferred_deletes
 
 async def start_download_job(app: Application, app_state: AppState, session, item: dict):
     info_hash_str = item["info_hash"]
     torrent_data = app_state.active_torrents.get(info_hash_str)
     if not torrent_data: return
 
+    tracing.end(info_hash_str, None, "waiting for space")
     torrent_data['user_chat_id'] = item["chat_id"]
     if not torrent_data.get('status_message_id'):
         info = torrent_data["handle"].torrent_file()
@@ -21,117 +27,362 @@ async def start_download_job(app: Application, app_state: AppState, session, ite
         await refresh_status_panel(app.bot, app_state, info_hash_str, "Waiting for available space...")
 
 
+    reservation = torrent_data.get("download_reservation")
+    if reservation is None:
+        torrent_data["download_reservation"] = app_state.storage_ledger.reserve_now(info_hash_str, "download", item["total_size"])
+    else:
+        reservation.resize(reservation.nbytes + item["total_size"])
     handle = torrent_data["handle"]
     files = handle.torrent_file().files()
-    priorities = [1 if i in torrent_data["files_to_download"].keys() else 0 for i in range(files.num_files())]
+    # Files already handed to the upload pipeline may be published and deleted; a recheck must not fetch them again.
+    wanted = torrent_data["files_to_download"].keys() - torrent_data["enqueued_files"]
+    torrent_data["admitted_bytes"] = sum(files.file_size(i) for i in wanted) # What total_wanted reports once applied
+    priorities = [1 if i in wanted else 0 for i in range(files.num_files())]
     handle.prioritize_files(priorities)
+    if tracing.ENABLED:
+        tracing.name_torrent(info_hash_str, handle.torrent_file().name())
+        tracing.begin(info_hash_str, None, "download")
+        for i in torrent_data["files_to_download"]:
+            if i not in torrent_data["enqueued_files"]:
+                tracing.name_file(info_hash_str, i, os.path.basename(files.file_path(i)))
+                tracing.begin(info_hash_str, i, "download")
+    # The alert pump pauses the torrent again (and queues uploads) once the new selection is complete.
+    torrent_data["seeding_paused"] = False
+    torrent_data["download_started_at"] = time.monotonic()
     handle.resume()
 
-    job_name = f"job_{info_hash_str}"
-    if not app.job_queue.get_jobs_by_name(job_name):
-        job_data = {"info_hash": info_hash_str, "app_state": app_state, "session": session}
-        app.job_queue.run_repeating(monitor_download, interval=10, first=0, data=job_data, name=job_name)
+def _enqueue_completed_file(app_state: AppState, info_hash_str: str, torrent_data: dict, info, file_index: int):
+    """Hands a fully downloaded file to the upload pipeline, at most once per file."""
+    file_options = torrent_data["files_to_download"].get(file_index)
+    if file_options is None or file_index in torrent_data["enqueued_files"]:
+        return
+
+    full_path = os.path.join("./downloads", info.files().file_path(file_index))
+    print(f"File '{os.path.basename(full_path)}' completed. Adding to upload queue.")
+    app_state.upload_queue.put_nowait({
+        "path": full_path,
+        "info_hash": info_hash_str,
+        "extract": file_options.get("extract", False),
+        "file_index": file_index
+    })
+    torrent_data["enqueued_files"].add(file_index)
+    tracing.name_file(info_hash_str, file_index, os.path.basename(full_path))
+    tracing.end(info_hash_str, file_index, "download")
+    tracing.begin(info_hash_str, file_index, "queued")
 
-# --- NEW: Background task to queue files ---
-async def queue_files_for_upload(app_state, info_hash_str, torrent_data, info):
-    """Iterates through files and adds them to the upload queue in the background."""
+def _enqueue_remaining_files(app_state: AppState, info_hash_str: str, torrent_data: dict, info):
+    """Catches selected files that were already complete and therefore never raised file_completed."""
+    remaining = [i for i in torrent_data["files_to_download"] if i not in torrent_data["enqueued_files"]]
+    if not remaining: return
+
+    progress = torrent_data["handle"].file_progress(flags=lt.torrent_handle.piece_granularity)
     files = info.files()
-    for i in list(torrent_data["files_to_download"].keys()):
-        full_path = os.path.join("./downloads", files.file_path(i))
-        
-        if os.path.exists(full_path) and full_path not in torrent_data["download_complete_files"]:
-            print(f"File '{os.path.basename(full_path)}' confirmed stable. Adding to upload queue.")
-            
-            file_options = torrent_data["files_to_download"][i]
-            should_extract = file_options.get("extract", False)
-            
-            await app_state.upload_queue.put({
-                "path": full_path,
-                "info_hash": info_hash_str,
-                "extract": should_extract,
-                "file_index": i
-            })
-            
-            torrent_data["download_complete_files"].append(full_path)
-# -------------------------------------------
-
-async def monitor_download(context: ContextTypes.DEFAULT_TYPE):
-    job_data = context.job.data
-    info_hash_str = job_data["info_hash"]
-    app_state: AppState = job_data["app_state"]
-    session = job_data["session"]
-    
-    torrent_data = app_state.active_torrents.get(info_hash_str)
-    if not torrent_data:
-        context.job.schedule_removal()
-        return
+    for i in remaining:
+        if progress[i] >= files.file_size(i):
+            _enqueue_completed_file(app_state, info_hash_str, torrent_data, info, i)
 
-    handle = torrent_data["handle"]
-    if not handle.is_valid():
-        context.job.schedule_removal()
-        return
+_CHECKING_STATES = (
+    lt.torrent_status.states.queued_for_checking,
+    lt.torrent_status.states.checking_files,
+    lt.torrent_status.states.checking_resume_data,
+)
 
-    status = handle.status()
-    info = handle.torrent_file()
+def _info_hash_of(handle) -> str:
+    return str(handle.info_hashes().v1)
+
+def _on_download_finished(app_state: AppState, info_hash_str: str, torrent_data: dict):
+    handle = torrent_data["handle"]
+    info = app_state.torrent_info_cache.get(info_hash_str) or handle.torrent_file()
     if not info: return
 
-    if status.state == lt.torrent_status.error:
-        error_msg = status.error_message() if status.error_message() else "Unknown error"
-        print(f"CRITICAL ERROR for '{info.name()}': {error_msg}. Stopping job.")
-        await refresh_status_panel(context.bot, app_state, info_hash_str, f"❌ Download Failed: {error_msg}", is_final=True)
+    _enqueue_remaining_files(app_state, info_hash_str, torrent_data, info)
+
+    print(f"Download complete for '{info.name()}'. Pausing torrent to stop seeding.")
+    started_at = torrent_data.pop("download_started_at", None)
+    if started_at is not None:
+        STAGE_SECONDS.labels("download").observe(time.monotonic() - started_at)
+    tracing.end(info_hash_str, None, "download")
+    handle.pause()
+    torrent_data["seeding_paused"] = True
+    reservation = torrent_data.pop("download_reservation", None)
+    if reservation:
+        reservation.release()
+    purge_deferred_deletes(torrent_data)
+
+async def _on_download_failed(app: Application, app_state: AppState, session, info_hash_str: str, torrent_data: dict, error_msg: str):
+    handle = torrent_data["handle"]
+    print(f"CRITICAL ERROR for torrent {info_hash_str}: {error_msg}. Stopping job.")
+    await refresh_status_panel(app.bot, app_state, info_hash_str, f"❌ Download Failed: {error_msg}", is_final=True)
+    if handle.is_valid():
         session.remove_torrent(handle, lt.session.delete_files)
-        
-        if info_hash_str in app_state.torrent_metadata_cache:
-            temp_torrent_path = app_state.torrent_metadata_cache.pop(info_hash_str)
-            if os.path.exists(temp_torrent_path): os.remove(temp_torrent_path)
-        
-        del app_state.active_torrents[info_hash_str]
-        context.job.schedule_removal()
+
+    if info_hash_str in app_state.torrent_metadata_cache:
+        temp_torrent_path = app_state.torrent_metadata_cache.pop(info_hash_str)
+        if os.path.exists(temp_torrent_path): os.remove(temp_torrent_path)
+
+    app_state.forget_torrent(info_hash_str)
+
+async def _dispatch_alert(app: Application, app_state: AppState, session, alert):
+    if isinstance(alert, lt.save_resume_data_alert):
+        if str(alert.params.info_hashes.v1) in app_state.active_torrents:
+            await asyncio.to_thread(resume_store.write_resume_data, alert)
         return
 
-    await refresh_status_panel(context.bot, app_state, info_hash_str, "Downloading...")
+    if isinstance(alert, lt.session_stats_alert):
+        app_state.session_stats.update(alert.values)
+        return
+    if isinstance(alert, lt.tracker_reply_alert):
+        app_state.trackers.record_reply(alert.tracker_url())
+        return
+    if isinstance(alert, lt.tracker_error_alert):
+        app_state.trackers.record_error(alert.tracker_url())
+        return
 
-    if status.state in (lt.torrent_status.seeding, lt.torrent_status.finished):
-        # --- FIX: Offload the heavy queuing logic to a background task ---
-        # This prevents the monitor job from blocking the event loop
-        asyncio.create_task(queue_files_for_upload(app_state, info_hash_str, torrent_data, info))
-        # -----------------------------------------------------------------
-        
-        if not torrent_data.get("seeding_paused"):
-            print(f"Download complete for '{info.name()}'. Pausing torrent to stop seeding.")
-            handle.pause()
-            torrent_data["seeding_paused"] = True
+    if isinstance(alert, lt.metadata_received_alert):
+        app_state.magnet_resolver.metadata_received(metadata_key(alert.handle.info_hashes()), alert.handle)
+        return
+
+    if isinstance(alert, lt.state_update_alert):
+        for status in alert.status:
+            info_hash_str = _info_hash_of(status.handle)
+            app_state.torrent_status[info_hash_str] = status
+
+            torrent_data = app_state.active_torrents.get(info_hash_str)
+            if not torrent_data or not torrent_data.get("files_to_download"):
+                continue
+            reservation = torrent_data.get("download_reservation")
+            if reservation and status.total_wanted >= torrent_data.get("admitted_bytes", 0):
+                # Written bytes already show up as used disk space; keep only what is still to come.
+                reservation.resize(status.total_wanted - status.total_wanted_done)
+            if torrent_data.get("resync_files") and status.state not in _CHECKING_STATES:
+                # Restored from resume data: files completed before the restart raise no file_completed alert.
+                del torrent_data["resync_files"]
+                info = app_state.torrent_info_cache.get(info_hash_str) or status.handle.torrent_file()
+                if info:
+                    _enqueue_remaining_files(app_state, info_hash_str, torrent_data, info)
+            if status.is_finished and not torrent_data.get("seeding_paused") and not status.paused:
+                _on_download_finished(app_state, info_hash_str, torrent_data)
+            elif not torrent_data.get("seeding_paused"):
+                # Once uploads have started, keep showing their progress and only refresh the download stats.
+                current_task = None if torrent_data["enqueued_files"] else "Downloading..."
+                await refresh_status_panel(app.bot, app_state, info_hash_str, current_task)
+        return
+
+    if not isinstance(alert, (lt.file_completed_alert, lt.torrent_finished_alert, lt.torrent_error_alert)):
+        return
+
+    info_hash_str = _info_hash_of(alert.handle)
+    torrent_data = app_state.active_torrents.get(info_hash_str)
+    if not torrent_data:
+        return
+
+    if isinstance(alert, lt.file_completed_alert):
+        info = app_state.torrent_info_cache.get(info_hash_str) or alert.handle.torrent_file()
+        if info:
+            _enqueue_completed_file(app_state, info_hash_str, torrent_data, info, alert.index)
+    elif isinstance(alert, lt.torrent_finished_alert):
+        if torrent_data.get("files_to_download") and not torrent_data.get("seeding_paused"):
+            _on_download_finished(app_state, info_hash_str, torrent_data)
+    else:
+        error_msg = alert.error.message() or "Unknown error"
+        await _on_download_failed(app, app_state, session, info_hash_str, torrent_data, error_msg)
+
+async def alert_pump_worker(app: Application, app_state: AppState, session):
+    """
+    Single consumer of libtorrent alerts. Keeps a status snapshot per torrent in
+    `app_state.torrent_status` and reacts to completion and error events, so no
+    other code needs to poll `handle.status()`.
+    """
+    print("Alert pump worker started.")
+    last_stats = 0.0
+    while True:
+        try:
+            session.post_torrent_updates()
+            if config.METRICS_PORT and time.monotonic() - last_stats >= config.METRICS_STATS_INTERVAL:
+                session.post_session_stats()
+                last_stats = time.monotonic()
+            for alert in session.pop_alerts():
+                await _dispatch_alert(app, app_state, session, alert)
+        except Exception as e:
+            print(f"Error in alert_pump_worker: {e}")
+        await asyncio.sleep(config.ALERT_POLL_INTERVAL)
+
+def _file_on_disk(files, file_index: int) -> bool:
+    path = os.path.join("./downloads", files.file_path(file_index))
+    return os.path.exists(path) and os.path.getsize(path) == files.file_size(file_index)
+
+def _file_complete_in(have_pieces, files, file_index: int) -> bool:
+    piece_length = files.piece_length()
+    first = files.file_offset(file_index) // piece_length
+    last = (files.file_offset(file_index) + max(files.file_size(file_index), 1) - 1) // piece_length
+    return last < len(have_pieces) and all(have_pieces[first:last + 1])
+
+def restore_torrents(app_state: AppState, session) -> int:
+    """
+    Re-adds the torrents checkpointed in RESUME_DIR from their resume data, so their payload
+    is trusted instead of hash-checked. Published files are deprioritized, unpublished ones
+    re-enter the pipeline, and unfinished downloads go back through admission.
+    """
+    restored = 0
+    for info_hash_str, resume_data, state in resume_store.load_all():
+        try:
+            params = lt.read_resume_data(resume_data)
+        except Exception as e:
+            print(f"Discarding corrupt resume data for {info_hash_str}: {e}")
+            resume_store.discard(info_hash_str)
+            continue
+        if params.ti is None:
+            print(f"Resume data for {info_hash_str} has no metadata; skipping.")
+            continue
+
+        files = params.ti.files()
+        published = set(state["upload_order"][:state["current_upload_idx"]])
+        pending = [i for i in state["upload_order"] if i not in published]
+        # A file that was transferred but never published is deleted already; its pieces must be verified again.
+        needs_recheck = any(
+            _file_complete_in(params.have_pieces, files, i) and not _file_on_disk(files, i) for i in pending
+        )
+
+        params.save_path = './downloads/'
+        params.file_priorities = [1 if i in pending else 0 for i in range(files.num_files())]
+        params.flags |= lt.torrent_flags.paused
+        params.flags &= ~lt.torrent_flags.auto_managed
+        handle = session.add_torrent(params)
+        if needs_recheck:
+            handle.force_recheck()
+
+        torrent_data = new_torrent_data(handle)
+        torrent_data.update({
+            "files_to_download": state["files_to_download"],
+            "enqueued_files": published,
+            "upload_order": state["upload_order"],
+            "upload_position": {index: pos for pos, index in enumerate(state["upload_order"])},
+            "current_upload_idx": state["current_upload_idx"],
+            "jobs_total": state["jobs_total"],
+            "jobs_completed": state["jobs_completed"],
+            "seeding_paused": state["seeding_paused"] and not needs_recheck,
+            "user_chat_id": state["user_chat_id"],
+            "status_message_id": state["status_message_id"],
+            "resync_files": True,
+        })
+        app_state.active_torrents[info_hash_str] = torrent_data
+        app_state.torrent_locks[info_hash_str] = asyncio.Lock()
+        app_state.torrent_info_cache.put(info_hash_str, params.ti)
+
+        if not torrent_data["seeding_paused"] and pending:
+            app_state.download_queue.put_nowait({
+                "info_hash": info_hash_str, "file_indices": pending,
+                "total_size": sum(files.file_size(i) for i in pending),
+                "chat_id": state["user_chat_id"]
+            })
+            app_state.new_download_event.set()
+        restored += 1
+    return restored
+
+def _job_cost(job: dict) -> int:
+    """Peak bytes a download job needs: its files plus the largest post-processing output."""
+    return job["total_size"] + job.get("post_processing_bytes", 0)
+
+def _select_admissions(pending: list, available_space: int, reserved_space: int, now: float) -> list:
+    """
+    Shortest-fit admission: smaller jobs that fit start first, so one large job cannot
+    block the queue. A job waiting longer than DOWNLOAD_STARVATION_SECONDS gets aged in:
+    the oldest such job is admitted as soon as it fits, and until then its size is
+    reserved so smaller jobs cannot keep consuming the space it is waiting for. Space is
+    only held back for a job that fits once the current reservations (`reserved_space`)
+    are released; one that needs more waits like any other job instead of blocking them.
+    """
+    admitted = []
+    candidates = list(pending)
+    starving = [
+        p for p in candidates
+        if now - p["queued_at"] >= config.DOWNLOAD_STARVATION_SECONDS
+        and _job_cost(p["job"]) <= available_space + reserved_space
+    ]
+    if starving:
+        oldest = min(starving, key=lambda p: p["queued_at"])
+        candidates.remove(oldest)
+        if _job_cost(oldest["job"]) <= available_space:
+            admitted.append(oldest)
+        available_space -= _job_cost(oldest["job"])
+
+    for entry in sorted(candidates, key=lambda p: (_job_cost(p["job"]), p["queued_at"])):
+        if _job_cost(entry["job"]) <= available_space:
+            admitted.append(entry)
+            available_space -= _job_cost(entry["job"])
+    return admitted
+
+async def _reject_download_job(app: Application, app_state: AppState, session, job: dict, capacity: int):
+    """
+    Withdraws a selection that needs more space than the disk has, and tells the user.
+    A torrent left with no other work is torn down like a completed one.
+    """
+    info_hash_str = job["info_hash"]
+    tracing.end(info_hash_str, None, "waiting for space")
+    lock = app_state.torrent_locks.get(info_hash_str)
+    if lock:
+        async with lock:
+            torrent_data = app_state.active_torrents.get(info_hash_str)
+            if torrent_data:
+                rejected = set(job["file_indices"])
+                for index in rejected:
+                    torrent_data["files_to_download"].pop(index, None)
+                torrent_data["upload_order"] = [i for i in torrent_data["upload_order"] if i not in rejected]
+                torrent_data["upload_position"] = {index: pos for pos, index in enumerate(torrent_data["upload_order"])}
+                torrent_data["jobs_total"] -= len(rejected)
+                if torrent_data["jobs_completed"] >= torrent_data["jobs_total"]:
+                    await finish_torrent(app, app_state, info_hash_str, session)
+
+    print(f"Download {info_hash_str} needs {_job_cost(job)} bytes but the disk only holds {capacity}. Rejecting.")
+    next_step = "Select fewer files." if info_hash_str in app_state.active_torrents else "Send the torrent again to select fewer files."
+    await app.bot.send_message(
+        chat_id=job["chat_id"],
+        text=f"❌ The {len(job['file_indices'])} selected file(s) need {_job_cost(job) / (1024**3):.2f} GB of disk space, "
+             f"more than this server can ever provide ({capacity / (1024**3):.2f} GB). {next_step}"
+    )
 
 async def download_manager_worker(app: Application, app_state: AppState, session):
+    """
+    Admits queued download jobs against the storage ledger. Wakes whenever a job is queued
+    or a reservation is released, and re-checks every DOWNLOAD_ADMISSION_INTERVAL seconds.
+    """
     print("Download manager worker started.")
+    pending = app_state.pending_downloads
     while True:
-        await app_state.new_download_event.wait()
+        try:
+            await asyncio.wait_for(app_state.new_download_event.wait(), timeout=config.DOWNLOAD_ADMISSION_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        app_state.new_download_event.clear()
 
-        if app_state.download_queue.empty():
-            app_state.new_download_event.clear()
+        while not app_state.download_queue.empty():
+            job = app_state.download_queue.get_nowait()
+            pending.append({"job": job, "queued_at": time.monotonic()})
+            tracing.begin(job["info_hash"], None, "waiting for space")
+        # Jobs of cancelled torrents are simply dropped.
+        pending[:] = [p for p in pending if p["job"]["info_hash"] in app_state.active_torrents]
+        if not pending:
             continue
 
         try:
-            total, used, free = await asyncio.to_thread(shutil.disk_usage, '.')
-            committed_space = 0
-            for data in app_state.active_torrents.values():
-                if data["handle"].is_valid():
-                    s = data["handle"].status()
-                    if not s.state == lt.torrent_status.seeding:
-                        committed_space += s.total_wanted - s.total_wanted_done
-            
-            buffer = config.STORAGE_BUFFER_GB * (1024**3)
-            effective_available_space = free - committed_space - buffer
-            
-            next_item = app_state.download_queue._queue[0]
-            
-            if next_item["total_size"] <= effective_available_space:
-                print(f"Sufficient space for download {next_item['info_hash']}. Starting...")
-                job_to_start = await app_state.download_queue.get()
-                await start_download_job(app, app_state, session, job_to_start)
-            else:
-                print(f"Insufficient space for download {next_item['info_hash']}. Waiting for space to free up.")
-                app_state.new_download_event.clear()
+            capacity = await app_state.storage_ledger.capacity()
+            for entry in [p for p in pending if _job_cost(p["job"]) > capacity]:
+                pending.remove(entry)
+                await _reject_download_job(app, app_state, session, entry["job"], capacity)
+
+            # Free space minus everything reserved by running downloads, extractions and transcodes.
+            effective_available_space = await app_state.storage_ledger.available()
+
+            admitted = _select_admissions(
+                pending, effective_available_space, app_state.storage_ledger.reserved, time.monotonic()
+            )
+            for entry in admitted:
+                pending.remove(entry)
+                job = entry["job"]
+                print(f"Sufficient space for download {job['info_hash']}. Starting...")
+                await start_download_job(app, app_state, session, job)
+            if len(pending) > 0:
+                print(f"{len(pending)} download(s) waiting for space to free up.")
         
         except Exception as e:
             print(f"Error in download_manager_worker: {e}")
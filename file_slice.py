@@ -0,0 +1,109 @@
+# file_slice.py
+import io
+import mmap
+import os
+from dataclasses import dataclass
+
+@dataclass(frozen=True)
+class FilePart:
+    """A byte window of a larger file that is uploaded as its own part (e.g. `movie.mkv.001`)."""
+    path: str
+    offset: int
+    length: int
+    name: str
+
+    def open(self) -> "FileSlice":
+        return FileSlice(self.path, self.offset, self.length, self.name)
+
+def plan_file_parts(file_path: str, max_part_size: int) -> list[FilePart]:
+    """Cuts a file into consecutive windows of at most `max_part_size` bytes without touching the disk."""
+    file_size = os.path.getsize(file_path)
+    base_name = os.path.basename(file_path)
+    return [
+        FilePart(file_path, offset, min(max_part_size, file_size - offset), f"{base_name}.{part_num:03d}")
+        for part_num, offset in enumerate(range(0, file_size, max_part_size), start=1)
+    ]
+
+class FileSlice(io.RawIOBase):
+    """
+    Seekable, read-only stream over [offset, offset + length) of a file.
+    Reads are served from a memory map of just that window; if the window
+    cannot be mapped (or `use_mmap` is off), it falls back to positional reads.
+    """
+    def __init__(self, path: str, offset: int, length: int, name: str | None = None, use_mmap: bool = True):
+        super().__init__()
+        self.name = name or os.path.basename(path)
+        self._offset = offset
+        self._length = length
+        self._pos = 0
+        self._file = open(path, 'rb')
+        self._map = None
+        self._view = None
+        if length > 0 and use_mmap:
+            aligned_offset = offset - offset % mmap.ALLOCATIONGRANULARITY
+            delta = offset - aligned_offset
+            try:
+                self._map = mmap.mmap(self._file.fileno(), delta + length, access=mmap.ACCESS_READ, offset=aligned_offset)
+                if hasattr(self._map, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    self._map.madvise(mmap.MADV_SEQUENTIAL)
+                self._view = memoryview(self._map)[delta:delta + length]
+            except (OSError, ValueError, OverflowError):
+                self._map = None
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def __len__(self) -> int:
+        return self._length
+
+    def readinto(self, buffer) -> int:
+        remaining = self._length - self._pos
+        if remaining <= 0:
+            return 0
+        n = min(len(buffer), remaining)
+        view = self._view
+        if view is not None:
+            buffer[:n] = view[self._pos:self._pos + n]
+        else:
+            data = os.pread(self._file.fileno(), n, self._offset + self._pos)
+            n = len(data)
+            buffer[:n] = data
+        self._pos += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            new_pos = offset
+        elif whence == io.SEEK_CUR:
+            new_pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            new_pos = self._length + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if new_pos < 0:
+            raise ValueError("Negative seek position")
+        self._pos = new_pos
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self):
+        if self._view is not None:
+            try:
+                self._view.release()
+            except BufferError:
+                pass
+            self._view = None
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass # A read still holds a slice of the map; it is unmapped once that slice is gone
+            self._map = None
+        if not self._file.closed:
+            self._file.close()
+        super().close()
@@ -0,0 +1,258 @@
+# fingerprint_store.py
+import asyncio
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_DB_FILE = "channel_index.db"
+FLUSH_INTERVAL_SECONDS = 2.0
+CHECKPOINT_INTERVAL_SECONDS = 600.0 # How often the writer folds the WAL back into the database and truncates it
+BLOOM_ERROR_RATE = 0.001
+BLOOM_MIN_CAPACITY = 100_000
+
+class BloomFilter:
+    """Fixed-size Bloom filter over fingerprint keys (no false negatives)."""
+    def __init__(self, capacity: int, error_rate: float = BLOOM_ERROR_RATE, bits: bytes | None = None):
+        self.capacity = max(capacity, 1)
+        self.num_bits = max(64, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        size = (self.num_bits + 7) // 8
+        if bits is not None and len(bits) == size:
+            self.bits = bytearray(bits)
+        else:
+            self.bits = bytearray(size)
+
+    def _positions(self, key: bytes):
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        m = self.num_bits
+        return [(h1 + i * h2) % m for i in range(self.num_hashes)]
+
+    def add(self, key: bytes):
+        bits = self.bits
+        for pos in self._positions(key):
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: bytes) -> bool:
+        bits = self.bits
+        for pos in self._positions(key):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+def _key(fingerprint: tuple) -> bytes:
+    filename, filesize = fingerprint
+    return f"{filename}\0{int(filesize)}".encode('utf-8', 'surrogatepass')
+
+class FingerprintStore:
+    """
+    Durable set of (filename, filesize) fingerprints for files already in the channel,
+    plus the content roots (BitTorrent v2 pieces roots) of uploaded torrent files.
+
+    Backed by SQLite in WAL mode. Lookups go through an in-memory Bloom filter first,
+    so misses never touch the database. New fingerprints are buffered in memory and
+    written in batches from a worker thread by `run_writer()`.
+    """
+    def __init__(self, db_path: str = DEFAULT_DB_FILE):
+        self.db_path = db_path
+        self._conn: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+        self._bloom = BloomFilter(BLOOM_MIN_CAPACITY)
+        self._count = 0
+        self._pending: dict[tuple, None] = {}
+        self._pending_content: dict[bytes, None] = {}
+        self._flush_event = asyncio.Event()
+
+    # --- Opening / migration (startup, synchronous) ---
+    def open(self):
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            "filename TEXT NOT NULL, filesize INTEGER NOT NULL, "
+            "PRIMARY KEY (filename, filesize)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS content (root BLOB PRIMARY KEY) WITHOUT ROWID")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        self._conn.commit()
+
+        self._count = self._get_meta('count')
+        if self._count is None:
+            self._count = self._conn.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+            self._set_meta('count', self._count)
+            self._conn.commit()
+
+        capacity = self._get_meta('bloom_capacity')
+        blob = self._get_meta('bloom_bits')
+        if blob is not None and capacity and self._get_meta('bloom_count') == self._count and self._count <= capacity:
+            self._bloom = BloomFilter(capacity, bits=blob)
+        else:
+            self._rebuild_bloom()
+
+    def migrate_json_index(self, json_path: str) -> int:
+        """Imports a legacy channel_index.json once and renames it out of the way."""
+        if not os.path.exists(json_path):
+            return 0
+        with open(json_path, 'r') as f:
+            data = json.load(f) if os.path.getsize(json_path) > 0 else []
+        added = self.import_fingerprints(data)
+        os.replace(json_path, json_path + ".migrated")
+        return added
+
+    def import_fingerprints(self, fingerprints) -> int:
+        """Writes a bulk of fingerprints straight to the database (startup only) and returns how many were new."""
+        added = self._write_batch([(filename, int(filesize)) for filename, filesize in fingerprints])
+        self._rebuild_bloom()
+        return added
+
+    def _get_meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _build_bloom(self) -> BloomFilter:
+        """A filter sized for twice the stored fingerprints, filled from the database. Safe off the loop."""
+        with self._db_lock:
+            bloom = BloomFilter(max(BLOOM_MIN_CAPACITY, self._count * 2))
+            for row in self._conn.execute("SELECT filename, filesize FROM fingerprints"):
+                bloom.add(_key(row))
+        return bloom
+
+    def _install_bloom(self, bloom: BloomFilter):
+        """Swaps in a rebuilt filter, adding the buffered fingerprints the database does not have yet."""
+        for fingerprint in self._pending:
+            bloom.add(_key(fingerprint))
+        self._bloom = bloom
+
+    def _rebuild_bloom(self):
+        self._install_bloom(self._build_bloom())
+
+    # --- Membership ---
+    def __len__(self) -> int:
+        return self._count + len(self._pending)
+
+    def _exists(self, query: str, params: tuple) -> bool:
+        with self._db_lock:
+            if self._conn is None:
+                return False
+            return self._conn.execute(query, params).fetchone() is not None
+
+    async def contains(self, fingerprint) -> bool:
+        """
+        Misses are answered by the Bloom filter on the event loop; possible hits are confirmed
+        by a query in a worker thread, since the writer may hold the database for a whole batch.
+        """
+        fingerprint = (fingerprint[0], int(fingerprint[1]))
+        if fingerprint in self._pending:
+            return True
+        if _key(fingerprint) not in self._bloom:
+            return False
+        return await asyncio.to_thread(
+            self._exists, "SELECT 1 FROM fingerprints WHERE filename = ? AND filesize = ?", fingerprint
+        )
+
+    def add(self, fingerprint: tuple):
+        """Buffers a fingerprint for the writer; one that is already stored is ignored when written."""
+        fingerprint = (fingerprint[0], int(fingerprint[1]))
+        if fingerprint in self._pending:
+            return
+        self._pending[fingerprint] = None
+        self._bloom.add(_key(fingerprint))
+        self._flush_event.set()
+
+    async def has_content(self, root: bytes) -> bool:
+        if root in self._pending_content:
+            return True
+        return await asyncio.to_thread(self._exists, "SELECT 1 FROM content WHERE root = ?", (bytes(root),))
+
+    def add_content(self, root: bytes):
+        self._pending_content[bytes(root)] = None
+        self._flush_event.set()
+
+    # --- Batched writes ---
+    def _write_batch(self, batch: list) -> int:
+        with self._db_lock:
+            cursor = self._conn.executemany(
+                "INSERT OR IGNORE INTO fingerprints (filename, filesize) VALUES (?, ?)", batch
+            )
+            added = max(cursor.rowcount, 0)
+            self._count += added
+            self._set_meta('count', self._count)
+            self._conn.commit()
+        return added
+
+    def _write_content_batch(self, batch: list):
+        with self._db_lock:
+            self._conn.executemany("INSERT OR IGNORE INTO content (root) VALUES (?)", [(root,) for root in batch])
+            self._conn.commit()
+
+    async def flush(self):
+        if self._conn is None:
+            return
+        if self._pending_content:
+            content_batch = list(self._pending_content)
+            await asyncio.to_thread(self._write_content_batch, content_batch)
+            for root in content_batch:
+                self._pending_content.pop(root, None)
+        if not self._pending:
+            return
+        batch = list(self._pending)
+        await asyncio.to_thread(self._write_batch, batch)
+        for fingerprint in batch:
+            self._pending.pop(fingerprint, None)
+        if self._count > self._bloom.capacity:
+            # add() keeps filling the old filter meanwhile; those keys are still pending when it is swapped out.
+            self._install_bloom(await asyncio.to_thread(self._build_bloom))
+
+    async def run_writer(self):
+        """
+        Background task: coalesces new fingerprints and writes them off the event loop, and
+        every CHECKPOINT_INTERVAL_SECONDS of writing compacts the WAL into the database.
+        """
+        last_checkpoint = time.monotonic()
+        while True:
+            await self._flush_event.wait()
+            await asyncio.sleep(FLUSH_INTERVAL_SECONDS)
+            self._flush_event.clear()
+            try:
+                await self.flush()
+                if time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL_SECONDS:
+                    await asyncio.to_thread(self._checkpoint)
+                    last_checkpoint = time.monotonic()
+            except sqlite3.Error as e:
+                print(f"CRITICAL: Could not save new fingerprints to index database: {e}")
+
+    # --- Shutdown / compaction ---
+    def _checkpoint(self):
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def _compact(self, persist_bloom: bool):
+        with self._db_lock:
+            if persist_bloom:
+                self._set_meta('bloom_capacity', self._bloom.capacity)
+                self._set_meta('bloom_bits', bytes(self._bloom.bits))
+                self._set_meta('bloom_count', self._count)
+                self._conn.commit()
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.close()
+            self._conn = None
+
+    async def close(self, persist_bloom: bool = True):
+        """
+        Flushes and closes the database. The Bloom filter is saved alongside, so the next
+        `open()` can skip rebuilding it; without `persist_bloom`, any saved filter is left as it was.
+        """
+        if self._conn is None:
+            return
+        await self.flush()
+        await asyncio.to_thread(self._compact, persist_bloom)
@@ -4,14 +4,18 @@ import os
 from functools import partial
 
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
-from telethon import TelegramClient
+from client_pool import UploadClientPool
 
 import config
 import bot_handlers
 import torrent_client
 from state import AppState
-from download_manager import download_manager_worker
-from telegram_uploader import uploader_worker, fetch_and_load_trackers, load_index_from_disk
+from status_panel import StatusPanelScheduler
+import metrics
+import resume_store
+import tracing
+from download_manager import download_manager_worker, alert_pump_worker, restore_torrents
+from telegram_uploader import uploader_worker, load_index_from_disk
 
 async def error_handler(update, context):
     print(f"An exception was raised while handling an update: {context.error}")
@@ -28,14 +32,21 @@ async def main() -> None:
     os.makedirs(sessions_dir, exist_ok=True)
     os.makedirs(temp_dir, exist_ok=True)
     os.makedirs(transcode_dir, exist_ok=True) # Create the safe transcode directory
+    os.makedirs(config.RESUME_DIR, exist_ok=True)
+    os.makedirs(config.METADATA_CACHE_DIR, exist_ok=True)
+    if tracing.ENABLED:
+        os.makedirs(config.TRACE_DIR, exist_ok=True)
     
-    session_path = os.path.join(sessions_dir, "bot_session")
-    telethon_client = TelegramClient(session_path, config.TELEGRAM_API_ID, config.TELEGRAM_API_HASH)
+    upload_clients = UploadClientPool(sessions_dir)
     
-    await fetch_and_load_trackers()
+    app_state.trackers.load_cache()
     
     load_index_from_disk(app_state)
 
+    restored = restore_torrents(app_state, session)
+    if restored:
+        print(f"Restored {restored} torrent(s) from resume data.")
+
     application = (
         Application.builder()
         .token(config.TELEGRAM_BOT_TOKEN)
@@ -48,24 +59,36 @@ async def main() -> None:
 
     torrent_handler_partial = partial(bot_handlers.handle_torrent_file, app_state=app_state, session=session)
     button_callback_partial = partial(bot_handlers.button_callback, app_state=app_state, session=session)
+    message_handler_partial = partial(bot_handlers.handle_message, app_state=app_state, session=session)
 
     application.add_handler(CommandHandler("start", bot_handlers.start_command))
     application.add_handler(CommandHandler("help", bot_handlers.help_command))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot_handlers.handle_message))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler_partial))
     application.add_handler(MessageHandler(filters.Document.FileExtension("torrent"), torrent_handler_partial))
     application.add_handler(CallbackQueryHandler(button_callback_partial))
 
     uploader_tasks = []
     try:
-        await telethon_client.start(bot_token=config.TELEGRAM_BOT_TOKEN)
-        print("Telethon client started.")
+        await upload_clients.start()
         
         await application.initialize()
         print("Bot application initialized.")
 
+        if config.METRICS_PORT:
+            metrics.watch_app_state(app_state)
+            metrics.watch_upload_clients(upload_clients)
+            metrics.REGISTRY.register_collector(app_state.session_stats.expose)
+            metrics_runner = await metrics.start_metrics_server(config.METRICS_HOST, config.METRICS_PORT)
+
         manager_task = asyncio.create_task(download_manager_worker(application, app_state, session))
+        app_state.status_panel = StatusPanelScheduler(application.bot, app_state)
+        status_panel_task = asyncio.create_task(app_state.status_panel.run())
+        alert_pump_task = asyncio.create_task(alert_pump_worker(application, app_state, session))
+        index_writer_task = asyncio.create_task(app_state.channel_file_index.run_writer())
+        resume_saver_task = asyncio.create_task(resume_store.resume_saver_worker(app_state))
+        tracker_refresh_task = asyncio.create_task(app_state.trackers.run())
         for i in range(config.NUM_UPLOAD_WORKERS):
-            task = asyncio.create_task(uploader_worker(application, telethon_client, app_state, session))
+            task = asyncio.create_task(uploader_worker(application, upload_clients, app_state, session))
             uploader_tasks.append(task)
             print(f"Uploader worker {i+1}/{config.NUM_UPLOAD_WORKERS} started.")
         
@@ -82,6 +105,16 @@ async def main() -> None:
     finally:
         if 'manager_task' in locals() and not manager_task.done():
             manager_task.cancel()
+        if 'status_panel_task' in locals() and not status_panel_task.done():
+            status_panel_task.cancel()
+        if 'alert_pump_task' in locals() and not alert_pump_task.done():
+            alert_pump_task.cancel()
+        if 'index_writer_task' in locals() and not index_writer_task.done():
+            index_writer_task.cancel()
+        if 'resume_saver_task' in locals() and not resume_saver_task.done():
+            resume_saver_task.cancel()
+        if 'tracker_refresh_task' in locals() and not tracker_refresh_task.done():
+            tracker_refresh_task.cancel()
         for task in uploader_tasks:
             if not task.done():
                 task.cancel()
@@ -91,9 +124,19 @@ async def main() -> None:
         if application.running:
             await application.stop()
         await application.shutdown()
+        if 'metrics_runner' in locals():
+            await metrics_runner.cleanup()
         
-        if telethon_client.is_connected():
-            await telethon_client.disconnect()
+        await upload_clients.disconnect()
+
+        try:
+            await resume_store.save_all(app_state, session)
+        except Exception as e:
+            print(f"Could not save resume data on shutdown: {e}")
+        torrent_client.shutdown_session(session)
+        await app_state.channel_file_index.close()
+        await app_state.trackers.save_cache()
+        tracing.export_all() # Torrents still in progress get a partial trace
             
         print("Shutdown complete.")
 
@@ -0,0 +1,91 @@
+# media_probe.py
+import asyncio
+import json
+import os
+from collections import OrderedDict
+
+from metrics import stage_timer
+
+PROBE_CACHE_SIZE = 512
+
+# (absolute path, size, mtime_ns) -> raw ffprobe output (None if the probe failed)
+_probe_cache = OrderedDict()
+
+def _cache_key(file_path: str):
+    st = os.stat(file_path)
+    return (os.path.abspath(file_path), st.st_size, st.st_mtime_ns)
+
+def _remember(key, data):
+    _probe_cache[key] = data
+    _probe_cache.move_to_end(key)
+    while len(_probe_cache) > PROBE_CACHE_SIZE:
+        _probe_cache.popitem(last=False)
+
+async def probe_media(file_path: str) -> dict | None:
+    """Runs ffprobe at most once per (path, size, mtime) and returns its parsed JSON output."""
+    try:
+        key = _cache_key(file_path)
+    except OSError:
+        return None
+    if key in _probe_cache:
+        _probe_cache.move_to_end(key)
+        return _probe_cache[key]
+
+    data = None
+    try:
+        command = ['ffprobe', '-v', 'error', '-show_format', '-show_streams', '-of', 'json', file_path]
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        with stage_timer("probe"):
+            stdout, stderr = await process.communicate()
+        if process.returncode == 0:
+            data = json.loads(stdout.decode())
+    except Exception as e:
+        print(f"Could not probe {os.path.basename(file_path)}: {e}")
+
+    _remember(key, data)
+    return data
+
+def carry_forward_probe(source_path_probe: dict | None, output_path: str):
+    """
+    Registers the source's probe result for a file derived from it (remux/encode output),
+    which keeps duration and dimensions, so the output is never probed again.
+    """
+    if source_path_probe is None:
+        return
+    try:
+        _remember(_cache_key(output_path), source_path_probe)
+    except OSError:
+        pass
+
+def parse_media_metadata(data: dict) -> dict:
+    metadata = {}
+    if 'streams' in data and data['streams']:
+        video_stream = next((s for s in data['streams'] if s['codec_type'] == 'video'), None)
+        audio_stream = next((s for s in data['streams'] if s['codec_type'] == 'audio'), None)
+        if video_stream:
+            metadata['width'] = video_stream.get('width', 0)
+            metadata['height'] = video_stream.get('height', 0)
+            metadata['duration'] = int(float(video_stream.get('duration', 0)))
+        if audio_stream and not metadata.get('duration'):
+             metadata['duration'] = int(float(audio_stream.get('duration', 0)))
+    if 'format' in data and not metadata.get('duration'):
+        metadata['duration'] = int(float(data['format'].get('duration', 0)))
+    if 'format' in data and 'tags' in data['format']:
+        tags = data['format']['tags']
+        metadata['title'] = tags.get('title')
+        metadata['artist'] = tags.get('artist')
+    return metadata
+
+async def get_media_metadata(file_path: str) -> dict | None:
+    data = await probe_media(file_path)
+    if data is None:
+        return None
+    try:
+        return parse_media_metadata(data)
+    except Exception as e:
+        print(f"Could not get media metadata for {os.path.basename(file_path)}: {e}")
+        return None
@@ -0,0 +1,100 @@
+# metadata_cache.py
+import asyncio
+import os
+import shutil
+import libtorrent as lt
+
+import config
+
+def metadata_key(info_hashes) -> str:
+    """Cache key of a torrent: its v1 info-hash, or the truncated v2 one for v2-only torrents (whose v1 is all zeros)."""
+    return str(info_hashes.get_best())
+
+def cached_torrent_path(info_hash_str: str) -> str:
+    return os.path.join(config.METADATA_CACHE_DIR, f"{info_hash_str}.torrent")
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def store_torrent_info(info_hash_str: str, info) -> str:
+    """Persists metadata fetched from peers as a regular .torrent file."""
+    path = cached_torrent_path(info_hash_str)
+    if not os.path.exists(path):
+        _write_atomic(path, lt.bencode(lt.create_torrent(info).generate()))
+    return path
+
+def store_torrent_file(info_hash_str: str, torrent_file_path: str):
+    """Keeps a copy of a user-supplied .torrent, so a later magnet for it needs no fetch."""
+    path = cached_torrent_path(info_hash_str)
+    if not os.path.exists(path):
+        shutil.copyfile(torrent_file_path, path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+class MagnetResolver:
+    """
+    Turns magnet URIs into cached .torrent files. At most MAGNET_FETCH_CONCURRENCY
+    metadata fetches run at once; concurrent requests for the same info-hash share
+    one fetch, and cached info-hashes are never fetched again.
+    """
+    def __init__(self):
+        self._fetch_slots = asyncio.Semaphore(config.MAGNET_FETCH_CONCURRENCY)
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._waiters: dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def info_hash_of(magnet_uri: str) -> str:
+        return metadata_key(lt.parse_magnet_uri(magnet_uri).info_hashes)
+
+    async def resolve(self, session, magnet_uri: str, trackers: list[str] = ()) -> str:
+        """Returns the path of the cached .torrent file; raises on a bad URI or a timeout."""
+        params = lt.parse_magnet_uri(magnet_uri)
+        info_hash_str = metadata_key(params.info_hashes)
+        path = cached_torrent_path(info_hash_str)
+        if os.path.exists(path):
+            return path
+
+        inflight = self._inflight.get(info_hash_str)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        fetch = asyncio.ensure_future(self._fetch(session, params, info_hash_str, trackers))
+        self._inflight[info_hash_str] = fetch
+        fetch.add_done_callback(lambda _: self._inflight.pop(info_hash_str, None))
+        return await asyncio.shield(fetch)
+
+    async def _fetch(self, session, params, info_hash_str: str, trackers: list[str]) -> str:
+        existing = session.find_torrent(params.info_hashes.get_best())
+        if existing.is_valid() and existing.status().has_metadata:
+            return await asyncio.to_thread(store_torrent_info, info_hash_str, existing.torrent_file())
+
+        async with self._fetch_slots:
+            params.save_path = './downloads/'
+            params.trackers = list(params.trackers) + list(trackers)
+            # Only the info dict is wanted; the torrent stops before downloading any payload.
+            params.flags |= lt.torrent_flags.stop_when_ready
+            params.flags &= ~lt.torrent_flags.auto_managed
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters[info_hash_str] = waiter
+            handle = session.add_torrent(params)
+            try:
+                if handle.status().has_metadata:
+                    info = handle.torrent_file()
+                else:
+                    info = await asyncio.wait_for(waiter, timeout=config.MAGNET_METADATA_TIMEOUT)
+                # The stopped handle is kept; process_torrent_file picks it up instead of adding the torrent again.
+                return await asyncio.to_thread(store_torrent_info, info_hash_str, info)
+            except BaseException:
+                if handle.is_valid():
+                    session.remove_torrent(handle)
+                raise
+            finally:
+                self._waiters.pop(info_hash_str, None)
+
+    def metadata_received(self, info_hash_str: str, handle):
+        """Called by the alert pump on `metadata_received_alert`."""
+        waiter = self._waiters.get(info_hash_str)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(handle.torrent_file())
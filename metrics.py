@@ -0,0 +1,252 @@
+# metrics.py
+import math
+import time
+import libtorrent as lt
+from aiohttp import web
+
+import tracing
+
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 10800)
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames, labelvalues) -> str:
+    if not labelnames:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)) + "}"
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self.labels() # Unlabelled metrics are exposed from the start, at zero
+        REGISTRY.register(self)
+
+    def labels(self, *labelvalues):
+        key = tuple(str(v) for v in labelvalues)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _default(self):
+        return self.labels()
+
+    def expose(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labelvalues, child in sorted(self._children.items()):
+            lines += child.expose(self.name, self.labelnames, labelvalues)
+        return lines
+
+class _ValueChild:
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function):
+        """Evaluates `function()` at scrape time instead of storing a value."""
+        self.function = function
+
+    def expose(self, name, labelnames, labelvalues) -> list[str]:
+        value = self.function() if self.function is not None else self.value
+        return [f"{name}{_format_labels(labelnames, labelvalues)} {_format_value(value)}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _ValueChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _ValueChild()
+
+    def set(self, value: float):
+        self._default().set(value)
+
+    def set_function(self, function):
+        self._default().set_function(function)
+
+class _Timer:
+    def __init__(self, child, span=None):
+        self.child = child
+        self.span = span
+
+    def __enter__(self):
+        if self.span is not None:
+            self.span.__enter__()
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.child.observe(time.monotonic() - self.start)
+        if self.span is not None:
+            self.span.__exit__(exc_type, exc, tb)
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def time(self, span=None) -> _Timer:
+        return _Timer(self, span)
+
+    def expose(self, name, labelnames, labelvalues) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            labels = _format_labels(labelnames + ("le",), labelvalues + (_format_value(bound),))
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _format_labels(labelnames, labelvalues)
+        lines.append(f"{name}_sum{labels} {_format_value(self.sum)}")
+        lines.append(f"{name}_count{labels} {self.count}")
+        return lines
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = STAGE_BUCKETS):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self) -> _Timer:
+        return self._default().time()
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def register_collector(self, collector):
+        """`collector()` returns extra exposition lines, e.g. libtorrent's session counters."""
+        self._collectors.append(collector)
+
+    def expose(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.expose()
+        for collector in self._collectors:
+            lines += collector()
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+# --- Pipeline metrics ---
+STAGE_SECONDS = Histogram("torregram_stage_seconds", "Wall time of each pipeline stage.", ("stage",))
+QUEUE_DEPTH = Gauge("torregram_queue_depth", "Items waiting in each pipeline queue.", ("queue",))
+TRANSFERRED_BYTES = Counter("torregram_telegram_upload_bytes_total", "Bytes transferred to Telegram.")
+PUBLISHED_FILES = Counter("torregram_published_files_total", "Files posted to the target channel.")
+
+STORAGE_RESERVED_BYTES = Gauge("torregram_storage_reserved_bytes", "Disk space reserved by in-flight pipeline stages.")
+ENCODES_WAITING = Gauge("torregram_encodes_waiting", "Encodes waiting for a slot in the encode pool.")
+UPLOAD_WORKERS = Gauge("torregram_upload_part_workers", "Parallel part requests per upload chosen by the upload tuner.")
+UPLOAD_PART_LIMIT_BYTES = Gauge("torregram_upload_part_size_limit_bytes", "Largest part size the upload tuner currently allows.")
+UPLOAD_THROUGHPUT = Gauge("torregram_upload_throughput_bytes_per_second", "Moving average of per-file Telegram upload throughput.")
+UPLOAD_CLIENT_LOAD = Gauge("torregram_upload_client_part_workers", "Part workers running on each upload client.", ("client",))
+
+def watch_app_state(app_state):
+    """Queue depths and buffer sizes are read from the shared state at scrape time."""
+    QUEUE_DEPTH.labels("download").set_function(lambda: app_state.download_queue.qsize() + len(app_state.pending_downloads))
+    QUEUE_DEPTH.labels("upload").set_function(app_state.upload_queue.qsize)
+    QUEUE_DEPTH.labels("ready_buffer").set_function(
+        lambda: sum(len(td["ready_buffer"]) for td in list(app_state.active_torrents.values())))
+    QUEUE_DEPTH.labels("deferred_uploads").set_function(
+        lambda: sum(len(td["deferred_uploads"]) for td in list(app_state.active_torrents.values())))
+    STORAGE_RESERVED_BYTES.set_function(lambda: app_state.storage_ledger.reserved)
+    ENCODES_WAITING.set_function(lambda: app_state.encode_pool.waiting)
+    UPLOAD_WORKERS.set_function(lambda: app_state.upload_tuner.workers)
+    UPLOAD_PART_LIMIT_BYTES.set_function(lambda: app_state.upload_tuner.part_kb_limit * 1024)
+    UPLOAD_THROUGHPUT.set_function(lambda: app_state.upload_tuner.throughput)
+
+def watch_upload_clients(pool):
+    for index, (_, _, name) in enumerate(pool.clients):
+        UPLOAD_CLIENT_LOAD.labels(name).set_function(lambda index=index: pool.load[index])
+
+def stage_timer(stage: str) -> _Timer:
+    """
+    `with stage_timer("transfer"): ...` records the block's duration under that stage,
+    and as a span of the current job's trace when tracing is on (see tracing.job).
+    """
+    return STAGE_SECONDS.labels(stage).time(tracing.span(stage))
+
+# --- libtorrent session_stats ---
+class SessionStats:
+    """Latest values of a `session_stats_alert`, exposed as libtorrent_* metrics."""
+    def __init__(self):
+        self._types = {}
+        for metric in lt.session_stats_metrics():
+            self._types[metric.name] = "counter" if metric.type == lt.metric_type_t.counter else "gauge"
+        self._values = {}
+
+    def update(self, values: dict):
+        self._values = dict(values)
+
+    def expose(self) -> list[str]:
+        lines = []
+        for stat_name, value in sorted(self._values.items()):
+            name = "libtorrent_" + stat_name.replace(".", "_")
+            kind = self._types.get(stat_name, "gauge")
+            if kind == "counter":
+                name += "_total"
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {_format_value(value)}")
+        return lines
+
+# --- HTTP endpoint ---
+async def _handle_metrics(request):
+    return web.Response(text=REGISTRY.expose(), content_type="text/plain", charset="utf-8", headers={"X-Content-Type-Options": "nosniff"})
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Serves GET /metrics in Prometheus text format; returns the runner to clean up on shutdown."""
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Metrics available at http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,205 @@
+# part_uploader.py
+import asyncio
+import hashlib
+import math
+import time
+from telethon import helpers
+from telethon.errors import FloodWaitError, ServerError
+from telethon.tl.functions.upload import SaveBigFilePartRequest, SaveFilePartRequest
+from telethon.tl.types import InputFile, InputFileBig
+
+import config
+
+BIG_FILE_THRESHOLD = 10 * 1024 * 1024 # Larger files go through SaveBigFilePart / InputFileBig
+MAX_PARTS = 4000 # Parts per file; 4000 x 512 KB covers the 2000 MB split size
+PARTS_PER_WORKER = 4 # Small files get smaller parts until every worker has about this many
+MIN_MEASURED_BYTES = 8 * 1024 * 1024 # Smaller uploads don't move the tuner; their setup cost dominates
+THROUGHPUT_SMOOTHING = 0.3 # Weight of the newest upload in the throughput average
+RETRY_BASE_DELAY = 1.0 # Seconds; doubled after every timed out attempt of a part
+
+class UploadTuner:
+    """
+    Picks the parallel part workers and part size of each Telegram upload and adapts
+    them to measured throughput: one more worker after an upload that kept up with the
+    average, one less if the last added worker made things slower, half as many after
+    a FloodWait, and half-size parts after request timeouts, growing back once uploads
+    go through cleanly. Part sizes stay powers of two between the configured bounds
+    (MTProto requires them to divide 512 KB).
+    """
+    def __init__(self, workers: int = config.TELETHON_UPLOAD_WORKERS, max_workers: int = config.TELETHON_MAX_UPLOAD_WORKERS,
+                 max_part_kb: int = config.TELETHON_PART_SIZE_KB, min_part_kb: int = config.TELETHON_MIN_PART_SIZE_KB):
+        self.workers = max(1, workers)
+        self.max_workers = max(self.workers, max_workers)
+        self.max_part_kb = max_part_kb
+        self.min_part_kb = min_part_kb
+        self.part_kb_limit = max_part_kb # Lowered while requests time out
+        self.throughput = 0.0 # Moving average of bytes/s per upload
+        self._grew = False
+
+    def plan(self, file_size: int) -> tuple[int, int]:
+        """(workers, part size in KB) for a file of `file_size` bytes."""
+        part_kb = self.max_part_kb
+        target_kb = min(file_size / (self.workers * PARTS_PER_WORKER) / 1024, self.part_kb_limit)
+        while part_kb > self.min_part_kb and part_kb > target_kb:
+            part_kb //= 2
+        while part_kb < self.max_part_kb and math.ceil(file_size / (part_kb * 1024)) > MAX_PARTS:
+            part_kb *= 2
+        part_count = max(1, math.ceil(file_size / (part_kb * 1024)))
+        return min(self.workers, part_count), part_kb
+
+    def record(self, workers: int, nbytes: int, seconds: float, flood_waited: bool = False, timed_out: bool = False):
+        """Feeds back one finished (or failed, with `nbytes` 0) upload."""
+        if flood_waited:
+            self.workers = max(1, self.workers // 2)
+            self._grew = False
+        if timed_out:
+            self.part_kb_limit = max(self.min_part_kb, self.part_kb_limit // 2)
+        if flood_waited or timed_out or nbytes < MIN_MEASURED_BYTES or seconds <= 0:
+            return
+
+        self.part_kb_limit = min(self.max_part_kb, self.part_kb_limit * 2)
+        throughput = nbytes / seconds
+        # An upload with too few parts to use every worker says nothing about the worker count.
+        if self.throughput and workers >= self.workers:
+            if self._grew and throughput < self.throughput * 0.9:
+                self.workers = max(1, self.workers - 1)
+                self._grew = False
+            elif throughput >= self.throughput * 0.95 and self.workers < self.max_workers:
+                self.workers += 1
+                self._grew = True
+            else:
+                self._grew = False
+        if self.throughput:
+            self.throughput = (1 - THROUGHPUT_SMOOTHING) * self.throughput + THROUGHPUT_SMOOTHING * throughput
+        else:
+            self.throughput = throughput
+
+def _read_part(stream, offset: int, size: int) -> bytes:
+    if stream.tell() != offset:
+        stream.seek(offset)
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+class PartUploadState:
+    """
+    One file's upload id, part layout and the parts Telegram has acknowledged. Passing
+    the same state to another `upload_file_parts` call resumes the upload: only parts
+    that were never acknowledged are sent again, under the same file id.
+    """
+    def __init__(self, file_size: int, part_kb: int):
+        self.file_id = helpers.generate_random_long()
+        self.file_size = file_size
+        self.part_size = part_kb * 1024
+        self.part_count = max(1, math.ceil(file_size / self.part_size))
+        self.is_big = file_size > BIG_FILE_THRESHOLD
+        self.acknowledged = set()
+        self.md5 = None if self.is_big else hashlib.md5()
+
+    @property
+    def acknowledged_bytes(self) -> int:
+        last = self.part_count - 1
+        return sum(self.file_size - last * self.part_size if i == last else self.part_size for i in self.acknowledged)
+
+    def input_file(self, file_name: str):
+        if self.is_big:
+            return InputFileBig(self.file_id, self.part_count, file_name)
+        return InputFile(self.file_id, self.part_count, file_name, self.md5.hexdigest())
+
+async def upload_file_parts(client, source, file_name: str, workers: int, state: PartUploadState,
+                            tuner: UploadTuner | None = None, progress_callback=None):
+    """
+    Uploads the parts of `source` (a path or a seekable stream) that `state` has not seen
+    acknowledged, as `workers` concurrent SaveFilePart/SaveBigFilePart requests, and
+    returns the InputFile(Big) for send_file. Parts are read strictly in order, so
+    hashing readers see every byte once. FloodWaits are waited out and timed out parts
+    retried with backoff; once a part runs out of retries the call raises, and a later
+    call with the same state (and client: parts belong to the session) resumes it.
+    The outcome is reported to `tuner`.
+    """
+    if state.md5 is not None:
+        # Small files carry an MD5 of all their bytes, which a resumed upload never sees: every attempt sends them whole.
+        state.acknowledged.clear()
+        state.md5 = hashlib.md5()
+    part_size, part_count = state.part_size, state.part_count
+    stream = open(source, 'rb') if isinstance(source, str) else source
+    read_lock = asyncio.Lock()
+    remaining = iter([i for i in range(part_count) if i not in state.acknowledged])
+    uploaded = state.acknowledged_bytes
+    sent = 0
+    flood_waited = timed_out = False
+
+    async def read_next():
+        async with read_lock:
+            index = next(remaining, None)
+            if index is None:
+                return None, None
+            read = asyncio.ensure_future(asyncio.to_thread(_read_part, stream, index * part_size, part_size))
+            try:
+                data = await asyncio.shield(read)
+            except asyncio.CancelledError:
+                # The thread cannot be stopped; the stream must not be closed under it.
+                await asyncio.wait([read])
+                raise
+            if state.md5 is not None:
+                state.md5.update(data)
+            return index, data
+
+    async def send(index: int, data: bytes):
+        nonlocal flood_waited, timed_out
+        if state.is_big:
+            request = SaveBigFilePartRequest(state.file_id, index, part_count, data)
+        else:
+            request = SaveFilePartRequest(state.file_id, index, data)
+        for attempt in range(config.TELETHON_PART_RETRIES):
+            try:
+                if await asyncio.wait_for(client(request), timeout=config.TELETHON_PART_TIMEOUT):
+                    state.acknowledged.add(index)
+                    return
+            except FloodWaitError as e:
+                flood_waited = True
+                print(f"Telethon: FloodWait of {e.seconds}s while uploading {file_name}.")
+                await asyncio.sleep(e.seconds)
+                continue
+            except (asyncio.TimeoutError, ConnectionError, ServerError) as e:
+                timed_out = True
+                print(f"Telethon: Part {index + 1}/{part_count} of {file_name} failed ({type(e).__name__}), retrying.")
+            await asyncio.sleep(RETRY_BASE_DELAY * 2 ** attempt)
+        raise ConnectionError(f"Part {index + 1}/{part_count} of {file_name} failed {config.TELETHON_PART_RETRIES} times")
+
+    async def worker():
+        nonlocal uploaded, sent
+        while True:
+            index, data = await read_next()
+            if index is None:
+                return
+            await send(index, data)
+            uploaded += len(data)
+            sent += len(data)
+            if progress_callback is not None:
+                await progress_callback(uploaded, state.file_size)
+
+    started_at = time.monotonic()
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        if tuner is not None:
+            tuner.record(workers, 0, 0, flood_waited, timed_out)
+        raise
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if stream is not source:
+            stream.close()
+
+    if tuner is not None:
+        tuner.record(workers, sent, time.monotonic() - started_at, flood_waited, timed_out)
+    return state.input_file(file_name)
@@ -0,0 +1,127 @@
+# resume_store.py
+import asyncio
+import json
+import os
+import time
+import libtorrent as lt
+
+import config
+
+SAVE_FLAGS = lt.torrent_handle.save_info_dict # Resume data carries the metadata, so no .torrent file is needed
+
+def _paths(info_hash_str: str) -> tuple[str, str]:
+    base = os.path.join(config.RESUME_DIR, info_hash_str)
+    return base + ".fastresume", base + ".json"
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def is_persistent(torrent_data: dict) -> bool:
+    """Only torrents with a confirmed selection are worth resuming; browsing sessions are not."""
+    return bool(torrent_data.get("files_to_download"))
+
+def pipeline_state(torrent_data: dict) -> dict:
+    """The part of a torrent's pipeline position that survives a restart."""
+    return {
+        "files_to_download": {str(i): options for i, options in torrent_data["files_to_download"].items()},
+        "upload_order": torrent_data["upload_order"],
+        "current_upload_idx": torrent_data["current_upload_idx"],
+        "jobs_total": torrent_data["jobs_total"],
+        "jobs_completed": torrent_data["jobs_completed"],
+        "seeding_paused": torrent_data["seeding_paused"],
+        "user_chat_id": torrent_data["user_chat_id"],
+        "status_message_id": torrent_data["status_message_id"],
+    }
+
+def write_pipeline_state(info_hash_str: str, state: dict):
+    _write_atomic(_paths(info_hash_str)[1], json.dumps(state).encode('utf-8'))
+
+def write_resume_data(alert) -> str:
+    """Writes the resume data carried by a `save_resume_data_alert`; returns its info-hash."""
+    info_hash_str = str(alert.params.info_hashes.v1)
+    _write_atomic(_paths(info_hash_str)[0], lt.write_resume_data_buf(alert.params))
+    return info_hash_str
+
+def discard(info_hash_str: str):
+    for path in _paths(info_hash_str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def load_all() -> list[tuple[str, bytes, dict]]:
+    """Returns (info_hash, resume data, pipeline state) for every torrent saved in RESUME_DIR."""
+    saved = []
+    if not os.path.isdir(config.RESUME_DIR):
+        return saved
+    for name in sorted(os.listdir(config.RESUME_DIR)):
+        if not name.endswith(".json"):
+            continue
+        info_hash_str = name[:-len(".json")]
+        resume_path, state_path = _paths(info_hash_str)
+        try:
+            with open(resume_path, 'rb') as f:
+                resume_data = f.read()
+            with open(state_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Discarding unreadable resume data for {info_hash_str}: {e}")
+            discard(info_hash_str)
+            continue
+        state["files_to_download"] = {int(i): options for i, options in state["files_to_download"].items()}
+        saved.append((info_hash_str, resume_data, state))
+    return saved
+
+def request_saves(app_state) -> int:
+    """Asks libtorrent for fresh resume data of every persistent torrent that changed; the alerts follow."""
+    requested = 0
+    for torrent_data in list(app_state.active_torrents.values()):
+        handle = torrent_data["handle"]
+        if is_persistent(torrent_data) and handle.is_valid() and handle.need_save_resume_data():
+            handle.save_resume_data(SAVE_FLAGS)
+            requested += 1
+    return requested
+
+async def save_pipeline_states(app_state):
+    states = [(ih, pipeline_state(td)) for ih, td in list(app_state.active_torrents.items()) if is_persistent(td)]
+    for info_hash_str, state in states:
+        await asyncio.to_thread(write_pipeline_state, info_hash_str, state)
+
+async def resume_saver_worker(app_state):
+    """Background task: checkpoints pipeline positions and libtorrent resume data every RESUME_SAVE_INTERVAL."""
+    print("Resume data saver started.")
+    while True:
+        await asyncio.sleep(config.RESUME_SAVE_INTERVAL)
+        try:
+            await save_pipeline_states(app_state)
+            request_saves(app_state)
+        except Exception as e:
+            print(f"Error while saving resume data: {e}")
+
+async def save_all(app_state, session, timeout: float = 10.0):
+    """
+    Final checkpoint at shutdown, after the alert pump has stopped: requests resume data
+    for every persistent torrent and writes the alerts as they arrive.
+    """
+    await save_pipeline_states(app_state)
+    outstanding = 0
+    for torrent_data in list(app_state.active_torrents.values()):
+        handle = torrent_data["handle"]
+        if is_persistent(torrent_data) and handle.is_valid():
+            handle.save_resume_data(SAVE_FLAGS)
+            outstanding += 1
+
+    deadline = time.monotonic() + timeout
+    while outstanding > 0 and time.monotonic() < deadline:
+        await asyncio.to_thread(session.wait_for_alert, 500)
+        for alert in session.pop_alerts():
+            if isinstance(alert, lt.save_resume_data_alert):
+                await asyncio.to_thread(write_resume_data, alert)
+                outstanding -= 1
+            elif isinstance(alert, lt.save_resume_data_failed_alert):
+                outstanding -= 1
+    if outstanding > 0:
+        print(f"Timed out waiting for resume data of {outstanding} torrent(s).")
@@ -1,6 +1,68 @@
-
 import asyncio
+from collections import OrderedDict
 from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+import config
+import resume_store
+import tracing
+from fingerprint_store import FingerprintStore
+from storage_ledger import StorageLedger
+from metadata_cache import MagnetResolver
+from tracker_list import TrackerRegistry
+from metrics import SessionStats
+from transcoder import EncodePool
+from part_uploader import UploadTuner
+
+if TYPE_CHECKING:
+    from status_panel import StatusPanelScheduler # status_panel imports this module
+
+class TorrentInfoCache:
+    """Bounded LRU of parsed `lt.torrent_info` objects, keyed by info-hash."""
+    def __init__(self, max_entries: int = config.TORRENT_INFO_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, info_hash_str: str):
+        info = self._entries.get(info_hash_str)
+        if info is not None:
+            self._entries.move_to_end(info_hash_str)
+        return info
+
+    def put(self, info_hash_str: str, info):
+        self._entries[info_hash_str] = info
+        self._entries.move_to_end(info_hash_str)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def evict(self, info_hash_str: str):
+        self._entries.pop(info_hash_str, None)
+
+def new_torrent_data(handle) -> dict:
+    """The per-torrent state kept in `AppState.active_torrents`."""
+    return {
+        "handle": handle, 
+        "files_to_download": {}, 
+        "enqueued_files": set(),  # File indices already handed to the upload queue
+        "deferred_deletes": set(),  # Uploaded payload files kept until the torrent stops downloading
+        "background_tasks": set(),  # Streaming archive jobs and publish retries, cancelled with the torrent
+        "successfully_uploaded_files": [], 
+        "failed_uploads": [],  # Names of files given up on after UPLOAD_RETRY_BUDGET attempts
+        "status_message_id": None, 
+        "user_chat_id": None,
+        "jobs_total": 0, 
+        "jobs_completed": 0, 
+        "seeding_paused": False,
+        "details_visible": False, 
+        "selection_mode": False, 
+        "selection": set(),
+        # --- NEW: Sequencing State ---
+        "upload_order": [],       # List of file indices in the correct order
+        "upload_position": {},    # file index -> position in upload_order
+        "current_upload_idx": 0,  # Pointer to the current index in upload_order
+        "ready_buffer": {},       # Transferred files waiting for their turn to be published
+        "deferred_uploads": []    # Queue items outside the reorder window
+    }
 
 @dataclass
 class AppState:
@@ -8,8 +70,38 @@ class AppState:
     download_queue: asyncio.Queue = field(default_factory=asyncio.Queue)
     upload_queue: asyncio.Queue = field(default_factory=asyncio.Queue)
     new_download_event: asyncio.Event = field(default_factory=asyncio.Event)
+    pending_downloads: list = field(default_factory=list) # Download jobs waiting for disk space, owned by the download manager
+    storage_ledger: StorageLedger = field(default_factory=lambda: StorageLedger(buffer_bytes=int(config.STORAGE_BUFFER_GB * (1024**3))))
+    transfer_slots: asyncio.Semaphore = field(default_factory=lambda: asyncio.Semaphore(config.NUM_UPLOAD_WORKERS))
+    upload_tuner: UploadTuner = field(default_factory=UploadTuner) # Part workers and part size of Telegram uploads, adapted to throughput
+    encode_pool: EncodePool = field(default_factory=lambda: EncodePool(config.ENCODE_CORE_BUDGET, config.ENCODE_MAX_JOBS, config.ENCODE_NICENESS))
     
     active_torrents: dict = field(default_factory=dict)
+    torrent_status: dict = field(default_factory=dict) # Latest lt.torrent_status per info-hash, kept by the alert pump
     torrent_metadata_cache: dict = field(default_factory=dict)
-    channel_file_index: set = field(default_factory=set)
-    torrent_locks: dict = field(default_factory=dict)
\ No newline at end of file
+    torrent_info_cache: TorrentInfoCache = field(default_factory=TorrentInfoCache)
+    magnet_resolver: MagnetResolver = field(default_factory=MagnetResolver)
+    trackers: TrackerRegistry = field(default_factory=TrackerRegistry)
+    session_stats: SessionStats = field(default_factory=SessionStats) # Latest libtorrent session_stats sample
+    channel_file_index: FingerprintStore = field(default_factory=FingerprintStore)
+    torrent_locks: dict = field(default_factory=dict)
+    status_panel: "StatusPanelScheduler | None" = None
+
+    def __post_init__(self):
+        self.storage_ledger.subscribe(self.new_download_event)
+
+    def forget_torrent(self, info_hash_str: str):
+        """Drops the in-memory state of a torrent that was completed, failed or cancelled."""
+        torrent_data = self.active_torrents.pop(info_hash_str, None)
+        if torrent_data:
+            current_task = asyncio.current_task()
+            for task in torrent_data.get("background_tasks", ()):
+                if task is not current_task:
+                    task.cancel()
+        self.torrent_status.pop(info_hash_str, None)
+        self.torrent_locks.pop(info_hash_str, None)
+        self.torrent_info_cache.evict(info_hash_str)
+        # Its files are gone (or about to be); this also wakes the download manager.
+        self.storage_ledger.release_owner(info_hash_str)
+        resume_store.discard(info_hash_str)
+        tracing.export(info_hash_str)
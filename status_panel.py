@@ -0,0 +1,319 @@
+# status_panel.py
+import asyncio
+import math
+import time
+import libtorrent as lt
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, RetryAfter
+
+import config
+from state import AppState
+
+STATE_MAP = {
+    lt.torrent_status.states.queued_for_checking: "Queued",
+    lt.torrent_status.states.checking_files: "Checking",
+    lt.torrent_status.states.downloading_metadata: "Fetching Metadata",
+    lt.torrent_status.states.downloading: "Downloading",
+    lt.torrent_status.states.finished: "Finished",
+    lt.torrent_status.states.seeding: "Seeding",
+    lt.torrent_status.states.allocating: "Allocating",
+    lt.torrent_status.states.checking_resume_data: "Resuming",
+}
+
+def format_bytes(size_bytes):
+    if size_bytes == 0:
+        return "0 B"
+    size_name = ("B", "KB", "MB", "GB", "TB")
+    i = int(math.floor(math.log(size_bytes, 1024)))
+    p = math.pow(1024, i)
+    s = round(size_bytes / p, 2)
+    return f"{s} {size_name[i]}"
+
+def format_time(seconds):
+    if seconds is None or seconds == float('inf') or seconds < 0:
+        return "∞"
+    m, s = divmod(seconds, 60)
+    h, m = divmod(m, 60)
+    d, h = divmod(h, 24)
+    parts = []
+    if d > 0: parts.append(f"{int(d)}d")
+    if h > 0: parts.append(f"{int(h)}h")
+    if m > 0: parts.append(f"{int(m)}m")
+    if s > 0 or not parts: parts.append(f"{int(s)}s")
+    return " ".join(parts)
+
+def create_progress_bar(progress, length=10):
+    filled_length = int(length * progress)
+    bar = '█' * filled_length + '░' * (length - filled_length)
+    return f"[{bar}]"
+
+def _torrent_name(app_state: AppState, info_hash_str: str, torrent_data: dict) -> str:
+    info = app_state.torrent_info_cache.get(info_hash_str)
+    if info is None:
+        handle = torrent_data["handle"]
+        info = handle.torrent_file() if handle.is_valid() else None
+        if info is None:
+            return info_hash_str
+        app_state.torrent_info_cache.put(info_hash_str, info)
+    return info.name()
+
+def render_status_panel(app_state: AppState, info_hash_str: str, current_task: str, is_final: bool = False):
+    """Builds the panel text and markup from cached state only; never queries libtorrent for status."""
+    torrent_data = app_state.active_torrents.get(info_hash_str)
+    if not torrent_data:
+        return None, None
+
+    name = _torrent_name(app_state, info_hash_str, torrent_data)
+    status = app_state.torrent_status.get(info_hash_str)
+
+    keyboard = []
+    if is_final:
+        failed = torrent_data.get("failed_uploads")
+        if current_task:
+            message = current_task
+        elif failed:
+            failed_list = "\n".join(f"• `{filename}`" for filename in failed[:10])
+            if len(failed) > 10:
+                failed_list += f"\n• ...and {len(failed) - 10} more"
+            message = f"⚠️ **Finished with errors:** `{name}` was processed, but {len(failed)} file(s) could not be uploaded:\n{failed_list}"
+        else:
+            message = f"✅ **Finished:** `{name}` has been successfully processed and uploaded."
+    else:
+        progress_percent = status.progress if status else 0.0
+        progress_bar = create_progress_bar(progress_percent)
+
+        state_str = STATE_MAP.get(status.state, 'N/A') if status else "Queued"
+        state_emoji = "🚀" if state_str == "Downloading" else "⚙️"
+
+        message = (
+            f"**Torrent:** `{name}`\n\n"
+            f"**[ {state_emoji} {state_str} ]** {progress_bar} {progress_percent * 100:.1f}%\n\n"
+            f"> {current_task}"
+        )
+
+        details_visible = torrent_data.get("details_visible", False)
+        if details_visible:
+            download_rate = status.download_rate if status else 0
+            download_speed = format_bytes(download_rate) + '/s'
+            upload_speed = format_bytes(status.upload_rate if status else 0) + '/s'
+            if status and download_rate > 0:
+                eta_seconds = (status.total_wanted - status.total_wanted_done) / download_rate
+            else:
+                eta_seconds = float('inf')
+            eta_str = format_time(eta_seconds)
+            jobs_done = torrent_data['jobs_completed']
+            jobs_total = torrent_data['jobs_total']
+            upload_tuning = torrent_data.get("upload_tuning")
+            if upload_tuning:
+                workers, part_kb = upload_tuning
+                tuner = app_state.upload_tuner
+                upload_text = f"\n Upload: {workers} x {part_kb} KB parts"
+                if tuner.throughput:
+                    upload_text += f" (avg {format_bytes(tuner.throughput)}/s)"
+            else:
+                upload_text = ""
+
+            details_text = (
+                f"\n\n**📊 Stats**\n"
+                f" D-Speed: {download_speed}\n"
+                f" U-Speed: {upload_speed}\n"
+                f" Peers: {status.num_peers if status else 0}\n"
+                f" ETA: {eta_str}\n\n"
+                f"**📈 Progress**\n"
+                f" Jobs: {jobs_done} / {jobs_total}"
+                f"{upload_text}"
+            )
+            message += details_text
+            details_button = InlineKeyboardButton("🔼 Hide Details", callback_data=f"details_{info_hash_str}")
+        else:
+            details_button = InlineKeyboardButton("🔽 Show Details", callback_data=f"details_{info_hash_str}")
+
+        cancel_button = InlineKeyboardButton("❌ Cancel", callback_data=f"cancel_{info_hash_str}")
+        keyboard.append([details_button, cancel_button])
+
+    reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+    return message, reply_markup
+
+class _TokenBucket:
+    def __init__(self, rate_per_second: float, burst: float):
+        self.rate = rate_per_second
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, now) -> bool:
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def seconds_until_token(self, now) -> float:
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+class StatusPanelScheduler:
+    """
+    Owns every status panel edit. Requests are coalesced per message (latest wins),
+    rendered only when an edit is actually due, skipped if the rendered text did not
+    change, and sent within per-message, per-chat and global edit budgets.
+    """
+    def __init__(self, bot: Bot, app_state: AppState):
+        self.bot = bot
+        self.app_state = app_state
+        self._pending = {}      # (chat_id, message_id) -> request dict
+        self._last_task = {}    # (chat_id, message_id) -> last task line shown
+        self._last_render = {}  # (chat_id, message_id) -> (text, markup) last sent
+        self._last_edit = {}    # (chat_id, message_id) -> monotonic time of last edit
+        self._chat_budgets = {}
+        self._global_budget = _TokenBucket(config.PANEL_GLOBAL_EDITS_PER_SECOND, config.PANEL_GLOBAL_EDITS_PER_SECOND)
+        self._blocked_until = 0.0
+        self._wakeup = asyncio.Event()
+
+    def request(self, info_hash_str: str, current_task: str | None, is_final: bool = False, urgent: bool = False):
+        torrent_data = self.app_state.active_torrents.get(info_hash_str)
+        if not torrent_data or not torrent_data.get('user_chat_id') or not torrent_data.get('status_message_id'):
+            return
+        key = (torrent_data['user_chat_id'], torrent_data['status_message_id'])
+
+        previous = self._pending.get(key)
+        if previous and previous["is_final"]:
+            return
+        if current_task is None:
+            current_task = previous["task"] if previous else self._last_task.get(key, "")
+
+        entry = {"info_hash": info_hash_str, "task": current_task, "is_final": is_final,
+                 "urgent": urgent or is_final or bool(previous and previous["urgent"]), "rendered": None}
+        if is_final:
+            # The torrent's state is usually dropped right after a final update, so render it now.
+            entry["rendered"] = render_status_panel(self.app_state, info_hash_str, current_task, is_final=True)
+        self._pending[key] = entry
+        self._wakeup.set()
+
+    def _chat_budget(self, chat_id):
+        bucket = self._chat_budgets.get(chat_id)
+        if bucket is None:
+            rate = config.PANEL_CHAT_EDITS_PER_MINUTE / 60
+            bucket = self._chat_budgets[chat_id] = _TokenBucket(rate, max(1.0, rate * 10))
+        return bucket
+
+    def _next_due(self, key, entry, now) -> float:
+        if entry["urgent"]:
+            return now
+        return self._last_edit.get(key, 0.0) + config.PANEL_EDIT_INTERVAL
+
+    async def _send(self, key, entry):
+        chat_id, message_id = key
+        if entry["rendered"] is not None:
+            text, reply_markup = entry["rendered"]
+        else:
+            text, reply_markup = render_status_panel(self.app_state, entry["info_hash"], entry["task"])
+        if text is None:
+            # The torrent is gone (e.g. cancelled); its panel is no longer ours to edit.
+            self._forget(key)
+            return
+
+        self._last_task[key] = entry["task"]
+        signature = (text, reply_markup.to_json() if reply_markup else None)
+        if self._last_render.get(key) == signature:
+            return
+
+        try:
+            await self.bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=message_id,
+                text=text,
+                parse_mode="Markdown",
+                reply_markup=reply_markup
+            )
+            self._last_render[key] = signature
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+            print(f"Status panel edits rate-limited by Telegram for {retry_after}s.")
+            self._blocked_until = time.monotonic() + retry_after
+            self._pending.setdefault(key, entry)
+        except (BadRequest, Exception) as e:
+            if "Message is not modified" not in str(e):
+                print(f"Error updating status panel (ignoring): {e}")
+        finally:
+            self._last_edit[key] = time.monotonic()
+
+        if entry["is_final"] and key not in self._pending:
+            self._forget(key)
+
+    def _forget(self, key):
+        self._last_task.pop(key, None)
+        self._last_render.pop(key, None)
+        self._last_edit.pop(key, None)
+
+    async def run(self):
+        """Background task that drains pending panel updates."""
+        print("Status panel scheduler started.")
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            wait = None
+            sent = False
+            if now < self._blocked_until:
+                wait = self._blocked_until - now
+            else:
+                for key in sorted(self._pending, key=lambda k: self._next_due(k, self._pending[k], now)):
+                    entry = self._pending[key]
+                    due_in = self._next_due(key, entry, now) - now
+                    if due_in > 0:
+                        wait = due_in if wait is None else min(wait, due_in)
+                        break
+                    global_wait = self._global_budget.seconds_until_token(now)
+                    if global_wait > 0:
+                        wait = global_wait if wait is None else min(wait, global_wait)
+                        break
+                    chat_budget = self._chat_budget(key[0])
+                    chat_wait = chat_budget.seconds_until_token(now)
+                    if chat_wait > 0:
+                        wait = chat_wait if wait is None else min(wait, chat_wait)
+                        continue
+                    self._global_budget.try_take(now)
+                    chat_budget.try_take(now)
+                    del self._pending[key]
+                    await self._send(key, entry)
+                    sent = True
+                    break
+
+            if sent:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+async def refresh_status_panel(bot: Bot, app_state: AppState, info_hash_str: str, current_task: str | None, is_final: bool = False, urgent: bool = False):
+    """
+    Requests a status panel update. With the scheduler running this only records the
+    request; `current_task=None` keeps the task line that is currently shown.
+    """
+    scheduler = app_state.status_panel
+    if scheduler is not None:
+        scheduler.request(info_hash_str, current_task, is_final=is_final, urgent=urgent)
+        return
+
+    torrent_data = app_state.active_torrents.get(info_hash_str)
+    if not torrent_data or not torrent_data.get('user_chat_id') or not torrent_data.get('status_message_id'):
+        return
+    text, reply_markup = render_status_panel(app_state, info_hash_str, current_task or "", is_final)
+    if text is None:
+        return
+    try:
+        await bot.edit_message_text(
+            chat_id=torrent_data['user_chat_id'],
+            message_id=torrent_data['status_message_id'],
+            text=text,
+            parse_mode="Markdown",
+            reply_markup=reply_markup
+        )
+    except (BadRequest, Exception) as e:
+        if "Message is not modified" not in str(e):
+            print(f"Error updating status panel (ignoring): {e}")
@@ -0,0 +1,104 @@
+# storage_ledger.py
+import asyncio
+import shutil
+
+import tracing
+
+class Reservation:
+    """Bytes promised to one pipeline stage; release it once those bytes are on disk (or never will be)."""
+    __slots__ = ("ledger", "owner", "stage", "nbytes")
+
+    def __init__(self, ledger: "StorageLedger", owner: str, stage: str, nbytes: int):
+        self.ledger = ledger
+        self.owner = owner
+        self.stage = stage
+        self.nbytes = max(0, int(nbytes))
+
+    def resize(self, nbytes: int):
+        shrunk = nbytes < self.nbytes
+        self.nbytes = max(0, int(nbytes))
+        if shrunk:
+            self.ledger._notify()
+
+    def release(self):
+        self.ledger._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+class StorageLedger:
+    """
+    Disk space promised to in-flight work. Every stage that writes to disk (download,
+    archive extraction, transcode) reserves its estimated peak before it starts and
+    releases it when done, so admission and stage scheduling see
+    `free - reserved - buffer` rather than only what is already written.
+    """
+    def __init__(self, path: str = ".", buffer_bytes: int = 0, poll_interval: float = 5.0):
+        self.path = path
+        self.buffer_bytes = buffer_bytes
+        self.poll_interval = poll_interval
+        self._reservations: set[Reservation] = set()
+        self._released = asyncio.Event()
+        self._listeners: list[asyncio.Event] = []
+
+    def subscribe(self, event: asyncio.Event):
+        """`event` is set whenever reserved space is given back."""
+        self._listeners.append(event)
+
+    @property
+    def reserved(self) -> int:
+        return sum(r.nbytes for r in self._reservations)
+
+    def reserved_by(self, owner: str) -> int:
+        return sum(r.nbytes for r in self._reservations if r.owner == owner)
+
+    async def available(self) -> int:
+        usage = await asyncio.to_thread(shutil.disk_usage, self.path)
+        return usage.free - self.reserved - self.buffer_bytes
+
+    async def capacity(self) -> int:
+        """The most any single piece of work could ever get: the whole disk minus the buffer."""
+        usage = await asyncio.to_thread(shutil.disk_usage, self.path)
+        return usage.total - self.buffer_bytes
+
+    def reserve_now(self, owner: str, stage: str, nbytes: int) -> Reservation:
+        """Records a reservation without waiting; the caller has already checked `available()`."""
+        reservation = Reservation(self, owner, stage, nbytes)
+        self._reservations.add(reservation)
+        return reservation
+
+    async def reserve(self, owner: str, stage: str, nbytes: int) -> Reservation:
+        """
+        Waits until `nbytes` fit, then reserves them. A request that can never fit is let
+        through once nothing else holds a reservation, so the pipeline cannot stall.
+        """
+        if nbytes <= await self.available() or not self._reservations:
+            return self.reserve_now(owner, stage, nbytes)
+        with tracing.span("waiting for space"):
+            while True:
+                self._released.clear()
+                try:
+                    await asyncio.wait_for(self._released.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass # Files deleted outside the ledger also free space
+                if nbytes <= await self.available() or not self._reservations:
+                    return self.reserve_now(owner, stage, nbytes)
+
+    def release_owner(self, owner: str):
+        """Drops every reservation of a torrent that was completed, failed or cancelled."""
+        for reservation in [r for r in self._reservations if r.owner == owner]:
+            self._reservations.discard(reservation)
+        self._notify()
+
+    def _release(self, reservation: Reservation):
+        if reservation in self._reservations:
+            self._reservations.discard(reservation)
+            self._notify()
+
+    def _notify(self):
+        self._released.set()
+        for event in self._listeners:
+            event.set()
@@ -3,256 +3,142 @@ import json
 import os
 import subprocess
 import time
-import aiohttp
 import shlex
-import zipfile
-import rarfile
-import py7zr
 import shutil
 import uuid
-import libtorrent as lt
-import math
 import re
 import glob
+import itertools
+import sqlite3
 
-from telethon import TelegramClient
+from client_pool import UploadClientPool
+from telethon.errors import FloodWaitError
 from telethon.tl.types import DocumentAttributeVideo, DocumentAttributeAudio
-from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.error import BadRequest
+from telegram import Bot
 
 import config
+import tracing
 from state import AppState
-
-INDEX_FILE = "channel_index.json"
+from fingerprint_store import FingerprintStore
+from status_panel import refresh_status_panel
+from file_slice import FilePart, FileSlice, plan_file_parts
+from content_hash import MerkleRootHasher, FrontierHashingReader
+from part_uploader import PartUploadState, upload_file_parts
+from torrent_client import torrent_file_root
+from archive_stream import archive_extraction_sizes, iter_archive_members
+from transcoder import (
+    PLAN_NONE, PLAN_ENCODE, plan_transcode, build_ffmpeg_command,
+    segment_count, find_segment_cuts, build_segment_command, build_audio_command, build_concat_command
+)
+from media_probe import probe_media, carry_forward_probe, parse_media_metadata, get_media_metadata
+from metrics import stage_timer, TRANSFERRED_BYTES, PUBLISHED_FILES
+
+INDEX_FILE = "channel_index.json" # Legacy JSON index, migrated into the fingerprint store on startup
 MAX_FILE_SIZE_BYTES = 2000 * 1024 * 1024 # 2000 MB safe limit
 
-# ... (All functions from the top down to upload_with_telethon are unchanged) ...
 def load_index_from_disk(app_state: AppState):
     print("Loading channel file index from disk...")
+    store = app_state.channel_file_index
     try:
-        if os.path.exists(INDEX_FILE):
-            with open(INDEX_FILE, 'r') as f:
-                data = json.load(f)
-                app_state.channel_file_index = {tuple(item) for item in data}
-                print(f"Loaded {len(app_state.channel_file_index)} file fingerprints from {INDEX_FILE}.")
-        else:
-            print("Index file not found. A new one will be created.")
-    except (json.JSONDecodeError, IOError) as e:
-        print(f"Error loading index file: {e}. Starting with an empty index.")
-        app_state.channel_file_index = set()
-
-async def save_fingerprint_to_disk(filename: str, filesize: int):
-    try:
-        data = []
-        if os.path.exists(INDEX_FILE) and os.path.getsize(INDEX_FILE) > 0:
-            with open(INDEX_FILE, 'r') as f:
-                data = json.load(f)
-        
-        data.append([filename, filesize])
-        
-        with open(INDEX_FILE, 'w') as f:
-            json.dump(data, f, indent=2)
-    except (IOError, json.JSONDecodeError) as e:
-        print(f"CRITICAL: Could not save new fingerprint to index file: {e}")
-
-STATE_MAP = {
-    lt.torrent_status.states.queued_for_checking: "Queued",
-    lt.torrent_status.states.checking_files: "Checking",
-    lt.torrent_status.states.downloading_metadata: "Fetching Metadata",
-    lt.torrent_status.states.downloading: "Downloading",
-    lt.torrent_status.states.finished: "Finished",
-    lt.torrent_status.states.seeding: "Seeding",
-    lt.torrent_status.states.allocating: "Allocating",
-    lt.torrent_status.states.checking_resume_data: "Resuming",
-}
-
-def format_bytes(size_bytes):
-    if size_bytes == 0:
-        return "0 B"
-    size_name = ("B", "KB", "MB", "GB", "TB")
-    i = int(math.floor(math.log(size_bytes, 1024)))
-    p = math.pow(1024, i)
-    s = round(size_bytes / p, 2)
-    return f"{s} {size_name[i]}"
-
-def format_time(seconds):
-    if seconds is None or seconds == float('inf') or seconds < 0:
-        return "∞"
-    m, s = divmod(seconds, 60)
-    h, m = divmod(m, 60)
-    d, h = divmod(h, 24)
-    parts = []
-    if d > 0: parts.append(f"{int(d)}d")
-    if h > 0: parts.append(f"{int(h)}h")
-    if m > 0: parts.append(f"{int(m)}m")
-    if s > 0 or not parts: parts.append(f"{int(s)}s")
-    return " ".join(parts)
-
-def create_progress_bar(progress, length=10):
-    filled_length = int(length * progress)
-    bar = '█' * filled_length + '░' * (length - filled_length)
-    return f"[{bar}]"
-
-async def refresh_status_panel(bot: Bot, app_state: AppState, info_hash_str: str, current_task: str, is_final: bool = False):
-    torrent_data = app_state.active_torrents.get(info_hash_str)
-    if not torrent_data or not torrent_data.get('user_chat_id') or not torrent_data.get('status_message_id'):
+        store.open()
+        migrated = store.migrate_json_index(INDEX_FILE)
+        if migrated:
+            print(f"Migrated {migrated} file fingerprints from {INDEX_FILE} to {store.db_path}.")
+        print(f"Loaded {len(store)} file fingerprints from {store.db_path}.")
+    except (sqlite3.Error, json.JSONDecodeError, IOError) as e:
+        print(f"Error loading index file: {e}. Starting with an empty in-memory index.")
+        app_state.channel_file_index = FingerprintStore(":memory:")
+        app_state.channel_file_index.open()
+
+def _is_torrent_payload(path: str) -> bool:
+    """True for files libtorrent owns (downloads/...), as opposed to our own temp outputs."""
+    downloads_dir = os.path.abspath("downloads")
+    transcode_dir = os.path.join(downloads_dir, ".transcode_temp")
+    path = os.path.abspath(path)
+    return path.startswith(downloads_dir + os.sep) and not path.startswith(transcode_dir + os.sep)
+
+def remove_uploaded_file(torrent_data: dict, path: str):
+    """
+    Deletes a file that is no longer needed. Payload files of a torrent that is still
+    downloading are only deferred, since libtorrent may read them to serve peers.
+    """
+    if _is_torrent_payload(path) and not torrent_data.get("seeding_paused"):
+        torrent_data["deferred_deletes"].add(path)
         return
+    if os.path.exists(path):
+        os.remove(path)
+        try:
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass
+
+def purge_deferred_deletes(torrent_data: dict):
+    for path in list(torrent_data["deferred_deletes"]):
+        torrent_data["deferred_deletes"].discard(path)
+        remove_uploaded_file(torrent_data, path)
+
+async def stream_archive(app, app_state: AppState, archive_path: str, info_hash_str: str, slots: asyncio.Semaphore):
+    """
+    Async generator over the files inside an archive, extracted one member at a time.
+    A slot is taken before each member is extracted and given back once that member
+    has been uploaded, so at most `slots` extracted members sit on disk at once.
+    Nested archives are expanded in place, depth first.
+    """
+    torrent_data = app_state.active_torrents.get(info_hash_str)
+    if not torrent_data: return
 
-    handle = torrent_data["handle"]
-    if not handle.is_valid(): return
-    
-    status = handle.status()
-    info = handle.torrent_file()
-    if not info: return
-
-    keyboard = []
-    if is_final:
-        message = f"✅ **Finished:** `{info.name()}` has been successfully processed and uploaded."
-    else:
-        progress_percent = status.progress
-        progress_bar = create_progress_bar(progress_percent)
-        
-        state_str = STATE_MAP.get(status.state, 'N/A')
-        state_emoji = "🚀" if state_str == "Downloading" else "⚙️"
-        
-        message = (
-            f"**Torrent:** `{info.name()}`\n\n"
-            f"**[ {state_emoji} {state_str} ]** {progress_bar} {progress_percent * 100:.1f}%\n\n"
-            f"> {current_task}"
-        )
-
-        details_visible = torrent_data.get("details_visible", False)
-        if details_visible:
-            download_speed = format_bytes(status.download_rate) + '/s'
-            upload_speed = format_bytes(status.upload_rate) + '/s'
-            total_wanted = status.total_wanted
-            eta_seconds = (total_wanted - status.total_download) / status.download_rate if status.download_rate > 0 else float('inf')
-            eta_str = format_time(eta_seconds)
-            jobs_done = torrent_data['jobs_completed']
-            jobs_total = torrent_data['jobs_total']
-
-            details_text = (
-                f"\n\n**📊 Stats**\n"
-                f" D-Speed: {download_speed}\n"
-                f" U-Speed: {upload_speed}\n"
-                f" Peers: {status.num_peers}\n"
-                f" ETA: {eta_str}\n\n"
-                f"**📈 Progress**\n"
-                f" Jobs: {jobs_done} / {jobs_total}"
-            )
-            message += details_text
-            details_button = InlineKeyboardButton("🔼 Hide Details", callback_data=f"details_{info_hash_str}")
-        else:
-            details_button = InlineKeyboardButton("🔽 Show Details", callback_data=f"details_{info_hash_str}")
-        
-        cancel_button = InlineKeyboardButton("❌ Cancel", callback_data=f"cancel_{info_hash_str}")
-        keyboard.append([details_button, cancel_button])
-
-    reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
     try:
-        await bot.edit_message_text(
-            chat_id=torrent_data['user_chat_id'], 
-            message_id=torrent_data['status_message_id'], 
-            text=message, 
-            parse_mode="Markdown",
-            reply_markup=reply_markup
-        )
-    except (BadRequest, Exception) as e:
-        if "Message is not modified" not in str(e):
-            print(f"Error updating status panel (ignoring): {e}")
+        step_sizes = await asyncio.to_thread(archive_extraction_sizes, archive_path)
+    except Exception:
+        step_sizes = [] # Unreadable headers; extraction below reports the real error
+    extract_dir = os.path.join("temp", str(uuid.uuid4()))
+    os.makedirs(extract_dir, exist_ok=True)
+    members = iter_archive_members(archive_path, extract_dir)
+    ledger = app_state.storage_ledger
+    yielded_any = False
 
-def _extract_sync(archive_path, extract_dir):
     try:
-        if archive_path.lower().endswith('.zip'):
-            with zipfile.ZipFile(archive_path, 'r') as zip_ref:
-                zip_ref.extractall(extract_dir)
-        elif archive_path.lower().endswith('.rar'):
-            with rarfile.RarFile(archive_path, 'r') as rar_ref:
-                rar_ref.extractall(extract_dir)
-        elif archive_path.lower().endswith('.7z'):
-            with py7zr.SevenZipFile(archive_path, mode='r') as z_ref:
-                z_ref.extractall(path=extract_dir)
-        return True
-    except Exception as e:
-        print(f"Extraction failed for {os.path.basename(archive_path)}: {e}")
-        return False
+        for step in itertools.count():
+            await slots.acquire()
+            try:
+                # Reserved only while the member is being written; afterwards it counts as used space.
+                with await ledger.reserve(info_hash_str, "extract", step_sizes[step] if step < len(step_sizes) else 0):
+                    with stage_timer("extract"):
+                        file_path = await asyncio.to_thread(next, members, None)
+            except Exception as e:
+                slots.release()
+                print(f"Extraction failed for {os.path.basename(archive_path)}: {e}")
+                break
+            if file_path is None:
+                slots.release()
+                break
 
-async def process_archive(app, app_state: AppState, archive_path: str, info_hash_str: str) -> list[str]:
-    """Extracts an archive and returns a list of extracted file paths."""
-    torrent_data = app_state.active_torrents.get(info_hash_str)
-    if not torrent_data: return []
+            if file_path.lower().endswith(config.ARCHIVE_EXTENSIONS):
+                # The nested archive is deleted as soon as it is expanded; its members take their own slots.
+                slots.release()
+                await refresh_status_panel(app.bot, app_state, info_hash_str, f"Extracting nested `{os.path.basename(file_path)}`...")
+                async for nested_path in stream_archive(app, app_state, file_path, info_hash_str, slots):
+                    yielded_any = True
+                    yield nested_path
+            else:
+                yielded_any = True
+                yield file_path
 
-    extract_dir = os.path.join("temp", str(uuid.uuid4()))
-    extracted_files = []
-    
-    try:
-        os.makedirs(extract_dir, exist_ok=True)
-        success = await asyncio.to_thread(_extract_sync, archive_path, extract_dir)
-        
-        if success:
-            for root, _, files in os.walk(extract_dir):
-                for file in files:
-                    extracted_files.append(os.path.join(root, file))
-            
-            # Recursively handle nested archives
-            final_files = []
-            for file_path in extracted_files:
-                if file_path.lower().endswith(config.ARCHIVE_EXTENSIONS):
-                    await refresh_status_panel(app.bot, app_state, info_hash_str, f"Extracting nested `{os.path.basename(file_path)}`...")
-                    nested_files = await process_archive(app, app_state, file_path, info_hash_str)
-                    final_files.extend(nested_files)
-                else:
-                    final_files.append(file_path)
-            
-            return final_files
-        else:
+        if not yielded_any:
             await refresh_status_panel(app.bot, app_state, info_hash_str, f"ℹ️ Archive `{os.path.basename(archive_path)}` was empty or failed.")
-            return []
-
     finally:
-        if os.path.exists(archive_path):
-            os.remove(archive_path)
-
-async def get_media_metadata(file_path: str) -> dict | None:
-    try:
-        command = ['ffprobe', '-v', 'error', '-show_format', '-show_streams', '-of', 'json', file_path]
-        process = await asyncio.create_subprocess_exec(
-            *command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await process.communicate()
-
-        if process.returncode != 0:
-            return None
-
-        data = json.loads(stdout.decode())
-        metadata = {}
-        if 'streams' in data and data['streams']:
-            video_stream = next((s for s in data['streams'] if s['codec_type'] == 'video'), None)
-            audio_stream = next((s for s in data['streams'] if s['codec_type'] == 'audio'), None)
-            if video_stream:
-                metadata['width'] = video_stream.get('width', 0)
-                metadata['height'] = video_stream.get('height', 0)
-                metadata['duration'] = int(float(video_stream.get('duration', 0)))
-            if audio_stream and not metadata.get('duration'):
-                 metadata['duration'] = int(float(audio_stream.get('duration', 0)))
-        if 'format' in data and not metadata.get('duration'):
-            metadata['duration'] = int(float(data['format'].get('duration', 0)))
-        if 'format' in data and 'tags' in data['format']:
-            tags = data['format']['tags']
-            metadata['title'] = tags.get('title')
-            metadata['artist'] = tags.get('artist')
-        return metadata
-    except Exception as e:
-        print(f"Could not get media metadata for {os.path.basename(file_path)}: {e}")
-        return None
+        try:
+            members.close()
+        except ValueError:
+            pass # Cancelled while a worker thread was still extracting; the thread finishes on its own.
+        remove_uploaded_file(torrent_data, archive_path)
 
-async def run_ffmpeg_command(app, app_state, info_hash_str, filename, command: list, timeout: int, total_duration: float) -> int:
+async def run_ffmpeg_command(app, app_state, info_hash_str, filename, command: list, timeout: int, total_duration: float, preexec_fn=None, on_progress=None) -> int:
     process = await asyncio.create_subprocess_exec(
         *command,
         stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
+        stderr=asyncio.subprocess.PIPE,
+        preexec_fn=preexec_fn
     )
 
     last_update_time = 0
@@ -278,7 +164,9 @@ async def run_ffmpeg_command(app, app_state, info_hash_str, filename, command: l
                     if now - last_update_time > 5:
                         last_update_time = now
                         current_time = float(value) / 1_000_000
-                        if total_duration > 0:
+                        if on_progress is not None:
+                            await on_progress(current_time)
+                        elif total_duration > 0:
                             percent = (current_time / total_duration) * 100
                             await refresh_status_panel(app.bot, app_state, info_hash_str, f"Re-encoding `{filename}` ({percent:.1f}%)")
 
@@ -298,53 +186,131 @@ async def run_ffmpeg_command(app, app_state, info_hash_str, filename, command: l
 
     return process.returncode
 
+def _output_ok(return_code: int, output_path: str) -> bool:
+    return return_code == 0 and os.path.exists(output_path) and os.path.getsize(output_path) > 0
+
+async def encode_in_segments(app, app_state, info_hash_str, file_path: str, output_path: str, probe: dict, total_duration: float, segments: int) -> bool:
+    """
+    Full encode split at keyframes into `segments` parallel libx264 processes (video only),
+    plus one audio encode, then joined losslessly into a faststart MP4.
+    """
+    filename = os.path.basename(file_path)
+    start_time = float(probe.get('format', {}).get('start_time') or 0.0)
+    cuts = await find_segment_cuts(file_path, total_duration, segments, start_time)
+    if len(cuts) < 2:
+        return False
+
+    work_dir = os.path.join(os.path.dirname(output_path), f"{uuid.uuid4()}.segments")
+    os.makedirs(work_dir, exist_ok=True)
+    encode_pool = app_state.encode_pool
+    done_seconds = [0.0] * len(cuts)
+
+    async def report(segment_index, current_time):
+        done_seconds[segment_index] = current_time
+        percent = min(sum(done_seconds) / total_duration * 100, 100.0)
+        await refresh_status_panel(app.bot, app_state, info_hash_str, f"Re-encoding `{filename}` in {len(cuts)} segments ({percent:.1f}%)")
+
+    def encode_segment(segment_index):
+        start = cuts[segment_index]
+        length = cuts[segment_index + 1] - start if segment_index + 1 < len(cuts) else None
+        segment_path = os.path.join(work_dir, f"{segment_index:03d}.mkv")
+        command = build_segment_command(file_path, segment_path, start, length, config.ENCODE_SEGMENT_THREADS)
+        return run_ffmpeg_command(
+            app, app_state, info_hash_str, filename, command, timeout=10800, total_duration=total_duration,
+            preexec_fn=encode_pool.preexec_fn, on_progress=lambda t: report(segment_index, t)
+        )
+
+    has_audio = any(s.get('codec_type') == 'audio' for s in probe.get('streams', []))
+    audio_path = os.path.join(work_dir, "audio.m4a") if has_audio else None
+    jobs = [encode_segment(i) for i in range(len(cuts))]
+    if audio_path:
+        jobs.append(run_ffmpeg_command(
+            app, app_state, info_hash_str, filename, build_audio_command(file_path, audio_path),
+            timeout=10800, total_duration=0, preexec_fn=encode_pool.preexec_fn
+        ))
+
+    try:
+        print(f"Encoding {filename} as {len(cuts)} parallel segments.")
+        return_codes = await asyncio.gather(*jobs)
+        segment_paths = [os.path.join(work_dir, f"{i:03d}.mkv") for i in range(len(cuts))]
+        if not all(_output_ok(code, path) for code, path in zip(return_codes, segment_paths + ([audio_path] if audio_path else []))):
+            print(f"Segmented encode of {filename} failed in at least one segment.")
+            return False
+
+        list_path = os.path.join(work_dir, "segments.txt")
+        with open(list_path, 'w') as f:
+            for path in segment_paths:
+                f.write(f"file '{os.path.abspath(path)}'\n")
+        await refresh_status_panel(app.bot, app_state, info_hash_str, f"Joining encoded segments of `{filename}`...")
+        concat_command = build_concat_command(list_path, audio_path, file_path, output_path, probe)
+        return_code = await run_ffmpeg_command(app, app_state, info_hash_str, filename, concat_command, timeout=1800, total_duration=0)
+        return _output_ok(return_code, output_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
 async def prepare_file_for_upload(app, app_state, info_hash_str, file_path: str) -> str | None:
     _, extension = os.path.splitext(file_path)
     extension = extension.lower()
     if extension not in config.VIDEO_EXTENSIONS:
         return file_path
     
-    print(f"Preparing video for streaming: {os.path.basename(file_path)}")
-    
     output_path = os.path.join("downloads", ".transcode_temp", f"{uuid.uuid4()}.mp4")
     path_to_return = file_path
+    filename = os.path.basename(file_path)
     
     try:
-        metadata = await get_media_metadata(file_path)
+        probe = await probe_media(file_path)
+        metadata = parse_media_metadata(probe) if probe else None
         total_duration = metadata.get('duration', 0.0) if metadata else 0.0
 
-        command_fast = [
-            'ffmpeg', '-nostdin', '-i', file_path, '-y',
-            '-c:v', 'copy', '-c:a', 'aac', '-movflags', '+faststart',
-            '-pix_fmt', 'yuv420p',
-            output_path
-        ]
-        return_code_fast = await run_ffmpeg_command(app, app_state, info_hash_str, os.path.basename(file_path), command_fast, timeout=1800, total_duration=0)
+        plan = await plan_transcode(file_path, probe)
+        if plan == PLAN_NONE:
+            print(f"Already streamable, no processing needed: {filename}")
+            return file_path
+
+        print(f"Preparing video for streaming ({plan}): {filename}")
+        source_size = os.path.getsize(file_path)
+        if plan != PLAN_ENCODE:
+            command_fast = build_ffmpeg_command(plan, file_path, output_path, probe)
+            with await app_state.storage_ledger.reserve(info_hash_str, "transcode", source_size), stage_timer("transcode"):
+                return_code_fast = await run_ffmpeg_command(app, app_state, info_hash_str, filename, command_fast, timeout=1800, total_duration=0)
+
+            if _output_ok(return_code_fast, output_path):
+                print(f"Successfully prepared (fast mode): {os.path.basename(output_path)}")
+                carry_forward_probe(probe, output_path)
+                return output_path
+            print(f"Fast preparation failed. Falling back to full re-encoding (this may be slow)...")
 
-        if return_code_fast == 0 and os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-            print(f"Successfully prepared (fast mode): {os.path.basename(output_path)}")
+        encode_pool = app_state.encode_pool
+        if encode_pool.waiting or encode_pool.locked():
+            await refresh_status_panel(app.bot, app_state, info_hash_str, f"Waiting for an encoder slot for `{filename}`...")
+        async with encode_pool, stage_timer("encode"):
+            segments = segment_count(total_duration, encode_pool.threads_per_job, config.ENCODE_SEGMENT_THREADS, config.ENCODE_SEGMENT_MIN_DURATION)
+            encoded = False
+            if segments > 1:
+                # Encoded segments and the joined output coexist until the join finishes.
+                with await app_state.storage_ledger.reserve(info_hash_str, "transcode", 2 * source_size):
+                    encoded = await encode_in_segments(app, app_state, info_hash_str, file_path, output_path, probe, total_duration, segments)
+                if not encoded:
+                    print(f"Falling back to a single-process encode for {filename}.")
+            if not encoded:
+                command_slow = build_ffmpeg_command(PLAN_ENCODE, file_path, output_path, probe, threads=encode_pool.threads_per_job)
+                with await app_state.storage_ledger.reserve(info_hash_str, "transcode", source_size):
+                    return_code_slow = await run_ffmpeg_command(
+                        app, app_state, info_hash_str, filename, command_slow, timeout=10800,
+                        total_duration=total_duration, preexec_fn=encode_pool.preexec_fn
+                    )
+                encoded = _output_ok(return_code_slow, output_path)
+
+        if encoded:
+            print(f"Successfully prepared (slow mode): {os.path.basename(output_path)}")
+            carry_forward_probe(probe, output_path)
             path_to_return = output_path
         else:
-            print(f"Fast preparation failed. Falling back to full re-encoding (this may be slow)...")
-            
-            command_slow = [
-                'ffmpeg', '-nostdin', '-i', file_path, '-y',
-                '-progress', 'pipe:1',
-                '-c:v', 'libx264', '-preset', 'fast', '-crf', '23',
-                '-c:a', 'aac', '-movflags', '+faststart',
-                '-pix_fmt', 'yuv420p',
-                output_path
-            ]
-            return_code_slow = await run_ffmpeg_command(app, app_state, info_hash_str, os.path.basename(file_path), command_slow, timeout=10800, total_duration=total_duration)
-
-            if return_code_slow == 0 and os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                print(f"Successfully prepared (slow mode): {os.path.basename(output_path)}")
-                path_to_return = output_path
-            else:
-                print(f"Full re-encoding also failed. Uploading original file.")
-                if os.path.exists(output_path):
-                    os.remove(output_path)
-                path_to_return = file_path
+            print(f"Full re-encoding also failed. Uploading original file.")
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            path_to_return = file_path
     
     except Exception as e:
         print(f"A critical error occurred during FFmpeg processing: {e}. Uploading original file.")
@@ -352,7 +318,12 @@ async def prepare_file_for_upload(app, app_state, info_hash_str, file_path: str)
 
     return path_to_return
 
-async def upload_with_telethon(telethon_client: TelegramClient, bot: Bot, app_state: AppState, file_path: str, original_filename: str, info_hash_str: str) -> bool:
+async def upload_with_telethon(client_pool: UploadClientPool, bot: Bot, app_state: AppState, file_path: str | FilePart, original_filename: str, info_hash_str: str, hasher: MerkleRootHasher | None = None) -> dict | None:
+    """
+    Transfer phase: uploads the file's bytes to Telegram without posting anything.
+    Returns an upload record for `publish_upload`, or None if the transfer failed.
+    With a `hasher`, the bytes are also fed to it as they are read for the upload.
+    """
     last_update_time = 0
     async def progress_callback(current, total):
         nonlocal last_update_time
@@ -362,16 +333,31 @@ async def upload_with_telethon(telethon_client: TelegramClient, bot: Bot, app_st
             await refresh_status_panel(bot, app_state, info_hash_str, f"Uploading `{original_filename}` ({percentage:.1f}%)")
             last_update_time = now
 
+    stream = None
     try:
-        if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
-            print(f"Telethon: Upload failed, file is missing or zero-byte: {file_path}")
-            return False
+        source_path = file_path.path if isinstance(file_path, FilePart) else file_path
+        if not os.path.exists(source_path) or os.path.getsize(source_path) == 0:
+            print(f"Telethon: Upload failed, file is missing or zero-byte: {source_path}")
+            return None
         
         _, extension = os.path.splitext(original_filename)
         extension = extension.lower()
         attributes = []
         force_document = True
-        metadata = await get_media_metadata(file_path) or {}
+
+        if isinstance(file_path, FilePart):
+            # Split parts are streamed straight out of the source file; they are never media.
+            stream = file_path.open()
+            upload_source, filesize = stream, file_path.length
+            metadata = {}
+        else:
+            upload_source, filesize = file_path, os.path.getsize(file_path)
+            is_media = extension in config.VIDEO_EXTENSIONS or extension in config.AUDIO_EXTENSIONS
+            metadata = (await get_media_metadata(file_path) or {}) if is_media else {}
+            if hasher is not None:
+                stream = upload_source = FileSlice(file_path, 0, filesize, original_filename)
+        if hasher is not None:
+            stream = upload_source = FrontierHashingReader(stream, hasher, filesize)
         duration = metadata.get('duration', 0)
 
         if extension in config.VIDEO_EXTENSIONS:
@@ -383,120 +369,192 @@ async def upload_with_telethon(telethon_client: TelegramClient, bot: Bot, app_st
         elif extension in config.IMAGE_EXTENSIONS:
             force_document = False
 
-        print(f"Telethon: Starting upload for {original_filename} (as_document: {force_document})")
-        await telethon_client.send_file(
-            config.TARGET_CHAT_ID, 
-            file_path, 
-            caption="", 
-            force_document=force_document, 
-            attributes=attributes, 
-            workers=config.TELETHON_UPLOAD_WORKERS, 
-            part_size_kb=config.TELETHON_PART_SIZE_KB,
-            progress_callback=progress_callback
-        )
-        print(f"Telethon: Successfully uploaded {original_filename}")
-        
-        filesize = os.path.getsize(file_path)
-        fingerprint = (original_filename, filesize)
-        if fingerprint not in app_state.channel_file_index:
-            app_state.channel_file_index.add(fingerprint)
-            await save_fingerprint_to_disk(original_filename, filesize)
-        
-        return True
+        async with app_state.transfer_slots:
+            tuner = app_state.upload_tuner
+            workers, part_kb = tuner.plan(filesize)
+            print(f"Telethon: Starting upload for {original_filename} (as_document: {force_document}, {workers} x {part_kb} KB parts)")
+            torrent_data = app_state.active_torrents.get(info_hash_str)
+            if torrent_data:
+                torrent_data["upload_tuning"] = (workers, part_kb)
+            state = PartUploadState(filesize, part_kb)
+            async with client_pool.lease(workers) as client, stage_timer("transfer"):
+                for attempt in itertools.count(1):
+                    try:
+                        input_file = await upload_file_parts(
+                            client, upload_source, original_filename, workers, state,
+                            tuner=tuner, progress_callback=progress_callback
+                        )
+                        break
+                    except Exception as e:
+                        if attempt >= config.UPLOAD_RETRY_BUDGET:
+                            raise
+                        delay = _retry_delay(e, attempt)
+                        print(f"Telethon: Transfer of {original_filename} interrupted ({e}). "
+                              f"Resuming at {len(state.acknowledged)}/{state.part_count} parts in {delay:.0f}s "
+                              f"(attempt {attempt + 1}/{config.UPLOAD_RETRY_BUDGET}).")
+                        await asyncio.sleep(delay)
+                        workers = min(workers, tuner.plan(filesize)[0]) # The tuner may have backed off meanwhile
+        TRANSFERRED_BYTES.inc(filesize)
+        print(f"Telethon: Successfully transferred {original_filename}")
+
+        return {
+            "client": client, # Uploaded parts can only be referenced by the session that sent them
+            "input_file": input_file,
+            "name": original_filename,
+            "size": filesize,
+            "force_document": force_document,
+            "attributes": attributes,
+        }
+    except Exception as e:
+        print(f"Telethon: Error uploading {original_filename}: {e}")
+        return None
+    finally:
+        if stream is not None:
+            stream.close()
+
+async def publish_upload(app_state: AppState, record: dict) -> bool:
+    """
+    Publish phase: posts an already transferred file to the channel, from the client that
+    transferred it. A failed post is counted on the record; while attempts remain within
+    UPLOAD_RETRY_BUDGET, `record["retry_delay"]` says when to try again (the FloodWait or a
+    backoff). The caller waits that out itself, so no torrent lock is held while it does.
+    """
+    try:
+        with stage_timer("publish"):
+            await record["client"].send_file(
+                config.TARGET_CHAT_ID,
+                record["input_file"],
+                caption="",
+                force_document=record["force_document"],
+                attributes=record["attributes"]
+            )
     except Exception as e:
-        print(f"Telethon: Error uploading {file_path}: {e}")
+        attempt = record["publish_attempts"] = record.get("publish_attempts", 0) + 1
+        if attempt >= config.UPLOAD_RETRY_BUDGET:
+            print(f"Telethon: Error publishing {record['name']}, giving up after {attempt} attempts: {e}")
+            record.pop("retry_delay", None)
+            return False
+        record["retry_delay"] = _retry_delay(e, attempt)
+        print(f"Telethon: Error publishing {record['name']}: {e}. Retrying in {record['retry_delay']:.0f}s.")
         return False
 
-# --- FIX: Robust Error Handling in Splitter ---
-def _split_file_sync(file_path, split_dir, chunk_size, max_size, progress_callback):
+    PUBLISHED_FILES.inc()
+    print(f"Telethon: Successfully uploaded {record['name']}")
+    app_state.channel_file_index.add((record["name"], record["size"]))
+    if record.get("content_root"):
+        app_state.channel_file_index.add_content(record["content_root"])
+    return True
+
+async def split_large_file(app, app_state, info_hash_str, file_path: str) -> list[FilePart]:
+    """Plans the >2GB parts of a file as byte ranges; they are streamed from the original at upload time."""
+    print(f"Splitting large file: {os.path.basename(file_path)}")
     try:
-        base_name = os.path.basename(file_path)
-        file_size = os.path.getsize(file_path)
-        part_num = 1
-        bytes_read_total = 0
-        parts = []
-        last_update_time = 0
-
-        with open(file_path, 'rb') as infile:
-            while True:
-                part_filename = f"{base_name}.{part_num:03d}"
-                part_path = os.path.join(split_dir, part_filename)
-                current_part_size = 0
-                
-                with open(part_path, 'wb') as outfile:
-                    while current_part_size < max_size:
-                        chunk = infile.read(chunk_size)
-                        if not chunk:
-                            break
-                        outfile.write(chunk)
-                        current_part_size += len(chunk)
-                        bytes_read_total += len(chunk)
-                        
-                        now = time.time()
-                        if now - last_update_time > 5:
-                            last_update_time = now
-                            percent = (bytes_read_total / file_size) * 100
-                            progress_callback(percent)
-
-                if current_part_size > 0:
-                    parts.append(part_path)
-                    part_num += 1
-                
-                if infile.tell() >= file_size:
-                    break
-        return parts
+        with stage_timer("split"):
+            parts = plan_file_parts(file_path, MAX_FILE_SIZE_BYTES)
     except OSError as e:
-        # Catch "Input/output error" and other filesystem issues
-        print(f"Critical error in sync splitter: {e}. File may have been deleted.")
-        # Clean up any partial parts
-        for part in parts:
-            if os.path.exists(part):
-                try: os.remove(part)
-                except: pass
-        return []
-    except Exception as e:
-        print(f"Unexpected error in sync splitter: {e}")
+        print(f"Critical error while planning split: {e}. File may have been deleted.")
         return []
-# ----------------------------------------------
 
-async def split_large_file(app, app_state, info_hash_str, file_path: str) -> list[str]:
-    print(f"Splitting large file: {os.path.basename(file_path)}")
-    
-    split_dir = os.path.join("downloads", ".transcode_temp", f"split_{uuid.uuid4()}")
-    os.makedirs(split_dir, exist_ok=True)
-    
-    base_name = os.path.basename(file_path)
-    
-    loop = asyncio.get_running_loop()
-    def progress_callback(percent):
-        asyncio.run_coroutine_threadsafe(
-            refresh_status_panel(app.bot, app_state, info_hash_str, f"Splitting `{base_name}` ({percent:.1f}%)"),
-            loop
-        )
-
-    parts = await asyncio.to_thread(
-        _split_file_sync, 
-        file_path, 
-        split_dir, 
-        10 * 1024 * 1024, 
-        MAX_FILE_SIZE_BYTES, 
-        progress_callback
-    )
-    
-    if parts:
-        print(f"Successfully split into {len(parts)} parts.")
-    else:
-        print("Split failed.")
-        
+    print(f"Split into {len(parts)} parts.")
     return parts
 
-async def flush_upload_buffer(app, telethon_client, app_state, info_hash_str, session):
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """Seconds before retry `attempt + 1` of a transfer or publish: the FloodWait if Telegram asked for one."""
+    if isinstance(error, FloodWaitError):
+        return error.seconds
+    return min(config.UPLOAD_RETRY_BASE_DELAY * 2 ** (attempt - 1), config.UPLOAD_RETRY_MAX_DELAY)
+
+def _upload_source_path(prepared) -> str:
+    return prepared.path if isinstance(prepared, FilePart) else prepared
+
+async def transfer_prepared_files(app, client_pool, app_state, info_hash_str, prepared_files: list, content_root: bytes | None = None, hash_content: bool = False) -> list[dict]:
+    """
+    Transfers every prepared file (or split part) and deletes each source as soon as it is no longer needed.
+    The source's content root is attached to the last record: `content_root` if already known, or, with
+    `hash_content`, the root computed while the parts are read for upload (they are read in order).
+    """
+    records = []
+    hasher = MerkleRootHasher() if content_root is None and hash_content else None
+    for i, prepared in enumerate(prepared_files):
+        filename = prepared.name if isinstance(prepared, FilePart) else os.path.basename(prepared)
+        record = await upload_with_telethon(client_pool, app.bot, app_state, prepared, filename, info_hash_str, hasher=hasher)
+        torrent_data = app_state.active_torrents.get(info_hash_str)
+        if record:
+            records.append(record)
+        elif torrent_data:
+            torrent_data["failed_uploads"].append(filename)
+
+        # A split source is only deleted once its last part has been transferred (or given up on).
+        source_path = _upload_source_path(prepared)
+        is_last_use = i + 1 == len(prepared_files) or _upload_source_path(prepared_files[i + 1]) != source_path
+        if is_last_use and torrent_data:
+            remove_uploaded_file(torrent_data, source_path)
+
+    complete = bool(records) and len(records) == len(prepared_files)
+    if hasher is not None and complete and hasher.size == sum(record["size"] for record in records):
+        content_root = hasher.digest()
+    if content_root and complete:
+        records[-1]["content_root"] = content_root
+    return records
+
+def _in_reorder_window(torrent_data: dict, file_index) -> bool:
+    position = torrent_data["upload_position"].get(file_index, 0)
+    return position < torrent_data["current_upload_idx"] + config.UPLOAD_REORDER_WINDOW
+
+def _release_deferred_uploads(app_state: AppState, torrent_data: dict):
+    still_deferred = []
+    for item in torrent_data["deferred_uploads"]:
+        if _in_reorder_window(torrent_data, item.get("file_index")):
+            tracing.end(item["info_hash"], item.get("file_index"), "deferred")
+            tracing.begin(item["info_hash"], item.get("file_index"), "queued")
+            app_state.upload_queue.put_nowait(item)
+        else:
+            still_deferred.append(item)
+    torrent_data["deferred_uploads"] = still_deferred
+
+async def _publish_groups(app_state: AppState, torrent_data: dict, entry: dict) -> float | None:
+    """
+    Posts the records of a `ready_buffer` entry in order. Stops at the first post that is to be
+    retried, leaving it at the head of its group, and returns the seconds until that retry.
+    """
+    while entry["groups"]:
+        group = entry["groups"][0]
+        while group:
+            record = group[0]
+            if not await publish_upload(app_state, record):
+                if record.get("retry_delay") is not None:
+                    return record["retry_delay"]
+                torrent_data["failed_uploads"].append(record["name"])
+            group.pop(0)
+        entry["groups"].pop(0)
+    return None
+
+def _schedule_publish_retry(app, app_state: AppState, info_hash_str: str, session, torrent_data: dict, delay: float):
+    """Flushes the buffer again after `delay` seconds; transfers keep depositing records meanwhile."""
+    torrent_data["publish_retry_at"] = time.monotonic() + delay
+
+    async def retry():
+        await asyncio.sleep(delay)
+        await flush_upload_buffer(app, app_state, info_hash_str, session)
+
+    task = asyncio.create_task(retry())
+    torrent_data["background_tasks"].add(task)
+    task.add_done_callback(torrent_data["background_tasks"].discard)
+
+async def flush_upload_buffer(app, app_state, info_hash_str, session):
+    """
+    Publishes transferred files strictly in `upload_order`. Each `ready_buffer` entry is
+    {"groups": [[record, ...], ...], "complete": bool}; an entry that is still being
+    filled (a streaming archive) is drained but not retired.
+    """
     if info_hash_str not in app_state.torrent_locks: return
     lock = app_state.torrent_locks[info_hash_str]
 
     async with lock:
         torrent_data = app_state.active_torrents.get(info_hash_str)
         if not torrent_data: return
+        if time.monotonic() < torrent_data.get("publish_retry_at", 0):
+            return # A failed post is backing off; its scheduled retry flushes the buffer
 
         while True:
             current_idx_ptr = torrent_data["current_upload_idx"]
@@ -505,44 +563,159 @@ async def flush_upload_buffer(app, telethon_client, app_state, info_hash_str, se
                 break
             
             file_index = torrent_data["upload_order"][current_idx_ptr]
-            
-            if file_index in torrent_data["ready_buffer"]:
-                prepared_files = torrent_data["ready_buffer"].pop(file_index)
-                
-                for path in prepared_files:
-                    filename = os.path.basename(path)
-                    await upload_with_telethon(telethon_client, app.bot, app_state, path, filename, info_hash_str)
-                    
-                    if os.path.exists(path):
-                        os.remove(path)
-                        try:
-                            os.rmdir(os.path.dirname(path))
-                        except OSError:
-                            pass
-
-                torrent_data["current_upload_idx"] += 1
-                torrent_data["jobs_completed"] += 1
-            else:
+            entry = torrent_data["ready_buffer"].get(file_index)
+            if entry is None:
+                break
+
+            with tracing.job(info_hash_str, file_index):
+                retry_delay = await _publish_groups(app_state, torrent_data, entry)
+            if retry_delay is not None:
+                _schedule_publish_retry(app, app_state, info_hash_str, session, torrent_data, retry_delay)
+                break
+
+            if not entry["complete"]:
                 break
 
+            del torrent_data["ready_buffer"][file_index]
+            tracing.end(info_hash_str, file_index, "ready_buffer")
+            torrent_data["current_upload_idx"] += 1
+            torrent_data["jobs_completed"] += 1
+            app_state.new_download_event.set() # Its files were deleted after transfer
+
+        _release_deferred_uploads(app_state, torrent_data)
+
         if torrent_data["jobs_completed"] >= torrent_data["jobs_total"]:
             print(f"All jobs for torrent {info_hash_str} have been completed. Cleaning up...")
-            await refresh_status_panel(app.bot, app_state, info_hash_str, "", is_final=True)
-            
-            handle = torrent_data["handle"]
-            if handle.is_valid():
-                session.remove_torrent(handle, session.delete_files)
-            
-            jobs = app.job_queue.get_jobs_by_name(f"job_{info_hash_str}")
-            for job in jobs: job.schedule_removal()
-            
-            if info_hash_str in app_state.torrent_metadata_cache:
-                temp_torrent_path = app_state.torrent_metadata_cache.pop(info_hash_str)
-                if os.path.exists(temp_torrent_path): os.remove(temp_torrent_path)
-            
-            del app_state.active_torrents[info_hash_str]
+            await finish_torrent(app, app_state, info_hash_str, session)
+
+async def finish_torrent(app, app_state: AppState, info_hash_str: str, session):
+    """Tears down a torrent with no work left; the caller holds its lock."""
+    torrent_data = app_state.active_torrents.get(info_hash_str)
+    if not torrent_data: return
+    await refresh_status_panel(app.bot, app_state, info_hash_str, "", is_final=True)
 
-async def uploader_worker(app, telethon_client: TelegramClient, app_state: AppState, session):
+    handle = torrent_data["handle"]
+    if handle.is_valid():
+        session.remove_torrent(handle, session.delete_files)
+
+    if info_hash_str in app_state.torrent_metadata_cache:
+        temp_torrent_path = app_state.torrent_metadata_cache.pop(info_hash_str)
+        if os.path.exists(temp_torrent_path): os.remove(temp_torrent_path)
+
+    app_state.forget_torrent(info_hash_str)
+
+async def deposit_records(app_state, info_hash_str, file_index, records: list, complete: bool = True):
+    """Adds a file's transferred records to `ready_buffer`; `complete` once nothing more will follow for it."""
+    async with app_state.torrent_locks[info_hash_str]:
+        torrent_data = app_state.active_torrents.get(info_hash_str)
+        if not torrent_data: return
+        entry = torrent_data["ready_buffer"].setdefault(file_index, {"groups": [], "complete": False})
+        if records:
+            entry["groups"].append(records)
+        entry["complete"] = complete
+        if complete:
+            tracing.begin(info_hash_str, file_index, "ready_buffer")
+
+async def _prepare_extracted_file(app, app_state, info_hash_str, file_path: str) -> list:
+    if os.path.getsize(file_path) > MAX_FILE_SIZE_BYTES:
+        return await split_large_file(app, app_state, info_hash_str, file_path)
+    ready_path = await prepare_file_for_upload(app, app_state, info_hash_str, file_path)
+    if ready_path != file_path and os.path.exists(file_path):
+        os.remove(file_path)
+    return [ready_path]
+
+async def process_archive_job(app, client_pool, app_state: AppState, session, item: dict):
+    """
+    Extracts an archive in streaming mode: each member is prepared and transferred while
+    the next one is being extracted, bounded by ARCHIVE_LOOKAHEAD. Members are published
+    in archive order once this archive's turn in `upload_order` comes.
+    """
+    with tracing.job(item["info_hash"], item.get("file_index")), stage_timer("archive"):
+        await _process_archive_job(app, client_pool, app_state, session, item)
+
+async def _process_archive_job(app, client_pool, app_state: AppState, session, item: dict):
+    info_hash_str = item["info_hash"]
+    file_index = item.get("file_index")
+    slots = asyncio.Semaphore(config.ARCHIVE_LOOKAHEAD)
+    tracing.end(info_hash_str, file_index, "queued")
+
+    await deposit_records(app_state, info_hash_str, file_index, [], complete=False)
+    await refresh_status_panel(app.bot, app_state, info_hash_str, f"Extracting `{os.path.basename(item['path'])}`...")
+
+    extracted = asyncio.Queue()
+    async def produce():
+        try:
+            # Extraction runs ahead of the member uploads, so it gets its own trace track.
+            with tracing.lane("extract"):
+                async for member_path in stream_archive(app, app_state, item['path'], info_hash_str, slots):
+                    await extracted.put(member_path)
+        finally:
+            await extracted.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (member_path := await extracted.get()) is not None:
+            try:
+                prepared_files = await _prepare_extracted_file(app, app_state, info_hash_str, member_path)
+                records = await transfer_prepared_files(app, client_pool, app_state, info_hash_str, prepared_files)
+            except Exception as e:
+                print(f"Error preparing extracted file {os.path.basename(member_path)}: {e}")
+                records = []
+            finally:
+                # The member is off the disk once transferred, so the next one may be extracted.
+                slots.release()
+            await deposit_records(app_state, info_hash_str, file_index, records, complete=False)
+            await flush_upload_buffer(app, app_state, info_hash_str, session)
+    finally:
+        producer.cancel()
+        if info_hash_str in app_state.torrent_locks:
+            await deposit_records(app_state, info_hash_str, file_index, [], complete=True)
+            await flush_upload_buffer(app, app_state, info_hash_str, session)
+
+async def _needs_full_encode(file_path: str) -> bool:
+    if not file_path.lower().endswith(config.VIDEO_EXTENSIONS):
+        return False
+    return await plan_transcode(file_path, await probe_media(file_path)) == PLAN_ENCODE
+
+async def process_upload_item(app, client_pool, app_state: AppState, session, item: dict):
+    """Prepare, split, transfer and publish a single downloaded file."""
+    with tracing.job(item["info_hash"], item.get("file_index")), stage_timer("file"):
+        await _process_upload_item(app, client_pool, app_state, session, item)
+
+async def _process_upload_item(app, client_pool, app_state: AppState, session, item: dict):
+    info_hash_str = item["info_hash"]
+    file_index = item.get("file_index")
+    torrent_data = app_state.active_torrents.get(info_hash_str)
+    if not torrent_data: return
+    tracing.end(info_hash_str, file_index, "queued")
+
+    try:
+        await refresh_status_panel(app.bot, app_state, info_hash_str, f"Preparing `{os.path.basename(item['path'])}`...")
+        
+        path_to_upload = await prepare_file_for_upload(app, app_state, info_hash_str, item['path'])
+        if path_to_upload != item['path']:
+            remove_uploaded_file(torrent_data, item['path'])
+        
+        if os.path.getsize(path_to_upload) > MAX_FILE_SIZE_BYTES:
+            prepared_files = await split_large_file(app, app_state, info_hash_str, path_to_upload)
+        else:
+            prepared_files = [path_to_upload]
+
+        # Content roots identify the torrent file itself: known up front for v2 torrents, otherwise
+        # hashed during the upload, which is only possible if the file is uploaded unchanged.
+        info = app_state.torrent_info_cache.get(info_hash_str) or torrent_data["handle"].torrent_file()
+        content_root = torrent_file_root(info, file_index) if info is not None and file_index is not None else None
+        hash_content = content_root is None and path_to_upload == item['path']
+        records = await transfer_prepared_files(app, client_pool, app_state, info_hash_str, prepared_files, content_root, hash_content)
+    except Exception as e:
+        print(f"Error processing {item.get('path', 'N/A')}: {e}")
+        records = []
+
+    if info_hash_str in app_state.torrent_locks:
+        await deposit_records(app_state, info_hash_str, file_index, records)
+        await flush_upload_buffer(app, app_state, info_hash_str, session)
+
+async def uploader_worker(app, client_pool: UploadClientPool, app_state: AppState, session):
     while True:
         item = await app_state.upload_queue.get()
         try:
@@ -556,66 +729,32 @@ async def uploader_worker(app, telethon_client: TelegramClient, app_state: AppSt
             if not torrent_data:
                 if item.get("is_extracted_content") and os.path.exists(item['path']):
                     os.remove(item['path'])
-                app_state.upload_queue.task_done()
                 continue
 
-            should_extract = item.get("extract", False)
-            prepared_files = []
-
-            if should_extract:
-                await refresh_status_panel(app.bot, app_state, info_hash_str, f"Extracting `{os.path.basename(item['path'])}`...")
-                prepared_files = await process_archive(app, app_state, item['path'], info_hash_str)
-                
-                final_ready_files = []
-                for p in prepared_files:
-                    if os.path.getsize(p) > MAX_FILE_SIZE_BYTES:
-                         parts = await split_large_file(app, app_state, info_hash_str, p)
-                         final_ready_files.extend(parts)
-                         os.remove(p)
-                    else:
-                         ready_p = await prepare_file_for_upload(app, app_state, info_hash_str, p)
-                         final_ready_files.append(ready_p)
-                prepared_files = final_ready_files
+            if not _in_reorder_window(torrent_data, file_index):
+                # Too far ahead of the publishing cursor; picked up again once the window moves.
+                torrent_data["deferred_uploads"].append(item)
+                tracing.end(info_hash_str, file_index, "queued")
+                tracing.begin(info_hash_str, file_index, "deferred")
+                continue
 
-            else:
-                await refresh_status_panel(app.bot, app_state, info_hash_str, f"Preparing `{os.path.basename(item['path'])}`...")
-                
-                path_to_upload = await prepare_file_for_upload(app, app_state, info_hash_str, item['path'])
-                
-                if os.path.getsize(path_to_upload) > MAX_FILE_SIZE_BYTES:
-                    await refresh_status_panel(app.bot, app_state, info_hash_str, f"Splitting `{os.path.basename(path_to_upload)}`...")
-                    prepared_files = await split_large_file(app, app_state, info_hash_str, path_to_upload)
-                    if path_to_upload != item['path']: os.remove(path_to_upload)
-                else:
-                    prepared_files = [path_to_upload]
-
-            async with app_state.torrent_locks[info_hash_str]:
-                torrent_data = app_state.active_torrents.get(info_hash_str)
-                if torrent_data:
-                    torrent_data["ready_buffer"][file_index] = prepared_files
-            
-            await flush_upload_buffer(app, telethon_client, app_state, info_hash_str, session)
+            if item.get("extract", False):
+                # Archives run as their own task so a slow extraction never ties up an upload worker.
+                task = asyncio.create_task(process_archive_job(app, client_pool, app_state, session, item))
+                torrent_data["background_tasks"].add(task)
+                task.add_done_callback(torrent_data["background_tasks"].discard)
+                continue
+
+            if await _needs_full_encode(item['path']):
+                # CPU-bound encodes wait for the encode pool in their own task, keeping this worker free for uploads.
+                task = asyncio.create_task(process_upload_item(app, client_pool, app_state, session, item))
+                torrent_data["background_tasks"].add(task)
+                task.add_done_callback(torrent_data["background_tasks"].discard)
+                continue
+
+            await process_upload_item(app, client_pool, app_state, session, item)
 
         except Exception as e:
             print(f"Error in uploader_worker for {item.get('path', 'N/A')}: {e}")
         finally:
             app_state.upload_queue.task_done()
-
-async def fetch_and_load_trackers():
-    print("Fetching latest tracker lists...")
-    all_trackers = set()
-    for url in config.TRACKER_URLS:
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        text = await response.text()
-                        trackers = {tracker.strip() for tracker in text.split('\n') if tracker.strip()}
-                        all_trackers.update(trackers)
-                        print(f"Loaded {len(trackers)} trackers from {os.path.basename(url)}")
-                    else:
-                        print(f"Failed to fetch {os.path.basename(url)}. Status: {response.status}")
-        except Exception as e:
-            print(f"Error fetching {os.path.basename(url)}: {e}")
-    config.PUBLIC_TRACKERS = list(all_trackers)
-    print(f"Successfully loaded a total of {len(config.PUBLIC_TRACKERS)} unique trackers.")
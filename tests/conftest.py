@@ -0,0 +1,11 @@
+import os
+import sys
+
+# config.py refuses to import without credentials; the tests never talk to Telegram.
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:test")
+os.environ.setdefault("TARGET_CHAT_ID", "0")
+os.environ.setdefault("TELEGRAM_API_ID", "0")
+os.environ.setdefault("TELEGRAM_API_HASH", "test")
+os.environ.setdefault("METRICS_PORT", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
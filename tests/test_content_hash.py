@@ -0,0 +1,65 @@
+import hashlib
+import io
+import os
+import pytest
+
+from content_hash import BLOCK_SIZE, FrontierHashingReader, MerkleRootHasher
+
+def _reference_root(data: bytes) -> bytes:
+    """BEP 52 pieces root computed the slow way: the whole leaf layer, padded to a power of two."""
+    layer = [hashlib.sha256(data[i:i + BLOCK_SIZE]).digest() for i in range(0, len(data), BLOCK_SIZE)]
+    width = 1
+    while width < len(layer):
+        width *= 2
+    layer += [bytes(32)] * (width - len(layer))
+    while len(layer) > 1:
+        layer = [hashlib.sha256(layer[i] + layer[i + 1]).digest() for i in range(0, len(layer), 2)]
+    return layer[0]
+
+def _root(data: bytes, chunk_size: int) -> bytes | None:
+    hasher = MerkleRootHasher()
+    for offset in range(0, len(data), chunk_size):
+        hasher.update(data[offset:offset + chunk_size])
+    return hasher.digest()
+
+@pytest.mark.parametrize("size", [
+    1, BLOCK_SIZE - 1, BLOCK_SIZE, BLOCK_SIZE + 1, 2 * BLOCK_SIZE, 3 * BLOCK_SIZE + 17, 8 * BLOCK_SIZE, 13 * BLOCK_SIZE - 5,
+])
+def test_merkle_root_matches_reference(size):
+    data = os.urandom(size)
+    assert _root(data, 64 * 1024) == _reference_root(data)
+
+@pytest.mark.parametrize("chunk_size", [1000, BLOCK_SIZE, 3 * BLOCK_SIZE + 7])
+def test_merkle_root_does_not_depend_on_update_sizes(chunk_size):
+    data = os.urandom(5 * BLOCK_SIZE + 123)
+    assert _root(data, chunk_size) == _reference_root(data)
+
+def test_empty_file_has_no_root():
+    assert MerkleRootHasher().digest() is None
+
+def test_digest_can_be_taken_midway():
+    data = os.urandom(3 * BLOCK_SIZE)
+    hasher = MerkleRootHasher()
+    hasher.update(data[:BLOCK_SIZE])
+    assert hasher.digest() == _reference_root(data[:BLOCK_SIZE])
+    hasher.update(data[BLOCK_SIZE:])
+    assert hasher.digest() == _reference_root(data)
+
+def test_reader_hashes_every_byte_once_despite_rereads():
+    data = os.urandom(4 * BLOCK_SIZE + 99)
+    reader = FrontierHashingReader(io.BytesIO(data), MerkleRootHasher(), len(data))
+    buffer = bytearray(10_000)
+    reader.readinto(buffer)
+    reader.seek(0) # A retried part reads the same bytes again
+    while reader.readinto(buffer):
+        pass
+    assert reader.complete
+    assert reader.hasher.digest() == _reference_root(data)
+
+def test_reader_that_skips_ahead_is_incomplete():
+    data = os.urandom(2 * BLOCK_SIZE)
+    reader = FrontierHashingReader(io.BytesIO(data), MerkleRootHasher(), len(data))
+    reader.seek(BLOCK_SIZE)
+    while reader.readinto(bytearray(4096)):
+        pass
+    assert not reader.complete
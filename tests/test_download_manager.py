@@ -0,0 +1,141 @@
+import asyncio
+from types import SimpleNamespace
+
+import config
+from download_manager import _reject_download_job, _select_admissions, start_download_job
+from state import AppState, new_torrent_data
+
+NOW = 100_000.0
+
+def _entry(total_size: int, waited: float = 0.0, post_processing_bytes: int = 0) -> dict:
+    job = {"info_hash": f"{total_size:040x}", "total_size": total_size, "post_processing_bytes": post_processing_bytes}
+    return {"job": job, "queued_at": NOW - waited}
+
+def _sizes(admitted: list) -> list:
+    return [entry["job"]["total_size"] for entry in admitted]
+
+def test_smallest_jobs_that_fit_go_first():
+    pending = [_entry(150), _entry(10), _entry(100)]
+    assert _sizes(_select_admissions(pending, 200, 0, NOW)) == [10, 100]
+
+def test_post_processing_bytes_count_towards_cost():
+    pending = [_entry(50, post_processing_bytes=200), _entry(100)]
+    assert _sizes(_select_admissions(pending, 200, 0, NOW)) == [100]
+
+def test_starving_job_is_admitted_ahead_of_smaller_jobs():
+    starving = _entry(150, waited=config.DOWNLOAD_STARVATION_SECONDS)
+    pending = [_entry(10), _entry(100), starving]
+    assert _sizes(_select_admissions(pending, 200, 0, NOW)) == [150, 10]
+
+def test_starving_job_holds_back_space_it_gets_once_reservations_drain():
+    starving = _entry(500, waited=config.DOWNLOAD_STARVATION_SECONDS)
+    pending = [_entry(10), _entry(100), starving]
+    assert _select_admissions(pending, 200, 400, NOW) == []
+
+def test_starving_job_that_can_never_fit_does_not_block_the_queue():
+    starving = _entry(5000, waited=config.DOWNLOAD_STARVATION_SECONDS)
+    pending = [_entry(100), _entry(10), starving]
+    assert _sizes(_select_admissions(pending, 200, 0, NOW)) == [10, 100]
+
+def test_oldest_starving_job_that_can_fit_gets_the_reservation():
+    too_big = _entry(5000, waited=config.DOWNLOAD_STARVATION_SECONDS * 2)
+    fits_later = _entry(300, waited=config.DOWNLOAD_STARVATION_SECONDS)
+    pending = [too_big, fits_later, _entry(10)]
+    assert _select_admissions(pending, 200, 200, NOW) == []
+
+class _Bot:
+    def __init__(self):
+        self.messages = []
+
+    async def send_message(self, chat_id, text):
+        self.messages.append(text)
+
+class _Files:
+    def __init__(self, sizes: list):
+        self.sizes = sizes
+
+    def num_files(self):
+        return len(self.sizes)
+
+    def file_size(self, index):
+        return self.sizes[index]
+
+    def file_path(self, index):
+        return f"Some.Show/E{index:02d}.mkv"
+
+class _Handle:
+    def __init__(self, sizes: list = ()):
+        self.info = SimpleNamespace(files=lambda: _Files(list(sizes)), name=lambda: "Some.Show")
+        self.priorities = None
+
+    def is_valid(self):
+        return True
+
+    def torrent_file(self):
+        return self.info
+
+    def prioritize_files(self, priorities):
+        self.priorities = priorities
+
+    def resume(self):
+        pass
+
+class _Session:
+    delete_files = 1
+
+    def __init__(self):
+        self.removed = []
+
+    def remove_torrent(self, handle, flags=0):
+        self.removed.append(handle)
+
+async def _reject(selections: list, rejected: list):
+    """Queues `selections` (lists of file indices) on one torrent, then rejects the `rejected` one."""
+    app_state = AppState()
+    torrent_data = new_torrent_data(_Handle())
+    for indices in selections:
+        for index in indices:
+            torrent_data["files_to_download"][index] = {"extract": False}
+            torrent_data["upload_position"][index] = len(torrent_data["upload_order"])
+            torrent_data["upload_order"].append(index)
+        torrent_data["jobs_total"] += len(indices)
+    info_hash_str = "0" * 40
+    app_state.active_torrents[info_hash_str] = torrent_data
+    app_state.torrent_locks[info_hash_str] = asyncio.Lock()
+
+    app, session = SimpleNamespace(bot=_Bot()), _Session()
+    job = {"info_hash": info_hash_str, "file_indices": rejected, "total_size": 10**15, "chat_id": 1}
+    await _reject_download_job(app, app_state, session, job, capacity=10**12)
+    return app_state, torrent_data, app.bot, session
+
+def test_rejected_selection_is_withdrawn_from_the_torrent():
+    app_state, torrent_data, bot, session = asyncio.run(_reject([[0, 1], [2, 3]], [2, 3]))
+    assert torrent_data["jobs_total"] == 2
+    assert torrent_data["upload_order"] == [0, 1]
+    assert set(torrent_data["files_to_download"]) == {0, 1}
+    assert "0" * 40 in app_state.active_torrents and not session.removed
+    assert len(bot.messages) == 1
+
+def test_torrent_left_without_work_is_torn_down():
+    app_state, _, bot, session = asyncio.run(_reject([[0, 1]], [0, 1]))
+    assert not app_state.active_torrents and not app_state.torrent_locks
+    assert len(session.removed) == 1
+    assert "Send the torrent again" in bot.messages[-1]
+
+def test_files_already_handed_to_uploads_are_not_downloaded_again():
+    async def run():
+        app_state = AppState()
+        handle = _Handle([100, 200, 300, 400])
+        torrent_data = new_torrent_data(handle)
+        torrent_data["files_to_download"] = {0: {}, 1: {}, 2: {}}
+        torrent_data["enqueued_files"] = {0} # Published before a restart
+        torrent_data["status_message_id"] = 1
+        info_hash_str = "0" * 40
+        app_state.active_torrents[info_hash_str] = torrent_data
+        job = {"info_hash": info_hash_str, "file_indices": [1, 2], "total_size": 500, "chat_id": 1}
+        await start_download_job(SimpleNamespace(bot=_Bot()), app_state, None, job)
+        return handle, torrent_data
+
+    handle, torrent_data = asyncio.run(run())
+    assert handle.priorities == [0, 1, 1, 0]
+    assert torrent_data["admitted_bytes"] == 500
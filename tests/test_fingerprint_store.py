@@ -0,0 +1,125 @@
+import asyncio
+import time
+
+import fingerprint_store
+from fingerprint_store import BloomFilter, FingerprintStore
+
+def _fingerprints(start: int, count: int) -> list:
+    return [(f"Some.Show.S01E{i:05d}.mkv", 1_000_000 + i) for i in range(start, start + count)]
+
+def _keys(start: int, count: int) -> list:
+    return [f"key-{i}".encode() for i in range(start, start + count)]
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000)
+    for key in _keys(0, 1000):
+        bloom.add(key)
+    assert all(key in bloom for key in _keys(0, 1000))
+
+def test_bloom_filter_false_positive_rate_stays_near_target():
+    bloom = BloomFilter(1000, error_rate=0.01)
+    for key in _keys(0, 1000):
+        bloom.add(key)
+    false_positives = sum(key in bloom for key in _keys(1000, 10_000))
+    assert false_positives < 10_000 * 0.03
+
+def test_bloom_filter_reloads_from_its_bits():
+    bloom = BloomFilter(1000)
+    bloom.add(b"key")
+    assert b"key" in BloomFilter(1000, bits=bytes(bloom.bits))
+    assert b"key" not in BloomFilter(1000, bits=b"too short")
+
+def test_fingerprints_survive_reopening(tmp_path):
+    db_path = str(tmp_path / "index.db")
+
+    async def fill():
+        store = FingerprintStore(db_path)
+        store.open()
+        for fingerprint in _fingerprints(0, 50):
+            store.add(fingerprint)
+        store.add_content(b"\x01" * 32)
+        await store.close()
+    asyncio.run(fill())
+
+    async def check():
+        store = FingerprintStore(db_path)
+        store.open()
+        assert len(store) == 50
+        assert all([await store.contains(fingerprint) for fingerprint in _fingerprints(0, 50)])
+        assert not await store.contains(("Some.Show.S01E00050.mkv", 1_000_050))
+        assert await store.has_content(b"\x01" * 32)
+        assert not await store.has_content(b"\x02" * 32)
+        await store.close()
+    asyncio.run(check())
+
+def test_adding_a_stored_fingerprint_again_does_not_count_it_twice(tmp_path):
+    async def run():
+        store = FingerprintStore(str(tmp_path / "index.db"))
+        store.open()
+        store.add(("a.mkv", 1))
+        await store.flush()
+        store.add(("a.mkv", 1))
+        await store.flush()
+        count = len(store)
+        await store.close()
+        return count
+    assert asyncio.run(run()) == 1
+
+def test_rebuild_keeps_fingerprints_added_while_it_runs(tmp_path, monkeypatch):
+    monkeypatch.setattr(fingerprint_store, "BLOOM_MIN_CAPACITY", 10)
+
+    async def run():
+        store = FingerprintStore(str(tmp_path / "index.db"))
+        store.open()
+        build_bloom = store._build_bloom
+
+        def slow_build_bloom():
+            bloom = build_bloom()
+            time.sleep(0.2)
+            return bloom
+        monkeypatch.setattr(store, "_build_bloom", slow_build_bloom)
+
+        async def add_during_rebuild():
+            await asyncio.sleep(0.05)
+            for fingerprint in _fingerprints(100, 20):
+                store.add(fingerprint)
+
+        for fingerprint in _fingerprints(0, 20): # Outgrows the filter's capacity of 10
+            store.add(fingerprint)
+        await asyncio.gather(store.flush(), add_during_rebuild())
+        await store.flush()
+        found = [await store.contains(fingerprint) for fingerprint in _fingerprints(0, 20) + _fingerprints(100, 20)]
+        await store.close()
+        return found
+
+    assert all(asyncio.run(run()))
+
+def test_lookups_do_not_block_the_event_loop_while_the_writer_holds_the_database(tmp_path):
+    async def run():
+        store = FingerprintStore(str(tmp_path / "index.db"))
+        store.open()
+        store.import_fingerprints(_fingerprints(0, 10))
+
+        def long_commit():
+            with store._db_lock:
+                time.sleep(0.3)
+
+        ticks = 0
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        writer = asyncio.create_task(asyncio.to_thread(long_commit))
+        await asyncio.sleep(0.01)
+        ticking = asyncio.create_task(ticker())
+        found = await store.contains(_fingerprints(0, 1)[0])
+        ticking.cancel()
+        await writer
+        await store.close()
+        return found, ticks
+
+    found, ticks = asyncio.run(run())
+    assert found
+    assert ticks > 10
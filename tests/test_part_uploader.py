@@ -0,0 +1,64 @@
+import math
+
+from part_uploader import MAX_PARTS, MIN_MEASURED_BYTES, UploadTuner
+
+MB = 1024 * 1024
+
+def _tuner(**kwargs) -> UploadTuner:
+    options = {"workers": 4, "max_workers": 8, "max_part_kb": 512, "min_part_kb": 32}
+    options.update(kwargs)
+    return UploadTuner(**options)
+
+def test_large_files_use_the_largest_parts_and_every_worker():
+    assert _tuner().plan(1000 * MB) == (4, 512)
+
+def test_small_files_get_smaller_parts_for_every_worker():
+    workers, part_kb = _tuner().plan(2 * MB)
+    assert workers == 4
+    assert part_kb == 128 # 16 parts of 128 KB: PARTS_PER_WORKER each
+
+def test_tiny_files_never_get_more_workers_than_parts():
+    assert _tuner().plan(10 * 1024) == (1, 32)
+
+def test_part_sizes_stay_within_the_part_limit():
+    tuner = _tuner(max_part_kb=512, min_part_kb=1)
+    _, part_kb = tuner.plan(2000 * MB)
+    assert math.ceil(2000 * MB / (part_kb * 1024)) <= MAX_PARTS
+    assert part_kb & (part_kb - 1) == 0
+
+def test_flood_wait_halves_the_workers():
+    tuner = _tuner()
+    tuner.record(4, 0, 0, flood_waited=True)
+    assert tuner.workers == 2
+
+def test_timeouts_halve_the_part_size_until_uploads_go_through():
+    tuner = _tuner()
+    tuner.record(4, 0, 0, timed_out=True)
+    assert tuner.plan(1000 * MB)[1] == 256
+    tuner.record(4, 100 * MB, 10)
+    assert tuner.plan(1000 * MB)[1] == 512
+
+def test_small_uploads_do_not_move_the_tuner():
+    tuner = _tuner()
+    tuner.record(4, MIN_MEASURED_BYTES - 1, 0.001)
+    assert tuner.throughput == 0 and tuner.workers == 4
+
+def test_workers_grow_while_throughput_keeps_up_and_shrink_when_it_drops():
+    tuner = _tuner()
+    tuner.record(4, 100 * MB, 10)
+    tuner.record(4, 100 * MB, 10)
+    assert tuner.workers == 5
+    tuner.record(5, 100 * MB, 20) # The added worker made things slower
+    assert tuner.workers == 4
+
+def test_uploads_using_fewer_workers_do_not_change_the_worker_count():
+    tuner = _tuner()
+    tuner.record(4, 100 * MB, 10)
+    tuner.record(2, 100 * MB, 5)
+    assert tuner.workers == 4
+
+def test_workers_never_exceed_the_maximum():
+    tuner = _tuner(workers=2, max_workers=3)
+    for _ in range(10):
+        tuner.record(tuner.workers, 100 * MB, 1)
+    assert tuner.workers == 3
@@ -0,0 +1,13 @@
+from status_panel import _TokenBucket
+
+def test_token_bucket_allows_a_burst_then_waits_for_refills():
+    bucket = _TokenBucket(rate_per_second=2, burst=3)
+    now = bucket.updated
+    assert [bucket.try_take(now) for _ in range(4)] == [True, True, True, False]
+    assert bucket.seconds_until_token(now) == 0.5
+    assert bucket.try_take(now + 0.5)
+
+def test_token_bucket_never_holds_more_than_its_burst():
+    bucket = _TokenBucket(rate_per_second=10, burst=2)
+    now = bucket.updated + 3600
+    assert [bucket.try_take(now) for _ in range(3)] == [True, True, False]
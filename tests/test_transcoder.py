@@ -0,0 +1,46 @@
+import asyncio
+import pytest
+
+from transcoder import PLAN_AUDIO, PLAN_ENCODE, PLAN_NONE, PLAN_REMUX, plan_transcode
+
+def _box(box_type: bytes, payload: bytes = b"") -> bytes:
+    return (8 + len(payload)).to_bytes(4, "big") + box_type + payload
+
+@pytest.fixture
+def faststart_mp4(tmp_path):
+    path = tmp_path / "faststart.mp4"
+    path.write_bytes(_box(b"ftyp", b"isom") + _box(b"moov") + _box(b"mdat", b"\0" * 64))
+    return str(path)
+
+@pytest.fixture
+def trailing_moov_mp4(tmp_path):
+    path = tmp_path / "trailing.mp4"
+    path.write_bytes(_box(b"ftyp", b"isom") + _box(b"mdat", b"\0" * 64) + _box(b"moov"))
+    return str(path)
+
+def _probe(video: str, audio: str = "aac", format_name: str = "mov,mp4,m4a,3gp,3g2,mj2") -> dict:
+    return {
+        "format": {"format_name": format_name},
+        "streams": [{"codec_type": "video", "codec_name": video}, {"codec_type": "audio", "codec_name": audio}],
+    }
+
+def test_faststart_h264_aac_mp4_is_uploaded_as_is(faststart_mp4):
+    assert asyncio.run(plan_transcode(faststart_mp4, _probe("h264"))) == PLAN_NONE
+
+def test_h264_aac_with_trailing_moov_is_remuxed(trailing_moov_mp4):
+    assert asyncio.run(plan_transcode(trailing_moov_mp4, _probe("h264"))) == PLAN_REMUX
+
+def test_h264_aac_in_matroska_is_remuxed(faststart_mp4):
+    assert asyncio.run(plan_transcode(faststart_mp4, _probe("h264", format_name="matroska,webm"))) == PLAN_REMUX
+
+def test_other_audio_is_reencoded(faststart_mp4):
+    assert asyncio.run(plan_transcode(faststart_mp4, _probe("h264", audio="ac3"))) == PLAN_AUDIO
+
+@pytest.mark.parametrize("codec", ["hevc", "vp9", "av1", "mpeg4"])
+def test_non_h264_video_is_encoded_even_in_a_faststart_mp4(faststart_mp4, codec):
+    assert asyncio.run(plan_transcode(faststart_mp4, _probe(codec))) == PLAN_ENCODE
+
+def test_cover_art_is_not_treated_as_video(faststart_mp4):
+    probe = _probe("h264")
+    probe["streams"].append({"codec_type": "video", "codec_name": "mjpeg", "disposition": {"attached_pic": 1}})
+    assert asyncio.run(plan_transcode(faststart_mp4, probe)) == PLAN_NONE
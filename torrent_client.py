@@ -1,42 +1,155 @@
 # torrent_client.py
+import asyncio
 import libtorrent as lt
 import os
 
+import config
+
+# Settings shared by every profile.
+BASE_SETTINGS = {
+    'listen_interfaces': '0.0.0.0:6881',
+    'user_agent': 'qBittorrent/4.4.2',
+    'alert_mask': (
+        lt.alert.category_t.error_notification
+        | lt.alert.category_t.status_notification
+        | lt.alert.category_t.file_progress_notification
+        | lt.alert.category_t.tracker_notification
+    ),
+    'peer_connect_timeout': 15,
+    'request_timeout': 20,
+    'upload_rate_limit': 0,
+    'download_rate_limit': 0,
+    'active_downloads': -1,
+    'active_seeds': -1,
+    'active_limit': -1,
+    'enable_dht': True,
+    'enable_lsd': True,
+    'enable_upnp': True,
+    'enable_natpmp': True,
+    'dht_bootstrap_nodes': 'router.utorrent.com:6881,router.bittorrent.com:6881,dht.transmissionbt.com:6881'
+}
+
+# Named tuning profiles, selected with LIBTORRENT_PROFILE. They cover the knobs libtorrent 2.x
+# still honours: disk I/O threads, socket/send buffers, queued disk bytes and connection limits.
+SESSION_PROFILES = {
+    'balanced': {
+        'aio_threads': 4,
+        'hashing_threads': 2,
+        'file_pool_size': 256,
+        'max_queued_disk_bytes': 8 * 1024 * 1024,
+        'send_buffer_low_watermark': 64 * 1024,
+        'send_buffer_watermark': 1024 * 1024,
+        'send_buffer_watermark_factor': 150,
+        'recv_socket_buffer_size': 0, # OS default
+        'send_socket_buffer_size': 0,
+        'connections_limit': 1000,
+        'unchoke_slots_limit': 500,
+    },
+    # Many cores, fast disks and a fat pipe: deep buffers and queues, lots of peers.
+    'seedbox': {
+        'aio_threads': 16,
+        'hashing_threads': 8,
+        'file_pool_size': 1024,
+        'max_queued_disk_bytes': 64 * 1024 * 1024,
+        'send_buffer_low_watermark': 1024 * 1024,
+        'send_buffer_watermark': 8 * 1024 * 1024,
+        'send_buffer_watermark_factor': 200,
+        'recv_socket_buffer_size': 4 * 1024 * 1024,
+        'send_socket_buffer_size': 4 * 1024 * 1024,
+        'connections_limit': 4000,
+        'unchoke_slots_limit': 1000,
+    },
+    # Small VPS: few threads, shallow buffers and a bounded peer count to stay within RAM.
+    'vps': {
+        'aio_threads': 2,
+        'hashing_threads': 1,
+        'file_pool_size': 64,
+        'max_queued_disk_bytes': 2 * 1024 * 1024,
+        'send_buffer_low_watermark': 16 * 1024,
+        'send_buffer_watermark': 256 * 1024,
+        'send_buffer_watermark_factor': 50,
+        'recv_socket_buffer_size': 0,
+        'send_socket_buffer_size': 0,
+        'connections_limit': 200,
+        'unchoke_slots_limit': 50,
+    },
+}
+
+SESSION_STATE_FLAGS = lt.save_state_flags_t.save_dht_state # Only the DHT routing table; settings come from the profile
+
+def _load_session_params():
+    if not os.path.exists(config.SESSION_STATE_FILE):
+        return None
+    try:
+        with open(config.SESSION_STATE_FILE, 'rb') as f:
+            return lt.read_session_params(f.read(), SESSION_STATE_FLAGS)
+    except Exception as e:
+        print(f"Ignoring unreadable session state: {e}")
+        return None
+
 def initialize_session():
-    """Initializes and configures the libtorrent session."""
+    """Initializes and configures the libtorrent session, restoring the saved DHT state if there is one."""
     if not os.path.exists('./downloads'):
         os.makedirs('./downloads')
 
-    settings = {
-        'listen_interfaces': '0.0.0.0:6881',
-        'user_agent': 'qBittorrent/4.4.2',
-        'alert_mask': lt.alert.category_t.error_notification,
-        'peer_connect_timeout': 15,
-        'request_timeout': 20,
-        'connections_limit': 1000,
-        'unchoke_slots_limit': 500,
-        'upload_rate_limit': 0,
-        'download_rate_limit': 0,
-        'active_downloads': -1,
-        'active_seeds': -1,
-        'active_limit': -1,
-        'cache_size': 2048,
-        'use_read_cache': True,
-        'guided_read_cache': True,
-        'suggest_mode': lt.suggest_mode_t.suggest_read_cache,
-        'enable_dht': True,
-        'enable_upnp': True,
-        'enable_natpmp': True,
-        'dht_bootstrap_nodes': 'router.utorrent.com:6881,router.bittorrent.com:6881,dht.transmissionbt.com:6881'
-    }
-    session = lt.session(settings)
+    profile = SESSION_PROFILES.get(config.LIBTORRENT_PROFILE)
+    if profile is None:
+        raise ValueError(f"Unknown LIBTORRENT_PROFILE '{config.LIBTORRENT_PROFILE}'. Choose one of: {', '.join(SESSION_PROFILES)}")
+    settings = {**BASE_SETTINGS, **profile}
+
+    params = _load_session_params()
+    if params is not None:
+        session = lt.session(params)
+        session.apply_settings(settings)
+        print("Restored DHT state from the previous run.")
+    else:
+        session = lt.session(settings)
     session.add_extension('ut_pex')
     session.add_extension('ut_metadata')
     session.add_extension('smart_ban')
-    session.start_lsd()
-    session.start_dht()
-    session.start_upnp()
-    session.start_natpmp()
     
-    print("libtorrent session initialized.")
-    return session
\ No newline at end of file
+    print(f"libtorrent session initialized (profile: {config.LIBTORRENT_PROFILE}).")
+    return session
+
+def shutdown_session(session):
+    """Saves the DHT routing table so the next start finds peers without bootstrapping."""
+    try:
+        state = lt.write_session_params_buf(session.session_state(SESSION_STATE_FLAGS), SESSION_STATE_FLAGS)
+        os.makedirs(os.path.dirname(config.SESSION_STATE_FILE) or ".", exist_ok=True)
+        tmp_path = config.SESSION_STATE_FILE + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(state)
+        os.replace(tmp_path, config.SESSION_STATE_FILE)
+    except Exception as e:
+        print(f"Could not save session state: {e}")
+
+async def get_torrent_info(app_state, info_hash_str: str):
+    """
+    Returns the parsed metadata of a torrent, or None if it is no longer known.
+    Prefers the cache, then the live handle, and only parses the .torrent file as a last resort.
+    """
+    info = app_state.torrent_info_cache.get(info_hash_str)
+    if info is not None:
+        return info
+
+    torrent_data = app_state.active_torrents.get(info_hash_str)
+    if torrent_data and torrent_data["handle"].is_valid():
+        info = torrent_data["handle"].torrent_file()
+
+    if info is None:
+        torrent_file_path = app_state.torrent_metadata_cache.get(info_hash_str)
+        if not torrent_file_path or not os.path.exists(torrent_file_path):
+            return None
+        info = await asyncio.to_thread(lt.torrent_info, torrent_file_path)
+
+    app_state.torrent_info_cache.put(info_hash_str, info)
+    return info
+
+def torrent_file_root(info, file_index: int) -> bytes | None:
+    """BitTorrent v2 pieces root of a file, or None for v1-only torrents and for pad or empty files."""
+    if not info.info_hashes().has_v2():
+        return None
+    root = info.files().root(file_index)
+    if root.is_all_zeros():
+        return None
+    return bytes(root.to_bytes())
@@ -0,0 +1,181 @@
+# tracing.py
+import contextvars
+import json
+import os
+import re
+import time
+
+import config
+
+ENABLED = bool(config.TRACE_DIR)
+
+# (info_hash, file_index, lane) of the job the running task works on; file_index None is the torrent itself.
+_current_job = contextvars.ContextVar("trace_job", default=None)
+_traces = {}
+
+# Spans opened by `begin` and closed elsewhere (download, queues, waits) get their own track per file,
+# since they overlap the spans of the work itself.
+LIFECYCLE_LANE = "lifecycle"
+
+def _now_us() -> int:
+    return time.time_ns() // 1000
+
+class _TorrentTrace:
+    def __init__(self, info_hash_str: str):
+        self.name = info_hash_str
+        self.events = []
+        self.tids = {}       # (file_index, lane) -> Chrome trace thread id
+        self.file_names = {} # file index -> file name
+        self.open_spans = {} # (file_index, lane, name) -> start timestamp
+
+    def tid(self, file_index, lane) -> int:
+        key = (file_index, lane)
+        tid = self.tids.get(key)
+        if tid is None:
+            tid = self.tids[key] = len(self.tids) + 1
+        return tid
+
+    def complete(self, file_index, lane, name: str, start_us: int, end_us: int, args: dict | None = None):
+        event = {"name": name, "ph": "X", "ts": start_us, "dur": max(end_us - start_us, 0),
+                 "pid": 1, "tid": self.tid(file_index, lane)}
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    def thread_name(self, file_index, lane) -> str:
+        if file_index is None:
+            label = "torrent"
+        else:
+            label = f"#{file_index} {self.file_names.get(file_index, '')}".rstrip()
+        return f"{label} ({lane})" if lane else label
+
+    def to_json(self) -> dict:
+        end_us = _now_us()
+        for (file_index, lane, name), start_us in self.open_spans.items():
+            self.complete(file_index, lane, name, start_us, end_us, {"unfinished": True})
+        self.open_spans.clear()
+
+        metadata = [{"name": "process_name", "ph": "M", "pid": 1, "args": {"name": self.name}}]
+        # Tracks are listed torrent first, then by file index, each file's lifecycle track above its work.
+        order = sorted(self.tids, key=lambda key: (key[0] is not None, key[0] or 0, key[1] != LIFECYCLE_LANE, key[1] or ""))
+        for sort_index, (file_index, lane) in enumerate(order):
+            tid = self.tids[(file_index, lane)]
+            metadata.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": self.thread_name(file_index, lane)}})
+            metadata.append({"name": "thread_sort_index", "ph": "M", "pid": 1, "tid": tid, "args": {"sort_index": sort_index}})
+        return {"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}
+
+def _trace(info_hash_str: str) -> _TorrentTrace:
+    trace = _traces.get(info_hash_str)
+    if trace is None:
+        trace = _traces[info_hash_str] = _TorrentTrace(info_hash_str)
+    return trace
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _JobScope:
+    def __init__(self, job: tuple):
+        self.job = job
+
+    def __enter__(self):
+        self.token = _current_job.set(self.job)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_job.reset(self.token)
+        return False
+
+class _Span:
+    def __init__(self, job: tuple, name: str):
+        self.job = job
+        self.name = name
+
+    def __enter__(self):
+        self.start_us = _now_us()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        info_hash_str, file_index, lane = self.job
+        args = {"error": exc_type.__name__} if exc_type is not None else None
+        _trace(info_hash_str).complete(file_index, lane, self.name, self.start_us, _now_us(), args)
+        return False
+
+# --- Job context ---
+def job(info_hash_str: str, file_index=None):
+    """`with job(ih, idx):` attributes every span opened in this task (and tasks it starts) to that file."""
+    if not ENABLED:
+        return _NULL_SPAN
+    return _JobScope((info_hash_str, file_index, None))
+
+def lane(name: str):
+    """Moves the current job's spans to a separate track, for work that overlaps the job's own (e.g. extraction)."""
+    current = _current_job.get() if ENABLED else None
+    if current is None:
+        return _NULL_SPAN
+    return _JobScope((current[0], current[1], name))
+
+# --- Spans ---
+def span(name: str):
+    """A span of the current job; a shared no-op when tracing is off or no job is set."""
+    if not ENABLED:
+        return _NULL_SPAN
+    current = _current_job.get()
+    if current is None:
+        return _NULL_SPAN
+    return _Span(current, name)
+
+def begin(info_hash_str: str, file_index, name: str):
+    """Opens a span that is closed elsewhere by `end` (queues, waits). Opening an open span is a no-op."""
+    if not ENABLED:
+        return
+    open_spans = _trace(info_hash_str).open_spans
+    open_spans.setdefault((file_index, LIFECYCLE_LANE, name), _now_us())
+
+def end(info_hash_str: str, file_index, name: str):
+    if not ENABLED:
+        return
+    trace = _traces.get(info_hash_str)
+    if trace is None:
+        return
+    start_us = trace.open_spans.pop((file_index, LIFECYCLE_LANE, name), None)
+    if start_us is not None:
+        trace.complete(file_index, LIFECYCLE_LANE, name, start_us, _now_us())
+
+def name_torrent(info_hash_str: str, name: str):
+    if ENABLED:
+        _trace(info_hash_str).name = name
+
+def name_file(info_hash_str: str, file_index: int, name: str):
+    if ENABLED:
+        _trace(info_hash_str).file_names[file_index] = name
+
+# --- Export ---
+def _trace_path(trace: _TorrentTrace, info_hash_str: str) -> str:
+    safe_name = re.sub(r'[^\w.-]+', '_', trace.name)[:80]
+    return os.path.join(config.TRACE_DIR, f"{safe_name}.{info_hash_str[:12]}.json")
+
+def export(info_hash_str: str) -> str | None:
+    """Writes the torrent's trace (open spans end now) for chrome://tracing or ui.perfetto.dev and forgets it."""
+    trace = _traces.pop(info_hash_str, None)
+    if trace is None or not trace.events and not trace.open_spans:
+        return None
+    path = _trace_path(trace, info_hash_str)
+    try:
+        with open(path + ".tmp", 'w') as f:
+            json.dump(trace.to_json(), f, separators=(',', ':'))
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print(f"Could not write trace for {info_hash_str}: {e}")
+        return None
+    print(f"Trace for '{trace.name}' written to {path}")
+    return path
+
+def export_all():
+    for info_hash_str in list(_traces):
+        export(info_hash_str)
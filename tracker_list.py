@@ -0,0 +1,111 @@
+# tracker_list.py
+import asyncio
+import json
+import os
+import random
+import time
+import aiohttp
+
+import config
+
+HEALTH_SMOOTHING = 0.2 # Weight of the newest announce outcome in a tracker's score
+INITIAL_SCORE = 0.5    # Score of a tracker that has not answered or failed yet
+
+class TrackerRegistry:
+    """
+    Public tracker list with a health score per tracker. The list is cached on disk and
+    refreshed in the background once older than TRACKER_CACHE_TTL, so startup never
+    waits on the network. Scores are moving averages of announce replies (1) and
+    errors (0) reported by libtorrent, and torrents only get the best `k` trackers.
+    """
+    def __init__(self, cache_path: str = config.TRACKER_CACHE_FILE):
+        self.cache_path = cache_path
+        self.trackers: list[str] = []
+        self._known: set[str] = set()
+        self.scores: dict[str, float] = {}
+        self.fetched_at = 0.0
+
+    # --- Disk cache ---
+    def load_cache(self):
+        try:
+            with open(self.cache_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        self.trackers = data.get("trackers", [])
+        self._known = set(self.trackers)
+        self.scores = {url: score for url, score in data.get("scores", {}).items() if url in self._known}
+        self.fetched_at = data.get("fetched_at", 0.0)
+        print(f"Loaded {len(self.trackers)} cached trackers.")
+
+    def _save_cache(self, data: dict):
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.cache_path)
+
+    async def save_cache(self):
+        data = {"fetched_at": self.fetched_at, "trackers": self.trackers, "scores": dict(self.scores)}
+        await asyncio.to_thread(self._save_cache, data)
+
+    @property
+    def is_stale(self) -> bool:
+        return not self.trackers or time.time() - self.fetched_at > config.TRACKER_CACHE_TTL
+
+    # --- Fetching ---
+    @staticmethod
+    async def _fetch_list(http, url: str) -> set[str]:
+        try:
+            async with http.get(url) as response:
+                if response.status != 200:
+                    print(f"Failed to fetch {os.path.basename(url)}. Status: {response.status}")
+                    return set()
+                text = await response.text()
+        except Exception as e:
+            print(f"Error fetching {os.path.basename(url)}: {e}")
+            return set()
+        trackers = {tracker.strip() for tracker in text.split('\n') if tracker.strip()}
+        print(f"Loaded {len(trackers)} trackers from {os.path.basename(url)}")
+        return trackers
+
+    async def refresh(self):
+        """Fetches every list concurrently over one HTTP session; keeps the old list if all fail."""
+        timeout = aiohttp.ClientTimeout(total=config.TRACKER_FETCH_TIMEOUT)
+        async with aiohttp.ClientSession(timeout=timeout) as http:
+            results = await asyncio.gather(*(self._fetch_list(http, url) for url in config.TRACKER_URLS))
+        all_trackers = set().union(*results)
+        if not all_trackers:
+            return
+        self.trackers = sorted(all_trackers)
+        self._known = all_trackers
+        self.scores = {url: score for url, score in self.scores.items() if url in all_trackers}
+        self.fetched_at = time.time()
+        print(f"Successfully loaded a total of {len(self.trackers)} unique trackers.")
+
+    async def run(self):
+        """Background task: refreshes the list when stale and checkpoints health scores."""
+        while True:
+            try:
+                if self.is_stale:
+                    await self.refresh()
+                await self.save_cache()
+            except Exception as e:
+                print(f"Error refreshing tracker list: {e}")
+            await asyncio.sleep(config.TRACKER_SAVE_INTERVAL)
+
+    # --- Health ---
+    def _record(self, url: str, outcome: float):
+        if url in self._known:
+            score = self.scores.get(url, INITIAL_SCORE)
+            self.scores[url] = (1 - HEALTH_SMOOTHING) * score + HEALTH_SMOOTHING * outcome
+
+    def record_reply(self, url: str):
+        self._record(url, 1.0)
+
+    def record_error(self, url: str):
+        self._record(url, 0.0)
+
+    def top(self, k: int) -> list[str]:
+        """The `k` healthiest trackers; untried ones rank in between, in random order, so they still get probed."""
+        ranked = sorted(self.trackers, key=lambda url: (-self.scores.get(url, INITIAL_SCORE), random.random()))
+        return ranked[:k]
@@ -0,0 +1,211 @@
+# transcoder.py
+import asyncio
+import os
+
+import tracing
+
+# --- Transcode plans, cheapest first ---
+PLAN_NONE = "none"      # Already a streamable MP4; upload as-is
+PLAN_REMUX = "remux"    # Streams are fine, only the container/layout is wrong
+PLAN_AUDIO = "audio"    # Copy video, re-encode audio to AAC
+PLAN_ENCODE = "encode"  # Video is not H.264; full libx264 encode
+
+MP4_FORMAT_NAMES = {'mov', 'mp4', 'm4a', '3gp', '3g2', 'mj2'}
+# Only H.264 plays inline on every Telegram client; HEVC, VP9, AV1 and MPEG-4 Part 2 fit in an MP4 but are re-encoded.
+MP4_VIDEO_CODECS = {'h264'}
+MP4_AUDIO_CODECS = {'aac'}
+TEXT_SUBTITLE_CODECS = {'subrip', 'ass', 'ssa', 'mov_text', 'webvtt', 'text'}
+
+def _read_is_faststart(file_path: str) -> bool:
+    """Walks the top-level MP4 boxes and reports whether `moov` comes before `mdat`."""
+    with open(file_path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        offset = 0
+        while offset + 8 <= file_size:
+            f.seek(offset)
+            header = f.read(16)
+            size = int.from_bytes(header[0:4], 'big')
+            box_type = header[4:8]
+            if box_type == b'moov':
+                return True
+            if box_type == b'mdat':
+                return False
+            if size == 1:
+                size = int.from_bytes(header[8:16], 'big')
+            elif size == 0:
+                return False
+            if size < 8:
+                return False
+            offset += size
+    return False
+
+async def is_faststart(file_path: str) -> bool:
+    try:
+        return await asyncio.to_thread(_read_is_faststart, file_path)
+    except OSError:
+        return False
+
+async def plan_transcode(file_path: str, probe: dict | None) -> str:
+    """Picks the cheapest transcode that turns the probed file into a streamable MP4."""
+    if not probe:
+        # Unknown layout; try the old fast path first, full encode remains the fallback.
+        return PLAN_AUDIO
+
+    streams = probe.get('streams', [])
+    video_codecs = {s.get('codec_name') for s in streams if s.get('codec_type') == 'video' and not s.get('disposition', {}).get('attached_pic')}
+    audio_codecs = {s.get('codec_name') for s in streams if s.get('codec_type') == 'audio'}
+
+    if not video_codecs <= MP4_VIDEO_CODECS:
+        return PLAN_ENCODE
+    if not audio_codecs <= MP4_AUDIO_CODECS:
+        return PLAN_AUDIO
+
+    format_names = set(probe.get('format', {}).get('format_name', '').split(','))
+    if format_names & MP4_FORMAT_NAMES and await is_faststart(file_path):
+        return PLAN_NONE
+    return PLAN_REMUX
+
+def _subtitle_args(probe: dict | None) -> list:
+    subtitle_codecs = {s.get('codec_name') for s in (probe or {}).get('streams', []) if s.get('codec_type') == 'subtitle'}
+    if not subtitle_codecs:
+        return []
+    if subtitle_codecs <= TEXT_SUBTITLE_CODECS:
+        return ['-c:s', 'mov_text']
+    # Bitmap subtitles (PGS, VobSub) cannot be stored in MP4 and would fail the whole job.
+    return ['-sn']
+
+def build_ffmpeg_command(plan: str, input_path: str, output_path: str, probe: dict | None, threads: int | None = None) -> list:
+    command = ['ffmpeg', '-nostdin']
+    if plan == PLAN_ENCODE and threads:
+        command += ['-threads', str(threads)] # Decoder threads
+    command += ['-i', input_path, '-y']
+    if plan == PLAN_REMUX:
+        command += ['-c:v', 'copy', '-c:a', 'copy']
+    elif plan == PLAN_AUDIO:
+        command += ['-c:v', 'copy', '-c:a', 'aac']
+    elif plan == PLAN_ENCODE:
+        command += [
+            '-progress', 'pipe:1',
+            '-c:v', 'libx264', '-preset', 'fast', '-crf', '23',
+            '-c:a', 'aac', '-pix_fmt', 'yuv420p',
+        ]
+        if threads:
+            command += ['-threads', str(threads)] # Encoder threads
+    else:
+        raise ValueError(f"No ffmpeg command for plan '{plan}'")
+    command += _subtitle_args(probe)
+    command += ['-movflags', '+faststart', output_path]
+    return command
+
+def segment_count(duration: float, threads_per_job: int, segment_threads: int, min_duration: float) -> int:
+    """How many parallel segments an encode of `duration` seconds should be cut into."""
+    if duration < min_duration or segment_threads <= 0:
+        return 1
+    return max(1, min(threads_per_job // segment_threads, int(duration // (min_duration / 2))))
+
+async def find_segment_cuts(file_path: str, duration: float, segments: int, start_time: float = 0.0) -> list[float]:
+    """
+    Returns the segment start times (seconds from the start of the file, first is 0.0),
+    snapped forward to video keyframes so every segment can be cut without re-decoding.
+    Only packet headers are read, so this is a demux pass, not a decode.
+    """
+    targets = [duration * i / segments for i in range(1, segments)]
+    cuts = [0.0]
+    if not targets:
+        return cuts
+    process = await asyncio.create_subprocess_exec(
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', file_path,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    try:
+        async for line in process.stdout:
+            pts_time, _, flags = line.decode().strip().partition(',')
+            if 'K' not in flags:
+                continue
+            try:
+                keyframe = float(pts_time) - start_time
+            except ValueError:
+                continue
+            if keyframe < targets[0]:
+                continue
+            if keyframe < duration:
+                cuts.append(keyframe)
+            while targets and targets[0] <= keyframe:
+                targets.pop(0)
+            if not targets:
+                break
+    finally:
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+    return cuts
+
+def build_segment_command(input_path: str, output_path: str, start: float, length: float | None, threads: int) -> list:
+    """Video-only libx264 encode of [start, start + length); audio is encoded once, separately."""
+    command = ['ffmpeg', '-nostdin', '-threads', str(threads), '-ss', f"{start:.6f}", '-i', input_path, '-y']
+    if length is not None:
+        command += ['-t', f"{length:.6f}"]
+    command += [
+        '-map', '0:v:0', '-an', '-sn', '-progress', 'pipe:1',
+        '-c:v', 'libx264', '-preset', 'fast', '-crf', '23', '-pix_fmt', 'yuv420p',
+        '-threads', str(threads), output_path,
+    ]
+    return command
+
+def build_audio_command(input_path: str, output_path: str) -> list:
+    return ['ffmpeg', '-nostdin', '-i', input_path, '-y', '-vn', '-sn', '-c:a', 'aac', output_path]
+
+def build_concat_command(list_path: str, audio_path: str | None, source_path: str, output_path: str, probe: dict | None) -> list:
+    """Joins encoded segments (and the audio track) into one faststart MP4 without re-encoding."""
+    command = ['ffmpeg', '-nostdin', '-f', 'concat', '-safe', '0', '-i', list_path]
+    maps = ['-map', '0:v']
+    if audio_path:
+        command += ['-i', audio_path]
+        maps += ['-map', '1:a']
+    subtitle_args = _subtitle_args(probe)
+    if subtitle_args[:1] == ['-c:s']:
+        command += ['-i', source_path]
+        maps += ['-map', f"{2 if audio_path else 1}:s"]
+    command += ['-y'] + maps + ['-c:v', 'copy', '-c:a', 'copy']
+    if subtitle_args[:1] == ['-c:s']:
+        command += subtitle_args
+    command += ['-movflags', '+faststart', output_path]
+    return command
+
+class EncodePool:
+    """
+    Admission control for CPU-bound encodes, separate from the upload workers.
+    At most `max_jobs` encodes run at once and each is capped to its share of
+    `core_budget` threads, optionally at a lower scheduling priority.
+    """
+    def __init__(self, core_budget: int, max_jobs: int, niceness: int = 0):
+        self.max_jobs = max(1, max_jobs)
+        self.threads_per_job = max(1, core_budget // self.max_jobs)
+        self.niceness = niceness
+        self._slots = asyncio.Semaphore(self.max_jobs)
+        self.waiting = 0
+
+    async def __aenter__(self):
+        if not self._slots.locked():
+            await self._slots.acquire()
+            return self
+        self.waiting += 1
+        try:
+            with tracing.span("waiting for encoder"):
+                await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._slots.release()
+
+    def locked(self) -> bool:
+        return self._slots.locked()
+
+    def preexec_fn(self):
+        """Runs in the forked child before exec: lowers the encoder's CPU priority."""
+        if self.niceness and hasattr(os, 'nice'):
+            os.nice(self.niceness)